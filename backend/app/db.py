@@ -1,17 +1,66 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
 from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = "sqlite:///../data/app.db"
 
+# The API threadpool, the scheduler workers/timer and the run executor all
+# write concurrently: WAL lets readers proceed while a run commits, and the
+# busy timeout makes writers wait for the lock instead of failing with
+# "database is locked".
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "20"))
+SQLITE_MAX_OVERFLOW = int(os.environ.get("SQLITE_MAX_OVERFLOW", "20"))
+
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False},
+    connect_args={
+        "check_same_thread": False,
+        "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+    },
+    pool_size=SQLITE_POOL_SIZE,
+    max_overflow=SQLITE_MAX_OVERFLOW,
+    pool_timeout=30,
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _conn_record):
+    cur = dbapi_conn.cursor()
+    try:
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cur.close()
+
+
+def sqlite_settings() -> dict:
+    """Active connection settings, as reported by SQLite itself."""
+    with engine.connect() as conn:
+        def pragma(name: str):
+            return conn.execute(text(f"PRAGMA {name}")).scalar()
+
+        return {
+            "journal_mode": pragma("journal_mode"),
+            "synchronous": {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}.get(pragma("synchronous")),
+            "busy_timeout_ms": pragma("busy_timeout"),
+            "cache_size": pragma("cache_size"),
+            "mmap_size": pragma("mmap_size"),
+            "pool_size": SQLITE_POOL_SIZE,
+            "max_overflow": SQLITE_MAX_OVERFLOW,
+        }
+
+
 def ensure_sqlite_schema_compat():
     """
     Lightweight startup migration for SQLite environments where create_all
@@ -25,12 +74,83 @@ def ensure_sqlite_schema_compat():
         if has_col("campaigns", "id") and not has_col("campaigns", "platform"):
             conn.execute(text("ALTER TABLE campaigns ADD COLUMN platform TEXT NOT NULL DEFAULT 'rubika'"))
 
+        if has_col("campaigns", "id") and not has_col("campaigns", "suppress_days"):
+            conn.execute(text("ALTER TABLE campaigns ADD COLUMN suppress_days INTEGER"))
+
         if has_col("customer_media", "id") and not has_col("customer_media", "platform"):
             conn.execute(text("ALTER TABLE customer_media ADD COLUMN platform TEXT NOT NULL DEFAULT 'rubika'"))
 
         if has_col("customers", "id") and not has_col("customers", "default_splus_token"):
             conn.execute(text("ALTER TABLE customers ADD COLUMN default_splus_token TEXT"))
 
+        if has_col("audience_snapshots", "id"):
+            # ref_count is gone (campaigns are the reference record). Tables
+            # made by create_all have it NOT NULL without a default, which
+            # would reject new uploads; DROP COLUMN needs SQLite 3.35+.
+            if has_col("audience_snapshots", "ref_count"):
+                conn.execute(text("ALTER TABLE audience_snapshots DROP COLUMN ref_count"))
+            if not has_col("audience_snapshots", "meta_json"):
+                conn.execute(text("ALTER TABLE audience_snapshots ADD COLUMN meta_json TEXT"))
+            if not has_col("audience_snapshots", "last_used_at"):
+                conn.execute(text("ALTER TABLE audience_snapshots ADD COLUMN last_used_at TEXT"))
+
+            # Snapshots are content-addressed by hash: fold duplicate uploads
+            # into the oldest one before enforcing uniqueness. The dropped
+            # rows' files are removed later by the snapshot GC.
+            conn.execute(text("""
+                UPDATE campaigns
+                SET audience_snapshot_id = (
+                    SELECT keep.id FROM audience_snapshots keep
+                    WHERE keep.hash = (SELECT s.hash FROM audience_snapshots s WHERE s.id = campaigns.audience_snapshot_id)
+                    ORDER BY keep.created_at, keep.id LIMIT 1
+                )
+                WHERE audience_snapshot_id IN (
+                    SELECT s.id FROM audience_snapshots s
+                    WHERE EXISTS (
+                        SELECT 1 FROM audience_snapshots o
+                        WHERE o.hash = s.hash AND (o.created_at < s.created_at OR (o.created_at = s.created_at AND o.id < s.id))
+                    )
+                )
+            """))
+            conn.execute(text("""
+                DELETE FROM audience_snapshots
+                WHERE EXISTS (
+                    SELECT 1 FROM audience_snapshots o
+                    WHERE o.hash = audience_snapshots.hash
+                      AND (o.created_at < audience_snapshots.created_at
+                           OR (o.created_at = audience_snapshots.created_at AND o.id < audience_snapshots.id))
+                )
+            """))
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ux_audience_snapshots_hash ON audience_snapshots (hash)"
+            ))
+
+        if has_col("runs", "id"):
+            for col in ("is_test", "progress_current", "progress_total", "sent_count", "failed_count"):
+                if not has_col("runs", col):
+                    conn.execute(text(f"ALTER TABLE runs ADD COLUMN {col} INTEGER"))
+            if not has_col("runs", "progress_updated_at"):
+                conn.execute(text("ALTER TABLE runs ADD COLUMN progress_updated_at TEXT"))
+            if not has_col("runs", "status_synced_at"):
+                conn.execute(text("ALTER TABLE runs ADD COLUMN status_synced_at TEXT"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_runs_is_test_started_at ON runs (is_test, started_at)"
+            ))
+
+        if has_col("scheduled_runs", "id"):
+            # Normalize legacy free-form ISO run_at values ("Z" / offsets) to the
+            # sortable UTC key format so due-run lookups can compare in SQL.
+            conn.execute(text(
+                "UPDATE scheduled_runs "
+                "SET run_at = strftime('%Y-%m-%dT%H:%M:%fZ', run_at) "
+                "WHERE strftime('%Y-%m-%dT%H:%M:%fZ', run_at) IS NOT NULL "
+                "AND run_at != strftime('%Y-%m-%dT%H:%M:%fZ', run_at)"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_scheduled_runs_status_run_at "
+                "ON scheduled_runs (status, run_at)"
+            ))
+
 def get_db():
     db = SessionLocal()
     try:
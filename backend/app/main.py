@@ -1,16 +1,34 @@
+import logging
+from threading import Thread
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from .db import Base, engine, ensure_sqlite_schema_compat
+from .db import Base, engine, ensure_sqlite_schema_compat, sqlite_settings
 from .routes import health, customers, audience, campaigns, runs, media_upload, schedule, dashboard
 from .scheduler import start_scheduler
+from .services.events import install_shutdown_hook
+from .services.run_executor import fail_orphaned_runs
+from .services.run_progress import backfill_legacy_runs
 from contextlib import asynccontextmanager
 
 Base.metadata.create_all(bind=engine)
 ensure_sqlite_schema_compat()
 
+logger = logging.getLogger("uvicorn.error")
+
 @asynccontextmanager
 async def lifespan(app):
+    settings = sqlite_settings()
+    logger.info("SQLite settings: %s", settings)
+    if str(settings.get("journal_mode")).lower() != "wal":
+        logger.warning("SQLite is not in WAL mode (journal_mode=%s)", settings.get("journal_mode"))
+    orphaned = fail_orphaned_runs()
+    if orphaned:
+        logger.warning("Marked %d run(s) left queued/running by the previous process as failed", orphaned)
+    # Older runs have no persisted progress yet; scrape their logs once, off the request path.
+    Thread(target=backfill_legacy_runs, name="run-progress-backfill", daemon=True).start()
+    install_shutdown_hook()
     start_scheduler()
     yield
     
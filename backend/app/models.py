@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Text
+from sqlalchemy import Column, Index, String, Integer, Text
 from .db import Base
 
 class Customer(Base):
@@ -38,6 +38,14 @@ class AudienceSnapshot(Base):
     row_count = Column(Integer, nullable=False)
     hash = Column(String, nullable=False)
     created_at = Column(String, nullable=False)
+    # Last upload (or dedup hit) of this content; the GC grace period counts from it.
+    last_used_at = Column(String, nullable=True)
+    # Upload response extras (columns, notes, preview) returned on dedup hits.
+    meta_json = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ux_audience_snapshots_hash", "hash", unique=True),
+    )
 
 class Campaign(Base):
     __tablename__ = "campaigns"
@@ -51,6 +59,8 @@ class Campaign(Base):
     test_number = Column(String, nullable=True)
     status = Column(String, nullable=False)
     created_at = Column(String, nullable=False)
+    # Skip numbers this customer messaged in the last N days (None/0 = off).
+    suppress_days = Column(Integer, nullable=True)
 
 class Schedule(Base):
     __tablename__ = "schedules"
@@ -71,13 +81,44 @@ class Run(Base):
     artifacts_path = Column(String, nullable=True)
     result_json = Column(Text, nullable=True)
 
+    # Published by the runners while they send (see services/run_progress.py),
+    # so the dashboard never has to scrape logs.
+    is_test = Column(Integer, nullable=True)
+    progress_current = Column(Integer, nullable=True)
+    progress_total = Column(Integer, nullable=True)
+    sent_count = Column(Integer, nullable=True)
+    failed_count = Column(Integer, nullable=True)
+    progress_updated_at = Column(String, nullable=True)
+    # Set once the run's message ids were loaded into message_status.
+    status_synced_at = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_runs_is_test_started_at", "is_test", "started_at"),
+    )
+
+
+class MessageStatus(Base):
+    """Latest delivery status per sent Rubika message (services/status_refresh.py)."""
+    __tablename__ = "message_status"
+    run_id = Column(String, primary_key=True)
+    message_id = Column(String, primary_key=True)
+    phone_number = Column(String, nullable=True)
+    status = Column(String, nullable=True)
+    status_at_send = Column(String, nullable=True)
+    updated_at = Column(String, nullable=True)   # last status change
+    checked_at = Column(String, nullable=True)   # last getMessagesStatus poll
+
+    __table_args__ = (
+        Index("ix_message_status_run_status", "run_id", "status"),
+    )
+
 
 class ScheduledRun(Base):
     __tablename__ = "scheduled_runs"
 
     id = Column(String, primary_key=True)
     campaign_id = Column(String, nullable=False, index=True)
-    run_at = Column(String, nullable=False, index=True)
+    run_at = Column(String, nullable=False, index=True)  # normalized UTC key, see scheduler.to_utc_key
     status = Column(String, nullable=False, default="scheduled")  # scheduled|waiting_token|running|success|failed|canceled
     customer_name = Column(String, nullable=True, index=True)
     campaign_name = Column(String, nullable=True, index=True)
@@ -87,3 +128,7 @@ class ScheduledRun(Base):
 
     # link to last Run id
     last_run_id = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_scheduled_runs_status_run_at", "status", "run_at"),
+    )
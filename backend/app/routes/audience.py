@@ -3,37 +3,76 @@ import json
 import uuid
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import BinaryIO
 
-import pandas as pd
 from fastapi import APIRouter, Depends, File, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from ..db import get_db
 from ..models import AudienceSnapshot
+from ..services.snapshot_cache import ingest_audience_file, legacy_snapshot_meta
 from ..services.storage import new_snapshot_path
-from ..services.validation import validate_and_clean
 
 router = APIRouter()
 
 def now_iso():
     return datetime.now(timezone.utc).isoformat()
 
-def sha256_bytes(b: bytes) -> str:
-    return hashlib.sha256(b).hexdigest()
+# Uploads are copied to disk in chunks of this size while being hashed.
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+def copy_and_hash(src: BinaryIO, dest: Path) -> tuple[str, int]:
+    """Copy src to dest in chunks. Returns (sha256 hex, size in bytes)."""
+    h = hashlib.sha256()
+    size = 0
+    with open(dest, "wb") as out:
+        while True:
+            chunk = src.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            h.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    return h.hexdigest(), size
+
+async def save_upload(file: UploadFile, dest: Path) -> tuple[str, int]:
+    """Stream the upload to dest. Returns (sha256 hex, size in bytes)."""
+    # Blocking file I/O and hashing; keep it off the event loop.
+    await file.seek(0)
+    return await run_in_threadpool(copy_and_hash, file.file, dest)
+
+def touch_snapshot(db: Session, snap: AudienceSnapshot) -> AudienceSnapshot:
+    """A dedup hit counts as a fresh upload: restart the snapshot's GC grace period."""
+    snap.last_used_at = now_iso()
+    db.commit()
+    return snap
 
-def read_file_to_df(path: Path) -> pd.DataFrame:
-    ext = path.suffix.lower()
-    if ext == ".csv":
-        return pd.read_csv(path)
-    if ext in (".xlsx", ".xls"):
-        return pd.read_excel(path)
-    raise ValueError(f"Unsupported file type: {ext}")
+def snapshot_response(snap: AudienceSnapshot, *, deduplicated: bool = False) -> dict:
+    meta = json.loads(snap.meta_json) if snap.meta_json else legacy_snapshot_meta(snap)
+    return {
+        "snapshot_id": snap.id,
+        "original_filename": snap.original_filename,
+        "stored_path": snap.stored_path,
+        "row_count": snap.row_count,
+        "hash": snap.hash,
+        "columns": meta.get("columns", []),
+        "preview": meta.get("preview", []),
+        "notes": meta.get("notes", []),
+        "deduplicated": deduplicated,
+    }
 
 @router.post("/audience/upload")
 async def upload_audience(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
 ):
+    """
+    Snapshots are content-addressed: uploading a file whose sha256 matches an
+    existing snapshot returns that snapshot (deduplicated=true) without
+    keeping the new copy or validating it again.
+    """
     if not file.filename:
         raise HTTPException(status_code=400, detail="No filename provided")
 
@@ -41,47 +80,57 @@ async def upload_audience(
     if ext not in (".csv", ".xlsx", ".xls"):
         raise HTTPException(status_code=400, detail="Only .csv, .xlsx, .xls are supported")
 
-    raw = await file.read()
-    if not raw:
+    stored_path = new_snapshot_path(file.filename)
+    h, size = await save_upload(file, stored_path)
+    if size == 0:
+        stored_path.unlink(missing_ok=True)
         raise HTTPException(status_code=400, detail="Empty file")
 
-    stored_path = new_snapshot_path(file.filename)
-    stored_path.write_bytes(raw)
+    existing = db.query(AudienceSnapshot).filter(AudienceSnapshot.hash == h).first()
+    if existing:
+        stored_path.unlink(missing_ok=True)
+        return snapshot_response(touch_snapshot(db, existing), deduplicated=True)
 
+    # Validates chunk by chunk and writes the runners' cache on the way
+    # (services/snapshot_cache.py); parsing is CPU-bound, keep it off the loop.
     try:
-        df = read_file_to_df(stored_path)
+        result = await run_in_threadpool(ingest_audience_file, stored_path, h)
     except Exception as e:
+        stored_path.unlink(missing_ok=True)
         raise HTTPException(status_code=400, detail=f"Failed to read file: {e}")
 
-    df, notes = validate_and_clean(df)
-    if df.empty:
+    notes = result.notes()
+    if result.missing:
+        stored_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail=notes[0])
+    if result.rows_out == 0:
+        stored_path.unlink(missing_ok=True)
         raise HTTPException(status_code=400, detail="No valid rows found. Check columns and values.")
 
-    row_count = int(len(df))
-    h = sha256_bytes(raw)
-
-    sid = str(uuid.uuid4())
     snap = AudienceSnapshot(
-        id=sid,
+        id=str(uuid.uuid4()),
         original_filename=file.filename,
         stored_path=str(stored_path),
-        row_count=row_count,
+        row_count=int(result.rows_out),
         hash=h,
         created_at=now_iso(),
+        last_used_at=now_iso(),
+        meta_json=json.dumps(
+            {"columns": result.columns, "notes": notes, "preview": result.preview},
+            ensure_ascii=False,
+            default=str,
+        ),
     )
     db.add(snap)
-    db.commit()
-
-    preview = df.head(10).to_dict(orient="records")
-    cols = list(df.columns)
-
-    return {
-        "snapshot_id": sid,
-        "original_filename": file.filename,
-        "stored_path": str(stored_path),
-        "row_count": row_count,
-        "hash": h,
-        "columns": cols,
-        "preview": preview,
-        "notes": notes,
-    }
+    try:
+        db.commit()
+    except IntegrityError:
+        # The same file finished uploading concurrently; keep the first one.
+        db.rollback()
+        stored_path.unlink(missing_ok=True)
+        existing = db.query(AudienceSnapshot).filter(AudienceSnapshot.hash == h).first()
+        if not existing:
+            raise
+        return snapshot_response(touch_snapshot(db, existing), deduplicated=True)
+
+    return snapshot_response(snap)
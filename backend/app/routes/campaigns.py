@@ -1,14 +1,15 @@
 import uuid
 from datetime import datetime, timezone
-import json
 from pathlib import Path
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from ..db import get_db
 from ..models import Campaign, Run, Customer, AudienceSnapshot
-from ..runners.rscript_runner import run_r_campaign
-from ..runners.splus_runner import run_splus_campaign
+from ..services.campaign_jobs import campaign_job
+from ..services.run_executor import submit_run
+from ..services.run_progress import publish_run_update
+from ..services.status_refresh import remember_run_token
 
 router = APIRouter()
 PROJECT_ROOT = Path(__file__).resolve().parents[3]
@@ -43,6 +44,7 @@ def list_campaigns(db: Session = Depends(get_db)):
         "customer_id": r.customer_id,
         "audience_snapshot_id": r.audience_snapshot_id,
         "selected_file_id": r.selected_file_id,
+        "suppress_days": r.suppress_days,
         "status": r.status,
         "created_at": r.created_at,
     } for r in rows]
@@ -57,6 +59,7 @@ def create_campaign(payload: dict, db: Session = Depends(get_db)):
     selected_file_id = payload.get("selected_file_id")
     test_number = payload.get("test_number")
     platform = normalize_platform(payload.get("platform"))
+    suppress_days = payload.get("suppress_days")
 
     if not customer_id:
         raise HTTPException(status_code=400, detail="customer_id is required")
@@ -64,6 +67,15 @@ def create_campaign(payload: dict, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="audience_snapshot_id is required")
     if not message_text or not str(message_text).strip():
         raise HTTPException(status_code=400, detail="message_text is required")
+    if suppress_days in ("", None):
+        suppress_days = None
+    else:
+        try:
+            suppress_days = int(suppress_days)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="suppress_days must be an integer")
+        if suppress_days < 0:
+            raise HTTPException(status_code=400, detail="suppress_days must be >= 0")
 
     # ensure customer exists
     if not db.query(Customer).filter(Customer.id == customer_id).first():
@@ -83,6 +95,7 @@ def create_campaign(payload: dict, db: Session = Depends(get_db)):
         selected_file_id=selected_file_id,
         message_text=str(message_text),
         test_number=str(test_number) if test_number else None,
+        suppress_days=suppress_days or None,
         status="draft",
         created_at=now_iso(),
     )
@@ -105,23 +118,13 @@ def get_campaign(campaign_id: str, db: Session = Depends(get_db)):
         "selected_file_id": c.selected_file_id,
         "message_text": c.message_text,
         "test_number": c.test_number,
+        "suppress_days": c.suppress_days,
         "status": c.status,
         "created_at": c.created_at,
     }
 
 
-@router.post("/campaigns/{campaign_id}/send-test")
-def send_test(campaign_id: str, payload: dict, db: Session = Depends(get_db)):
-    token = payload.get("token")
-    test_number = payload.get("test_number")
-
-    if not token or not str(token).strip():
-        raise HTTPException(status_code=400, detail="token is required")
-
-    c = db.query(Campaign).filter(Campaign.id == campaign_id).first()
-    if not c:
-        raise HTTPException(status_code=404, detail="campaign not found")
-
+def enqueue_campaign_run(db: Session, c: Campaign, token: str, *, mode: str, test_number: str | None = None) -> dict:
     cust = db.query(Customer).filter(Customer.id == c.customer_id).first()
     snap = db.query(AudienceSnapshot).filter(AudienceSnapshot.id == c.audience_snapshot_id).first()
     if not cust or not snap:
@@ -132,60 +135,45 @@ def send_test(campaign_id: str, payload: dict, db: Session = Depends(get_db)):
     r = Run(
         id=rid,
         campaign_id=c.id,
-        status="running",
+        status="queued",
         started_at=now_iso(),
         finished_at=None,
         log_path=log_path,
         artifacts_path=run_dir,
         result_json=None,
+        is_test=1 if mode == "test" else 0,
+        progress_current=0,
+        progress_total=1 if mode == "test" else snap.row_count,
     )
     db.add(r)
     db.commit()
+    publish_run_update(rid)
+    if c.platform == "rubika" and mode == "send":
+        remember_run_token(rid, token)
 
-    try:
-        if c.platform == "splus":
-            out = run_splus_campaign(
-                mode="test",
-                splus_bot_id=str(token),
-                snapshot_path=snap.stored_path,
-                file_id=c.selected_file_id,
-                message_text=c.message_text,
-                test_number=str(test_number) if test_number else (c.test_number or "989024004940"),
-                run_id=rid,
-                scenario_name=c.name or c.id,
-            )
-        else:
-            out = run_r_campaign(
-                mode="test",
-                rubica_token=str(token),
-                snapshot_path=snap.stored_path,
-                service_id=cust.service_id,
-                file_id=c.selected_file_id,
-                message_text=c.message_text,
-                test_number=str(test_number) if test_number else (c.test_number or "989024004940"),
-                run_id=rid,
-            )
+    submit_run(rid, campaign_job(c, cust, snap, mode=mode, token=token, run_id=rid, test_number=test_number))
+    return {"run_id": rid, "status": r.status, "log_url": f"/api/runs/{rid}/log"}
 
-        r.log_path = out["log_path"]
-        r.artifacts_path = out["run_dir"]
-        r.finished_at = now_iso()
 
-        if out["returncode"] == 0:
-            r.status = "success"
-            r.result_json = json.dumps({"ok": True}, ensure_ascii=False)
-        else:
-            r.status = "failed"
-            r.result_json = json.dumps({"ok": False, "returncode": out["returncode"]}, ensure_ascii=False)
+@router.post("/campaigns/{campaign_id}/send-test")
+def send_test(campaign_id: str, payload: dict, db: Session = Depends(get_db)):
+    token = payload.get("token")
+    test_number = payload.get("test_number")
 
-        db.commit()
-        return {"run_id": rid, "status": r.status, "log_url": f"/api/runs/{rid}/log"}
+    if not token or not str(token).strip():
+        raise HTTPException(status_code=400, detail="token is required")
 
-    except Exception as e:
-        r.status = "failed"
-        r.finished_at = now_iso()
-        r.result_json = json.dumps({"ok": False, "error": str(e)}, ensure_ascii=False)
-        db.commit()
-        raise HTTPException(status_code=500, detail=str(e))
+    c = db.query(Campaign).filter(Campaign.id == campaign_id).first()
+    if not c:
+        raise HTTPException(status_code=404, detail="campaign not found")
+
+    return enqueue_campaign_run(
+        db,
+        c,
+        str(token),
+        mode="test",
+        test_number=str(test_number) if test_number else (c.test_number or "989024004940"),
+    )
 
 
 @router.post("/campaigns/{campaign_id}/run-now")
@@ -198,67 +186,4 @@ def run_now(campaign_id: str, payload: dict, db: Session = Depends(get_db)):
     if not c:
         raise HTTPException(status_code=404, detail="campaign not found")
 
-    cust = db.query(Customer).filter(Customer.id == c.customer_id).first()
-    snap = db.query(AudienceSnapshot).filter(AudienceSnapshot.id == c.audience_snapshot_id).first()
-    if not cust or not snap:
-        raise HTTPException(status_code=400, detail="campaign missing customer or snapshot")
-
-    rid = str(uuid.uuid4())
-    run_dir, log_path = prepare_run_paths(rid)
-    r = Run(
-        id=rid,
-        campaign_id=c.id,
-        status="running",
-        started_at=now_iso(),
-        finished_at=None,
-        log_path=log_path,
-        artifacts_path=run_dir,
-        result_json=None,
-    )
-    db.add(r)
-    db.commit()
-
-    try:
-        if c.platform == "splus":
-            out = run_splus_campaign(
-                mode="send",
-                splus_bot_id=str(token),
-                snapshot_path=snap.stored_path,
-                file_id=c.selected_file_id,
-                message_text=c.message_text,
-                test_number=None,
-                run_id=rid,
-                scenario_name=c.name or c.id,
-            )
-        else:
-            out = run_r_campaign(
-                mode="send",
-                rubica_token=str(token),
-                snapshot_path=snap.stored_path,
-                service_id=cust.service_id,
-                file_id=c.selected_file_id,
-                message_text=c.message_text,
-                test_number=None,
-                run_id=rid,
-            )
-
-        r.log_path = out["log_path"]
-        r.artifacts_path = out["run_dir"]
-        r.finished_at = now_iso()
-
-        if out["returncode"] == 0:
-            r.status = "success"
-            r.result_json = json.dumps({"ok": True}, ensure_ascii=False)
-        else:
-            r.status = "failed"
-            r.result_json = json.dumps({"ok": False, "returncode": out["returncode"]}, ensure_ascii=False)
-
-        db.commit()
-        return {"run_id": rid, "status": r.status, "log_url": f"/api/runs/{rid}/log"}
-
-    except Exception as e:
-        r.status = "failed"
-        r.finished_at = now_iso()
-        r.result_json = json.dumps({"ok": False, "error": str(e)}, ensure_ascii=False)
-        db.commit()
-        raise HTTPException(status_code=500, detail=str(e))
+    return enqueue_campaign_run(db, c, str(token), mode="send")
@@ -1,7 +1,13 @@
 from fastapi import APIRouter
 
+from ..db import sqlite_settings
+
 router = APIRouter()
 
 @router.get("/health")
 def health():
     return {"ok": True}
+
+@router.get("/health/db")
+def health_db():
+    return {"ok": True, "sqlite": sqlite_settings()}
@@ -7,7 +7,7 @@ from sqlalchemy.orm import Session
 
 from ..db import get_db
 from ..models import Customer, CustomerMedia
-from ..runners.rscript_runner import run_r_upload_media
+from ..runners.rubika_runner import rubika_upload_runner
 from ..runners.splus_runner import run_splus_upload_media
 
 PROJECT_ROOT = Path(__file__).resolve().parents[3]
@@ -62,7 +62,7 @@ async def upload_customer_media(
             run_id=run_id,
         )
     else:
-        out = run_r_upload_media(
+        out = rubika_upload_runner()(
             rubica_token=token.strip(),
             media_path=str(local_path),
             media_type=file_type,
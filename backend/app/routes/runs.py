@@ -1,13 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-from ..db import get_db
-from ..models import Run
-from fastapi.responses import FileResponse
+from ..db import get_db, SessionLocal
+from ..models import Run, Campaign, Customer, AudienceSnapshot
+from ..services.campaign_jobs import campaign_job
+from ..services.events import broker
+from ..services.run_executor import is_run_active, release_run, reserve_run, submit_run
+from ..services.run_progress import publish_run_update
+from ..services.status_refresh import refresh_run_in_background, remember_run_token, status_summary
+from fastapi.responses import FileResponse, StreamingResponse
+import asyncio
+import json
 import os
+import time
 
 
 router = APIRouter()
 
+# Live log streaming: how often the file is checked for new bytes, the
+# largest chunk pushed per event, and the keep-alive interval.
+LOG_STREAM_POLL_SEC = float(os.environ.get("LOG_STREAM_POLL_SEC", "0.5"))
+LOG_STREAM_CHUNK_BYTES = int(os.environ.get("LOG_STREAM_CHUNK_BYTES", str(64 * 1024)))
+LOG_STREAM_HEARTBEAT_SEC = 15.0
+LOG_READ_MAX_BYTES = 1024 * 1024
+
 @router.get("/runs")
 def list_runs(db: Session = Depends(get_db)):
     rows = db.query(Run).order_by(Run.started_at.desc()).limit(200).all()
@@ -80,13 +95,210 @@ def get_run(run_id: str, db: Session = Depends(get_db)):
         "result_json": r.result_json,
     }
 
+def read_log_chunk(path: str, offset: int, max_bytes: int, final: bool = False) -> tuple[str, int]:
+    """
+    Read up to max_bytes from offset, cut back to the last complete line so a
+    line (or a UTF-8 sequence) is never split across reads. With final=True
+    a trailing partial line is returned too. Returns (text, next_offset).
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(max_bytes)
+    if not data:
+        return "", offset
+    if not final or len(data) == max_bytes:
+        cut = data.rfind(b"\n")
+        if cut < 0:
+            # A single line longer than max_bytes: pass it through as is.
+            if len(data) < max_bytes:
+                return "", offset
+            cut = len(data) - 1
+        data = data[: cut + 1]
+    return data.decode("utf-8", errors="replace"), offset + len(data)
+
+
 @router.get("/runs/{run_id}/log")
-def get_run_log(run_id: str, db: Session = Depends(get_db)):
+def get_run_log(run_id: str, offset: int | None = None, db: Session = Depends(get_db)):
+    """
+    Without offset: the whole log, as before. With offset: only the bytes
+    after it (up to 1 MB of complete lines) plus next_offset for the next call.
+    """
     r = db.query(Run).filter(Run.id == run_id).first()
     if not r or not r.log_path:
         raise HTTPException(status_code=404, detail="log not found")
     try:
-        with open(r.log_path, "r", encoding="utf-8", errors="replace") as f:
-            return {"log": f.read()}
+        if offset is None:
+            with open(r.log_path, "r", encoding="utf-8", errors="replace") as f:
+                return {"log": f.read()}
+
+        size = os.path.getsize(r.log_path)
+        if offset < 0 or offset > size:
+            offset = 0
+        text, next_offset = read_log_chunk(
+            r.log_path, offset, LOG_READ_MAX_BYTES, final=r.status not in ("queued", "running")
+        )
+        return {"log": text, "offset": offset, "next_offset": next_offset, "size": size}
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="log file missing")
+
+
+def _run_state(run_id: str) -> tuple[str | None, str | None]:
+    db = SessionLocal()
+    try:
+        r = db.query(Run.status, Run.log_path).filter(Run.id == run_id).first()
+        return (r.status, r.log_path) if r else (None, None)
+    finally:
+        db.close()
+
+
+def _sse(event: str, data: dict, event_id: int | None = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.get("/runs/{run_id}/log/stream")
+async def stream_run_log(run_id: str, request: Request, offset: int = 0):
+    """
+    Server-sent events following run.log from a byte offset.
+
+    Events: "log" {text, offset} with id = next byte offset (so a reconnecting
+    EventSource resumes via Last-Event-ID), "reset" when the file shrank
+    below the offset, and "end" {status} once the run finished and the whole
+    file was sent.
+    """
+    status, log_path = await asyncio.to_thread(_run_state, run_id)
+    if status is None or not log_path:
+        raise HTTPException(status_code=404, detail="log not found")
+
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        offset = int(last_event_id)
+    offset = max(0, offset)
+
+    async def events():
+        nonlocal offset, status
+        yield "retry: 3000\n\n"
+        last_sent = time.monotonic()
+        while True:
+            if broker.closed or await request.is_disconnected():
+                return
+
+            finished = status not in ("queued", "running")
+            try:
+                size = os.path.getsize(log_path)
+            except OSError:
+                size = 0
+            if size < offset:
+                offset = 0
+                yield _sse("reset", {"offset": 0}, 0)
+
+            while offset < size:
+                text, next_offset = read_log_chunk(log_path, offset, LOG_STREAM_CHUNK_BYTES, final=finished)
+                if next_offset == offset:
+                    break
+                offset = next_offset
+                yield _sse("log", {"text": text, "offset": offset}, offset)
+                last_sent = time.monotonic()
+
+            if finished:
+                yield _sse("end", {"status": status, "offset": offset}, offset)
+                return
+
+            if time.monotonic() - last_sent >= LOG_STREAM_HEARTBEAT_SEC:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+
+            await asyncio.sleep(LOG_STREAM_POLL_SEC)
+            # Re-read the status after sleeping: lines written before the run
+            # finished are flushed on the next pass before "end" is sent.
+            status, _ = await asyncio.to_thread(_run_state, run_id)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/runs/{run_id}/resume")
+def resume_run(run_id: str, payload: dict, db: Session = Depends(get_db)):
+    """
+    Re-run an interrupted send into the same run directory. Rows already
+    logged as sent are skipped (SPlus: phone+link keys, Rubika: R --resume).
+    """
+    token = payload.get("token")
+    if not token or not str(token).strip():
+        raise HTTPException(status_code=400, detail="token is required")
+
+    r = db.query(Run).filter(Run.id == run_id).first()
+    if not r:
+        raise HTTPException(status_code=404, detail="run not found")
+    if r.status == "success":
+        raise HTTPException(status_code=409, detail="run already completed")
+    if r.is_test:
+        # Resuming always sends to the whole audience; start a new test instead.
+        raise HTTPException(status_code=409, detail="test runs cannot be resumed")
+    if not r.artifacts_path or not os.path.isdir(r.artifacts_path):
+        raise HTTPException(status_code=409, detail="run has no log directory to resume from")
+    if is_run_active(run_id):
+        raise HTTPException(status_code=409, detail="run is still executing")
+
+    c = db.query(Campaign).filter(Campaign.id == r.campaign_id).first()
+    if not c:
+        raise HTTPException(status_code=404, detail="campaign not found")
+
+    cust = db.query(Customer).filter(Customer.id == c.customer_id).first()
+    snap = db.query(AudienceSnapshot).filter(AudienceSnapshot.id == c.audience_snapshot_id).first()
+    if not cust or not snap:
+        raise HTTPException(status_code=400, detail="campaign missing customer or snapshot")
+
+    # Claim the run first: a concurrent resume is refused before this one
+    # touches the row.
+    if not reserve_run(run_id):
+        raise HTTPException(status_code=409, detail="run is still executing")
+    try:
+        r.status = "queued"
+        r.finished_at = None
+        r.result_json = None
+        # The resumed send appends message ids; load them again once it finishes.
+        r.status_synced_at = None
+        db.commit()
+        job = campaign_job(c, cust, snap, mode="send", token=str(token), run_id=run_id, resume=True)
+    except Exception:
+        release_run(run_id)
+        raise
+    if c.platform == "rubika":
+        remember_run_token(run_id, str(token))
+    submit_run(run_id, job, reserved=True)
+    publish_run_update(run_id)
+    return {"run_id": run_id, "status": r.status, "log_url": f"/api/runs/{run_id}/log"}
+
+
+@router.post("/runs/{run_id}/refresh-status")
+def refresh_run_status(run_id: str, payload: dict, db: Session = Depends(get_db)):
+    """
+    Poll Rubika for the delivery status of the run's messages that are not
+    final yet. Runs in the background; read the result from message-status.
+    """
+    r = db.query(Run).filter(Run.id == run_id).first()
+    if not r:
+        raise HTTPException(status_code=404, detail="run not found")
+    c = db.query(Campaign).filter(Campaign.id == r.campaign_id).first()
+    if not c or c.platform != "rubika":
+        raise HTTPException(status_code=400, detail="delivery status is only available for Rubika runs")
+    if r.is_test or r.status not in ("success", "failed"):
+        raise HTTPException(status_code=409, detail="run is not a finished send")
+
+    token = payload.get("token")
+    if token and str(token).strip():
+        remember_run_token(run_id, str(token))
+    started = refresh_run_in_background(run_id, str(token) if token else None)
+    return {"run_id": run_id, "started": started}
+
+
+@router.get("/runs/{run_id}/message-status")
+def get_run_message_status(run_id: str, db: Session = Depends(get_db)):
+    r = db.query(Run).filter(Run.id == run_id).first()
+    if not r:
+        raise HTTPException(status_code=404, detail="run not found")
+    return {**status_summary(db, run_id), "synced_at": r.status_synced_at}
@@ -6,6 +6,7 @@ from sqlalchemy.orm import Session
 
 from ..db import get_db
 from ..models import ScheduledRun, Campaign, Customer
+from ..scheduler import notify_schedule_changed, to_utc_key
 
 router = APIRouter()
 
@@ -33,6 +34,10 @@ def schedule_campaign(campaign_id: str, payload: dict, db: Session = Depends(get
     run_at = payload.get("run_at")  # ISO UTC string
     if not run_at:
         raise HTTPException(status_code=400, detail="run_at is required (ISO UTC string)")
+    try:
+        run_at = to_utc_key(str(run_at))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="run_at must be an ISO datetime string")
 
     token = payload.get("token")
     if not token or not str(token).strip():
@@ -61,6 +66,7 @@ def schedule_campaign(campaign_id: str, payload: dict, db: Session = Depends(get
     )
     db.add(sr)
     db.commit()
+    notify_schedule_changed(sid, sr.run_at)
 
     return {"scheduled_run_id": sid, "status": sr.status}
 
@@ -74,11 +80,12 @@ def run_scheduled_now_with_token(scheduled_run_id: str, payload: dict, db: Sessi
     if not sr:
         raise HTTPException(status_code=404, detail="scheduled run not found")
 
-    # set token temporarily (in DB) and mark scheduled (processor will pick it up quickly)
+    # set token temporarily (in DB) and mark scheduled (the timer is woken right away)
     sr.token_plain = str(token).strip()
     sr.status = "scheduled"
     sr.updated_at = now_iso()
     db.commit()
+    notify_schedule_changed(sr.id, sr.run_at)
 
     return {"ok": True, "message": "Token saved for this scheduled run; it will execute shortly."}
 
@@ -93,4 +100,5 @@ def cancel_scheduled_run(scheduled_run_id: str, db: Session = Depends(get_db)):
     sr.status = "canceled"
     sr.updated_at = now_iso()
     db.commit()
+    notify_schedule_changed()
     return {"ok": True, "status": sr.status}
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parents[3]
+TUNING_DIR = PROJECT_ROOT / "data" / "send_tuning"
+
+# Bounds for the adaptive sendBulkMessages batch size and parallelism.
+RUBIKA_MIN_BATCH_SIZE = int(os.environ.get("RUBIKA_MIN_BATCH_SIZE", "50"))
+RUBIKA_MAX_BATCH_SIZE = int(os.environ.get("RUBIKA_MAX_BATCH_SIZE", "1000"))
+RUBIKA_MAX_SEND_WORKERS = int(os.environ.get("RUBIKA_MAX_SEND_WORKERS", "10"))
+# A batch slower than this counts as a warning sign: the batch shrinks.
+RUBIKA_TARGET_BATCH_SEC = float(os.environ.get("RUBIKA_TARGET_BATCH_SEC", "15"))
+# "0" keeps batch size and workers fixed for the whole run.
+RUBIKA_ADAPTIVE_BATCHING = os.environ.get("RUBIKA_ADAPTIVE_BATCHING", "1").strip().lower() not in ("0", "false", "no")
+
+# Batch size grows by this factor after a window of fast, clean batches.
+GROWTH_FACTOR = 1.25
+# A batch slower than the target shrinks the batch size by this factor.
+SLOW_FACTOR = 0.8
+
+
+class BatchTuner:
+    """
+    AIMD controller for batch size and parallelism, in the spirit of
+    TokenBucket: a timed-out / throttled batch halves the batch size and
+    drops one worker; slow batches shrink it gently; a full window of fast,
+    clean batches grows it, and once the batch size is at its maximum adds
+    a worker. Only batches sent at (or above) the current size move it, so
+    a burst of failures already in flight counts once.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        workers: int,
+        *,
+        min_batch: int = RUBIKA_MIN_BATCH_SIZE,
+        max_batch: int = RUBIKA_MAX_BATCH_SIZE,
+        max_workers: int = RUBIKA_MAX_SEND_WORKERS,
+        target_sec: float = RUBIKA_TARGET_BATCH_SEC,
+        adaptive: bool = RUBIKA_ADAPTIVE_BATCHING,
+    ):
+        self._lock = threading.Lock()
+        self.min_batch = max(1, min(min_batch, max_batch))
+        self.max_batch = max(self.min_batch, max_batch)
+        # Explicitly requested parallelism above the cap is honoured.
+        self.max_workers = max(1, max_workers, int(workers))
+        self.target_sec = target_sec
+        self.adaptive = adaptive
+        self.batch_size = min(max(int(batch_size), self.min_batch), self.max_batch)
+        self.workers = min(max(int(workers), 1), self.max_workers)
+        self.last_good: Optional[tuple[int, int]] = None
+        self._streak = 0
+        self.batches = 0
+        self.failures = 0
+
+    def record(self, size: int, elapsed_sec: float, failed: bool):
+        """Feed back one finished batch: its size, send latency and whether it needs a retry."""
+        with self._lock:
+            self.batches += 1
+            if failed:
+                self.failures += 1
+                self._streak = 0
+                if self.adaptive and size >= self.batch_size:
+                    self.batch_size = max(self.min_batch, self.batch_size // 2)
+                    self.workers = max(1, self.workers - 1)
+                return
+
+            if size < self.batch_size:
+                # A smaller batch (a retry round, the tail of the audience)
+                # says nothing about the current setting.
+                return
+            self.last_good = (self.batch_size, self.workers)
+            if not self.adaptive:
+                return
+            if elapsed_sec > self.target_sec:
+                self._streak = 0
+                self.batch_size = max(self.min_batch, int(self.batch_size * SLOW_FACTOR))
+                return
+            if elapsed_sec > self.target_sec / 2:
+                return  # close to the target: hold
+
+            self._streak += 1
+            if self._streak < self.workers:
+                return
+            self._streak = 0
+            if self.batch_size < self.max_batch:
+                self.batch_size = min(self.max_batch, int(self.batch_size * GROWTH_FACTOR) + 1)
+            elif self.workers < self.max_workers:
+                self.workers += 1
+
+    def settings(self) -> dict[str, Any]:
+        with self._lock:
+            batch_size, workers = self.last_good or (self.batch_size, self.workers)
+            return {
+                "batch_size": batch_size,
+                "workers": workers,
+                "final_batch_size": self.batch_size,
+                "final_workers": self.workers,
+                "batches": self.batches,
+                "failures": self.failures,
+            }
+
+
+def tuning_path(platform: str, service_id: str) -> Path:
+    # Keyed by a hash so any service id is a safe file name.
+    digest = hashlib.sha256(str(service_id).strip().encode("utf-8")).hexdigest()[:16]
+    return TUNING_DIR / f"{platform}_{digest}.json"
+
+
+def load_tuning(platform: str, service_id: str) -> Optional[dict[str, Any]]:
+    """Last good batch_size / workers recorded for this service, if any."""
+    p = tuning_path(platform, service_id)
+    if not p.exists():
+        return None
+    try:
+        obj = json.loads(p.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(obj, dict) or "batch_size" not in obj or "workers" not in obj:
+        return None
+    return obj
+
+
+def save_tuning(platform: str, service_id: str, settings: dict[str, Any], run_id: str):
+    """Record a run's last good settings; later runs for the service start from them."""
+    p = tuning_path(platform, service_id)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    obj = {
+        "batch_size": int(settings["batch_size"]),
+        "workers": int(settings["workers"]),
+        "run_id": run_id,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    tmp = p.with_name(p.name + ".tmp")
+    tmp.write_text(json.dumps(obj), encoding="utf-8")
+    os.replace(tmp, p)
+
+
+def initial_settings(platform: str, service_id: str, batch_size: Optional[int], workers: Optional[int], defaults: tuple[int, int]) -> tuple[int, int]:
+    """Explicit arguments win, then the service's recorded settings, then defaults."""
+    stored = load_tuning(platform, service_id) or {}
+    return (
+        int(batch_size or stored.get("batch_size") or defaults[0]),
+        int(workers or stored.get("workers") or defaults[1]),
+    )
@@ -0,0 +1,27 @@
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# HTTP helpers shared by the provider runners and the status refresh service.
+
+
+def make_session(pool_size: int) -> requests.Session:
+    # One pooled session per run: connections are reused across rows instead of
+    # paying a TCP/TLS handshake per message. Retries are handled by us, not urllib3.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size), max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def safe_json(resp: requests.Response) -> dict[str, Any]:
+    try:
+        return resp.json()
+    except Exception:
+        return {}
+
+
+def is_throttled(resp: Optional[requests.Response]) -> bool:
+    return resp is not None and (resp.status_code == 429 or resp.status_code >= 500)
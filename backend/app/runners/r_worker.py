@@ -0,0 +1,189 @@
+import atexit
+import json
+import os
+import subprocess
+import time
+import uuid
+from pathlib import Path
+from queue import Empty, Queue
+from threading import Lock, Thread
+from typing import Callable, Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parents[3]
+R_WORKER = PROJECT_ROOT / "r" / "runners" / "r_worker.R"
+WORKER_LOG_DIR = PROJECT_ROOT / "data" / "r_workers"
+
+# Long-lived R processes (r/runners/r_worker.R) that run run_campaign.R jobs,
+# so a test send or media upload does not pay Rscript startup and package
+# loading. 0 disables the pool: every job spawns its own Rscript as before.
+R_WORKER_POOL_SIZE = int(os.environ.get("R_WORKER_POOL_SIZE", "2"))
+# Workers are replaced after this many jobs to bound memory growth.
+R_WORKER_MAX_JOBS = int(os.environ.get("R_WORKER_MAX_JOBS", "50"))
+R_WORKER_START_TIMEOUT_SEC = float(os.environ.get("R_WORKER_START_TIMEOUT_SEC", "60"))
+# After a worker fails to start, use plain Rscript for this long before retrying.
+R_WORKER_RETRY_SEC = float(os.environ.get("R_WORKER_RETRY_SEC", "300"))
+
+RESPONSE_PREFIX = "@@cpa-worker@@ "
+
+
+class RWorkerUnavailable(RuntimeError):
+    """No worker could take the job; nothing was sent, run it with Rscript instead."""
+
+
+class RWorkerError(RuntimeError):
+    """The worker died while running a job."""
+
+
+class RWorker:
+    def __init__(self, rscript_bin: str):
+        WORKER_LOG_DIR.mkdir(parents=True, exist_ok=True)
+        self.jobs = 0
+        self._responses: Queue[Optional[dict]] = Queue()
+        self._stderr = open(WORKER_LOG_DIR / f"worker-{uuid.uuid4().hex[:8]}.log", "a", encoding="utf-8")
+        try:
+            self.proc = subprocess.Popen(
+                [rscript_bin, str(R_WORKER)],
+                cwd=str(PROJECT_ROOT),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=self._stderr,
+                text=True,
+                encoding="utf-8",
+                bufsize=1,
+            )
+        except OSError as e:
+            self._stderr.close()
+            raise RWorkerUnavailable(f"cannot start R worker: {e}") from e
+
+        Thread(target=self._read_stdout, name=f"r-worker-{self.proc.pid}", daemon=True).start()
+        try:
+            ready = self._responses.get(timeout=R_WORKER_START_TIMEOUT_SEC)
+        except Empty:
+            ready = None
+        if not ready or ready.get("id") != "ready":
+            self.close()
+            raise RWorkerUnavailable(f"R worker did not start (see {self._stderr.name})")
+
+    def _read_stdout(self):
+        for line in self.proc.stdout:
+            if line.startswith(RESPONSE_PREFIX):
+                try:
+                    self._responses.put(json.loads(line[len(RESPONSE_PREFIX):]))
+                    continue
+                except ValueError:
+                    pass
+            # Anything else is output that escaped the job's log sink.
+            self._stderr.write(line)
+            self._stderr.flush()
+        self._responses.put(None)
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def run(self, args: list[str], env: dict[str, str], log_path: Path | str, on_tick: Callable[[], None], tick_sec: float) -> int:
+        """Run one run_campaign.R job; on_tick is called every tick_sec while it runs."""
+        job_id = uuid.uuid4().hex
+        request = {"id": job_id, "args": args, "env": env, "log": str(log_path)}
+        try:
+            self.proc.stdin.write(json.dumps(request, ensure_ascii=False) + "\n")
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError) as e:
+            raise RWorkerUnavailable(f"R worker is gone: {e}") from e
+
+        while True:
+            try:
+                msg = self._responses.get(timeout=tick_sec)
+            except Empty:
+                on_tick()
+                continue
+            if msg is None:
+                raise RWorkerError(f"R worker exited during the job (exit code {self.proc.wait()})")
+            if msg.get("id") == job_id:
+                self.jobs += 1
+                return int(msg.get("returncode", 1))
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except Exception:
+            self.proc.kill()
+        self._stderr.close()
+
+
+class RWorkerPool:
+    """
+    Up to `size` workers, started on first use. A job never waits for a
+    worker: when all are busy (e.g. with long sends) it runs as its own
+    Rscript process, so a test send is never queued behind a campaign.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: list[RWorker] = []
+        self._count = 0
+        self._lock = Lock()
+        self._disabled_until = 0.0
+        self._closed = False
+
+    def _acquire(self, rscript_bin: str) -> RWorker:
+        with self._lock:
+            if self._closed or time.monotonic() < self._disabled_until:
+                raise RWorkerUnavailable("R worker pool is disabled")
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    return worker
+                worker.close()
+                self._count -= 1
+            if self._count >= self.size:
+                raise RWorkerUnavailable("all R workers are busy")
+            self._count += 1
+
+        try:
+            return RWorker(rscript_bin)
+        except RWorkerUnavailable:
+            with self._lock:
+                self._count -= 1
+                self._disabled_until = time.monotonic() + R_WORKER_RETRY_SEC
+            raise
+
+    def _release(self, worker: RWorker):
+        with self._lock:
+            keep = worker.alive() and worker.jobs < R_WORKER_MAX_JOBS and not self._closed
+            if keep:
+                self._idle.append(worker)
+            else:
+                self._count -= 1
+        if not keep:
+            worker.close()
+
+    def run(self, rscript_bin: str, args: list[str], env: dict[str, str], log_path: Path | str, on_tick: Callable[[], None], tick_sec: float) -> int:
+        worker = self._acquire(rscript_bin)
+        try:
+            return worker.run(args, env, log_path, on_tick, tick_sec)
+        finally:
+            self._release(worker)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+        for worker in idle:
+            worker.close()
+
+
+pool = RWorkerPool(R_WORKER_POOL_SIZE)
+atexit.register(pool.close)
+
+
+def run_in_worker(rscript_bin: str, args: list[str], env: dict[str, str], log_path: Path | str, on_tick: Callable[[], None], tick_sec: float) -> int:
+    """
+    Run a run_campaign.R job (its command-line flags in args) on a pooled R
+    worker and return its exit code. Raises RWorkerUnavailable when the pool
+    is disabled or no worker can be started; the job has not run then.
+    """
+    if pool.size <= 0:
+        raise RWorkerUnavailable("R worker pool is disabled (R_WORKER_POOL_SIZE=0)")
+    return pool.run(rscript_bin, args, env, log_path, on_tick, tick_sec)
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parents[3]
+RATE_STATE_DIR = PROJECT_ROOT / "data" / "ratelimit"
+
+# Requests/sec and burst per provider token. Rubika counts API calls (one
+# sendBulkMessages call carries a whole batch), SPlus counts single messages.
+DEFAULT_LIMITS = {
+    "splus": (
+        float(os.environ.get("SPLUS_RATE_PER_SEC", "20")),
+        int(os.environ.get("SPLUS_RATE_BURST", "20")),
+    ),
+    "rubika": (
+        float(os.environ.get("RUBIKA_RATE_PER_SEC", "5")),
+        int(os.environ.get("RUBIKA_RATE_BURST", "5")),
+    ),
+}
+
+# When throttled the rate is halved, never below this fraction of the target.
+MIN_RATE_FRACTION = 0.05
+# After a throttle signal, wait this long before growing the rate again.
+RECOVERY_COOLDOWN_SEC = 5.0
+# Additive increase per successful call, as a fraction of the target rate.
+RECOVERY_STEP_FRACTION = 0.02
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket with AIMD adaptation: penalize() halves the
+    current rate (429 / retryable provider codes), reward() slowly grows it
+    back towards the configured target.
+    """
+
+    def __init__(self, rate_per_sec: float, burst: int):
+        if rate_per_sec <= 0:
+            raise ValueError("rate_per_sec must be > 0")
+        self._lock = threading.Lock()
+        self.target_rate = float(rate_per_sec)
+        self.burst = max(1, int(burst))
+        self.rate = self.target_rate
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._last_penalty = 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(float(self.burst), self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def acquire(self) -> float:
+        """Block until one token is available. Returns seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return waited
+                delay = (1.0 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def penalize(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.target_rate * MIN_RATE_FRACTION, self.rate / 2.0)
+            # Drop queued burst so the slower rate takes effect immediately.
+            self._tokens = min(self._tokens, 0.0)
+            self._last_penalty = now
+
+    def reward(self):
+        with self._lock:
+            if self.rate >= self.target_rate:
+                return
+            now = time.monotonic()
+            if now - self._last_penalty < RECOVERY_COOLDOWN_SEC:
+                return
+            self._refill(now)
+            self.rate = min(self.target_rate, self.rate + self.target_rate * RECOVERY_STEP_FRACTION)
+
+    def configure(self, rate_per_sec: float, burst: int):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.target_rate = float(rate_per_sec)
+            self.burst = max(1, int(burst))
+            self.rate = min(self.rate, self.target_rate)
+            self._tokens = min(self._tokens, float(self.burst))
+
+
+_limiters: dict[str, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_key(platform: str, token: str) -> str:
+    # Never keep raw tokens around as dict keys or file names.
+    digest = hashlib.sha256(str(token).strip().encode("utf-8")).hexdigest()[:16]
+    return f"{platform}:{digest}"
+
+
+def get_rate_limiter(
+    platform: str,
+    token: str,
+    rate_per_sec: Optional[float] = None,
+    burst: Optional[int] = None,
+) -> TokenBucket:
+    """
+    Process-wide limiter for one provider token; concurrent campaigns using
+    the same bot/token share it. Explicit rate/burst reconfigure the shared bucket.
+    """
+    default_rate, default_burst = DEFAULT_LIMITS.get(platform, DEFAULT_LIMITS["splus"])
+    key = limiter_key(platform, token)
+    with _limiters_lock:
+        bucket = _limiters.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate_per_sec or default_rate, burst or default_burst)
+            _limiters[key] = bucket
+            return bucket
+    if rate_per_sec is not None or burst is not None:
+        bucket.configure(rate_per_sec or bucket.target_rate, burst or bucket.burst)
+    return bucket
+
+
+def rate_state_path(platform: str, token: str) -> Path:
+    """
+    Shared state file for limiters living outside this process (the R runner's
+    multisession workers). Keyed by token hash, like the in-process registry.
+    """
+    RATE_STATE_DIR.mkdir(parents=True, exist_ok=True)
+    return RATE_STATE_DIR / (limiter_key(platform, token).replace(":", "_") + ".json")
@@ -0,0 +1,152 @@
+import csv
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def progress_path_for(log_csv: Path | str) -> Path:
+    return Path(str(log_csv) + ".progress.json")
+
+
+def read_progress(log_csv: Path | str) -> Optional[dict[str, Any]]:
+    p = progress_path_for(log_csv)
+    if not p.exists():
+        return None
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+
+def _terminate_last_line(path: Path):
+    # A crash can leave a half-written last row; never glue new rows onto it.
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+class ResultLogWriter:
+    """
+    Appends per-row send results to a CSV in small batches while a run is in
+    progress, so memory stays bounded and a crash loses at most one batch.
+
+    After every flush the rows are fsync'ed and a sidecar
+    "<log_csv>.progress.json" trailer is replaced atomically with the number
+    of completed rows and sent/failed counters. "complete" is only set by close(ok=True),
+    so a trailer with complete=false means the run stopped early. on_flush,
+    if given, receives every trailer (used to publish progress to the DB).
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        fieldnames: list[str],
+        *,
+        total: Optional[int] = None,
+        append: bool = False,
+        already_done: int = 0,
+        flush_every: int = 500,
+        flush_interval_sec: float = 2.0,
+        on_flush: Optional[Callable[[dict[str, Any]], None]] = None,
+    ):
+        self.path = Path(path)
+        self.fieldnames = fieldnames
+        self.total = total
+        self.flush_every = max(1, int(flush_every))
+        self.flush_interval_sec = flush_interval_sec
+        self.on_flush = on_flush
+
+        # On resume the caller passes how many rows were already sent; failed
+        # rows are re-attempted, so only successes carry over.
+        self.rows_written = already_done if append else 0
+        self.sent = already_done if append else 0
+        self.failed = 0
+
+        write_header = not (append and self.path.exists() and self.path.stat().st_size > 0)
+        if not write_header:
+            _terminate_last_line(self.path)
+            # Keep the column layout of the log we are appending to.
+            with open(self.path, "r", newline="", encoding="utf-8-sig") as f:
+                existing = next(csv.reader(f), None)
+            if existing:
+                self.fieldnames = fieldnames = existing
+        # utf-8-sig keeps the BOM for Excel; TextIOWrapper skips it when appending.
+        self._f = open(self.path, "a" if append else "w", newline="", encoding="utf-8-sig")
+        self._writer = csv.DictWriter(self._f, fieldnames=fieldnames, extrasaction="ignore")
+        if write_header:
+            self._writer.writeheader()
+
+        self._buffer: list[dict[str, Any]] = []
+        self._buffer_counted = 0
+        self._buffer_sent = 0
+        self._last_flush = time.monotonic()
+        self._write_trailer(complete=False)
+
+    def write(self, row: dict[str, Any], ok: bool, counted: bool = True):
+        """counted=False logs a row that will be retried without counting it as done."""
+        self._buffer.append(row)
+        if counted:
+            self._buffer_counted += 1
+            if ok:
+                self._buffer_sent += 1
+        if (
+            len(self._buffer) >= self.flush_every
+            or time.monotonic() - self._last_flush >= self.flush_interval_sec
+        ):
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._writer.writerows(self._buffer)
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self.rows_written += self._buffer_counted
+            self.sent += self._buffer_sent
+            self.failed += self._buffer_counted - self._buffer_sent
+            self._buffer.clear()
+            self._buffer_counted = 0
+            self._buffer_sent = 0
+            self._write_trailer(complete=False)
+        self._last_flush = time.monotonic()
+
+    def close(self, ok: bool = False):
+        if self._f.closed:
+            return
+        self.flush()
+        self._f.close()
+        self._write_trailer(complete=ok)
+
+    def _write_trailer(self, complete: bool):
+        trailer = {
+            "rows": self.rows_written,
+            "sent": self.sent,
+            "failed": self.failed,
+            "total": self.total,
+            "complete": complete,
+            "updated_at": now_iso(),
+        }
+        p = progress_path_for(self.path)
+        tmp = p.with_name(p.name + ".tmp")
+        tmp.write_text(json.dumps(trailer), encoding="utf-8")
+        os.replace(tmp, p)
+        if self.on_flush is not None:
+            try:
+                self.on_flush(trailer)
+            except Exception:
+                # Progress publishing must never break the send itself.
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(ok=exc_type is None)
+        return False
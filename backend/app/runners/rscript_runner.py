@@ -2,16 +2,68 @@ import os
 import subprocess
 import traceback
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Optional
 import json
 
+from .batch_tuner import initial_settings
+from .r_worker import R_WORKER_POOL_SIZE, RWorkerUnavailable, run_in_worker
+from .rate_limiter import DEFAULT_LIMITS, rate_state_path
+from .result_log import read_progress
+
 PROJECT_ROOT = Path(__file__).resolve().parents[3]
 RUNS_DIR = PROJECT_ROOT / "data" / "runs"
 R_RUNNER = PROJECT_ROOT / "r" / "runners" / "run_campaign.R"
 
+# How often the R progress sidecar is polled while Rscript runs.
+PROGRESS_POLL_SEC = float(os.environ.get("R_PROGRESS_POLL_SEC", "2"))
+
 def ensure_runs_dir():
     RUNS_DIR.mkdir(parents=True, exist_ok=True)
 
+
+def _poll_progress(log_csv: Path, progress_cb, last: Optional[dict]) -> Optional[dict]:
+    # The R runner keeps "<log_csv>.progress.json" in the same format as
+    # ResultLogWriter; forward it only when it changed.
+    trailer = read_progress(log_csv)
+    if trailer is None or trailer == last:
+        return last
+    try:
+        progress_cb(trailer)
+    except Exception:
+        pass
+    return trailer
+
+def _execute(cmd: list[str], token: str, log_file, on_tick: Callable[[], None]) -> int:
+    """
+    Run cmd ([rscript, run_campaign.R, *flags]) with its output appended to
+    log_file and return the exit code. Uses a pooled R worker (r_worker.py)
+    when one is available, otherwise a fresh Rscript process.
+    """
+    log_file.flush()
+    try:
+        return run_in_worker(cmd[0], cmd[2:], {"RUBICA_TOKEN": token}, log_file.name, on_tick, PROGRESS_POLL_SEC)
+    except RWorkerUnavailable as e:
+        if R_WORKER_POOL_SIZE > 0:
+            log_file.write(f"({e}; starting Rscript)\n")
+            log_file.flush()
+
+    env = os.environ.copy()
+    env["RUBICA_TOKEN"] = token
+    proc = subprocess.Popen(
+        cmd,
+        cwd=str(PROJECT_ROOT),
+        env=env,
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    while True:
+        try:
+            return proc.wait(timeout=PROGRESS_POLL_SEC)
+        except subprocess.TimeoutExpired:
+            on_tick()
+
+
 def run_r_campaign(
     *,
     mode: str,
@@ -21,16 +73,29 @@ def run_r_campaign(
     file_id: Optional[str],
     message_text: str,
     test_number: Optional[str],
-    batch_size: int = 1000,
-    workers: int = 5,
-    sleep_sec: float = 0.2,
+    batch_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    sleep_sec: float = 0.0,
+    rate_per_sec: Optional[float] = None,
+    burst: Optional[int] = None,
     run_id: str,
+    resume: bool = False,
+    progress_cb: Optional[Callable[[dict[str, Any]], None]] = None,
 ) -> dict:
     """
     Always creates run_dir and run.log.
     Token passed only via env var.
+    Batches are paced by the shared per-token limiter (see rate_limiter.py);
+    sleep_sec only applies as a fixed pause when no limiter is configured.
+    resume=True re-runs into the same run_dir: the R runner skips numbers
+    already in rubika_message_log.csv and run.log is appended to.
+    progress_cb receives the R runner's progress sidecar while it runs.
+    Without explicit batch_size / workers a send starts from the last good
+    settings the Python runner recorded for the service (the R runner keeps
+    them fixed for the run).
     Returns returncode + paths even on failure.
     """
+    batch_size, workers = initial_settings("rubika", service_id, batch_size, workers, (1000, 5))
     ensure_runs_dir()
     run_dir = RUNS_DIR / run_id
     run_dir.mkdir(parents=True, exist_ok=True)
@@ -44,6 +109,8 @@ def run_r_campaign(
     # Allow configuring Rscript path via env var on Windows
     rscript_bin = os.environ.get("RSCRIPT_PATH", "Rscript")
 
+    default_rate, default_burst = DEFAULT_LIMITS["rubika"]
+
     cmd = [
         rscript_bin,
         str(R_RUNNER),
@@ -55,32 +122,33 @@ def run_r_campaign(
         "--batch_size", str(batch_size),
         "--workers", str(workers),
         "--sleep_sec", str(sleep_sec),
+        "--rate_state", str(rate_state_path("rubika", rubica_token)),
+        "--rate_per_sec", str(rate_per_sec or default_rate),
+        "--burst", str(burst or default_burst),
+        "--resume", "true" if resume else "false",
     ]
     if file_id:
         cmd += ["--file_id", str(file_id)]
     if mode == "test" and test_number:
         cmd += ["--test_number", str(test_number)]
 
-    env = os.environ.copy()
-    env["RUBICA_TOKEN"] = rubica_token
+    last_progress = None
+
+    def on_tick():
+        nonlocal last_progress
+        if progress_cb is not None:
+            last_progress = _poll_progress(log_csv, progress_cb, last_progress)
 
     try:
-        with open(log_path, "w", encoding="utf-8") as f:
+        with open(log_path, "a" if resume else "w", encoding="utf-8") as f:
+            if resume:
+                f.write("\n=== RESUME ===\n")
             f.write("COMMAND:\n" + " ".join(cmd) + "\n\n")
-            f.flush()
-
-            proc = subprocess.run(
-                cmd,
-                cwd=str(PROJECT_ROOT),
-                env=env,
-                stdout=f,
-                stderr=subprocess.STDOUT,
-                text=True,
-                check=False,
-            )
+            returncode = _execute(cmd, rubica_token, f, on_tick)
+        on_tick()
 
         return {
-            "returncode": proc.returncode,
+            "returncode": returncode,
             "run_dir": str(run_dir),
             "log_path": str(log_path),
             "log_csv": str(log_csv),
@@ -132,21 +200,24 @@ def run_r_upload_media(
         "--result_json", str(result_path),
     ]
 
-    env = os.environ.copy()
-    env["RUBICA_TOKEN"] = rubica_token
-
-    with open(log_path, "w", encoding="utf-8") as f:
-        f.write("COMMAND:\n" + " ".join(cmd) + "\n\n")
-        f.flush()
-        proc = subprocess.run(
-            cmd,
-            cwd=str(PROJECT_ROOT),
-            env=env,
-            stdout=f,
-            stderr=subprocess.STDOUT,
-            text=True,
-            check=False,
-        )
+    try:
+        with open(log_path, "w", encoding="utf-8") as f:
+            f.write("COMMAND:\n" + " ".join(cmd) + "\n\n")
+            returncode = _execute(cmd, rubica_token, f, lambda: None)
+    except Exception as e:
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write("\n\n=== PYTHON RUNNER ERROR ===\n")
+            f.write(str(e) + "\n")
+            f.write(traceback.format_exc() + "\n")
+
+        return {
+            "returncode": 999,
+            "run_dir": str(run_dir),
+            "log_path": str(log_path),
+            "result_path": str(result_path),
+            "result": None,
+            "error": str(e),
+        }
 
     result = None
     if result_path.exists():
@@ -156,7 +227,7 @@ def run_r_upload_media(
             result = {"ok": False, "error": "Could not parse result.json"}
 
     return {
-        "returncode": proc.returncode,
+        "returncode": returncode,
         "run_dir": str(run_dir),
         "log_path": str(log_path),
         "result_path": str(result_path),
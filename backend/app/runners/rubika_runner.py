@@ -0,0 +1,560 @@
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import pandas as pd
+import requests
+
+from ..services.validation import normalize_phone_series
+from .batch_tuner import BatchTuner, initial_settings, save_tuning
+from .http_common import is_throttled, make_session, safe_json
+from .rate_limiter import TokenBucket, get_rate_limiter
+from .result_log import ResultLogWriter
+from .snapshot_reader import read_snapshot
+from .rscript_runner import run_r_campaign, run_r_upload_media
+
+PROJECT_ROOT = Path(__file__).resolve().parents[3]
+RUNS_DIR = PROJECT_ROOT / "data" / "runs"
+
+DEFAULT_RUBIKA_BASE_URL = os.environ.get("RUBIKA_BASE_URL", "https://messaging.rubika.ir")
+# "python" sends with this module; "r" keeps the Rscript runner (rscript_runner.py).
+RUBIKA_ENGINE = os.environ.get("RUBIKA_ENGINE", "python").strip().lower()
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_SEND_WORKERS = int(os.environ.get("RUBIKA_SEND_WORKERS", "5"))
+# Rounds after the first resend only rows logged as "retry", in smaller
+# batches (run_campaign.R --max_rounds / --retry_batch_size / --sleep_round_sec).
+RUBIKA_MAX_ROUNDS = int(os.environ.get("RUBIKA_MAX_ROUNDS", "20"))
+RUBIKA_RETRY_BATCH_SIZE = int(os.environ.get("RUBIKA_RETRY_BATCH_SIZE", "100"))
+RUBIKA_ROUND_SLEEP_SEC = float(os.environ.get("RUBIKA_ROUND_SLEEP_SEC", "5"))
+# Same columns, order and quoting conventions as save_rubika_log() in R.
+RUBIKA_LOG_FIELDS = [
+    "phone_number",
+    "message_id",
+    "file_id",
+    "status",
+    "text",
+    "scenario",
+    "send_data",
+    "send_time",
+    "outcome",
+]
+# Row outcomes, as rubika_row_outcome() in R: "sent" has a message_id,
+# "retry" (timeout, throttling, incomplete answer) is sent again in a later
+# round, "failed" was rejected by the provider.
+OUTCOME_SENT = "sent"
+OUTCOME_RETRY = "retry"
+OUTCOME_FAILED = "failed"
+
+
+def ensure_runs_dir():
+    RUNS_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# ---- API client ---------------------------------------------------------------
+
+def _api_call(
+    session: requests.Session,
+    base_url: str,
+    token: str,
+    method: str,
+    data: dict[str, Any],
+    timeout_sec: float,
+) -> tuple[Optional[requests.Response], dict[str, Any]]:
+    """One Rubika API call ({method, data, api_version} envelope, token header)."""
+    resp = session.post(
+        base_url,
+        json={"method": method, "data": data, "api_version": 1},
+        headers={"Content-Type": "application/json", "Accept": "application/json", "token": token},
+        timeout=timeout_sec,
+    )
+    obj = safe_json(resp)
+    return resp, obj if isinstance(obj, dict) else {}
+
+
+def send_bulk_messages(session, base_url, token, service_id, messages, timeout_sec):
+    return _api_call(
+        session, base_url, token, "sendBulkMessages",
+        {"service_id": service_id, "message_list": messages}, timeout_sec,
+    )
+
+
+def get_messages_status(session, base_url, token, message_ids, timeout_sec):
+    return _api_call(
+        session, base_url, token, "getMessagesStatus",
+        {"message_ids": list(message_ids)}, timeout_sec,
+    )
+
+
+@lru_cache(maxsize=32)
+def _template_parts(template: str) -> tuple[str, Optional[str]]:
+    """
+    Split a message template the way R's sprintf(text_template, link) reads
+    it: "%%" is a literal "%" and the first "%s" takes the link. Returns
+    (head, tail) around that "%s", or (text, None) when there is none.
+    R rejects a second "%s" (too few arguments); it is kept verbatim here.
+    """
+    parts: list[str] = []
+    head: Optional[str] = None
+    i = 0
+    while i < len(template):
+        j = template.find("%", i)
+        if j < 0 or j + 1 >= len(template):
+            parts.append(template[i:])
+            break
+        parts.append(template[i:j])
+        spec = template[j + 1]
+        if spec == "%":
+            parts.append("%")
+        elif spec == "s" and head is None:
+            head = "".join(parts)
+            parts = []
+        else:
+            parts.append(template[j:j + 2])
+        i = j + 2
+    rest = "".join(parts)
+    return (head, rest) if head is not None else (rest, None)
+
+
+def _message_text(template: str, link: str) -> str:
+    # make_messages_from_df(): sprintf(text_template, link)
+    head, tail = _template_parts(template)
+    return head if tail is None else head + link + tail
+
+
+def status_list(obj: dict[str, Any]) -> list[dict[str, Any]]:
+    data = obj.get("data")
+    msl = data.get("message_status_list") if isinstance(data, dict) else None
+    if not isinstance(msl, list):
+        return []
+    return [m for m in msl if isinstance(m, dict)]
+
+
+def _send_batch(
+    *,
+    session: requests.Session,
+    limiter: TokenBucket,
+    base_url: str,
+    token: str,
+    service_id: str,
+    batch: list[tuple[str, str]],
+    text_template: str,
+    file_id: Optional[str],
+    scenario: str,
+    timeout_sec: float,
+) -> tuple[list[dict[str, Any]], str, float]:
+    """
+    sendBulkMessages for one batch of (phone, link), then getMessagesStatus
+    for the returned ids. Never raises: failures become SEND_ERROR rows, as
+    in send_rubika_in_batches_parallel(). Returns (log rows, summary, seconds
+    the sendBulkMessages call took); the rows are in batch order.
+    """
+    ts = datetime.now()
+    elapsed = 0.0
+    messages = []
+    for phone, link in batch:
+        msg = {"phone": phone, "text": _message_text(text_template, link)}
+        if file_id:
+            msg["file_id"] = file_id
+        messages.append(msg)
+
+    def error_rows(status_val: Any, data_status_val: Any, retryable: bool) -> list[dict[str, Any]]:
+        status = f"SEND_ERROR: {status_val if status_val is not None else '?'}/{data_status_val if data_status_val is not None else '?'}"
+        outcome = OUTCOME_RETRY if retryable else OUTCOME_FAILED
+        return [_log_row(phone, "", file_id, status, "", scenario, ts, outcome) for phone, _ in batch]
+
+    try:
+        limiter.acquire()
+        started = time.monotonic()
+        try:
+            resp, obj = send_bulk_messages(session, base_url, token, service_id, messages, timeout_sec)
+        finally:
+            elapsed = time.monotonic() - started
+        if is_throttled(resp):
+            limiter.penalize()
+        else:
+            limiter.reward()
+
+        status_val = obj.get("status")
+        data = obj.get("data") if isinstance(obj.get("data"), dict) else {}
+        data_status_val = data.get("status")
+        msl = status_list(obj)
+        if not any(m.get("message_id") for m in msl):
+            # Throttled, unparsed or an OK answer without ids: nothing was rejected.
+            retryable = is_throttled(resp) or status_val in (None, "OK")
+            return error_rows(status_val, data_status_val, retryable), f"http={resp.status_code} status={status_val}/{data_status_val}", elapsed
+
+        # Latest status (Seen / Sent / ...) for the ids we got back.
+        final: dict[str, Any] = {}
+        try:
+            limiter.acquire()
+            _, st_obj = get_messages_status(
+                session, base_url, token, [m.get("message_id") for m in msl if m.get("message_id")], timeout_sec
+            )
+            final = {str(m.get("message_id")): m.get("status") for m in status_list(st_obj)}
+        except Exception:
+            pass
+
+        rows = []
+        for i, msg in enumerate(messages):
+            m = msl[i] if i < len(msl) else {}
+            message_id = str(m.get("message_id") or "")
+            status = final.get(message_id) or m.get("status") or ""
+            outcome = OUTCOME_SENT if message_id else OUTCOME_FAILED if m.get("status") else OUTCOME_RETRY
+            rows.append(_log_row(msg["phone"], message_id, file_id, str(status), msg["text"], scenario, ts, outcome))
+        return rows, f"http={resp.status_code} status={status_val}/{data_status_val}", elapsed
+
+    except Exception as ex:
+        # Timeouts / transport errors count as throttle signals too.
+        limiter.penalize()
+        return error_rows("EXCEPTION", str(ex), True), f"error={ex}", elapsed
+
+
+def _log_row(phone, message_id, file_id, status, text, scenario, ts: datetime, outcome: str) -> dict[str, Any]:
+    return {
+        # Excel-safe text, like save_rubika_log().
+        "phone_number": f"'{phone}",
+        "message_id": f"'{message_id}" if message_id else "",
+        "file_id": file_id or "",
+        "status": status,
+        "text": text,
+        "scenario": scenario,
+        "send_data": ts.strftime("%Y-%m-%d"),
+        "send_time": ts.strftime("%H:%M"),
+        "outcome": outcome,
+    }
+
+
+def _read_logged_phones(log_csv: Path) -> set[str]:
+    """Canonical numbers already settled in the message log (any outcome but "retry"), like read_progress_numbers() in R."""
+    if not log_csv.exists() or log_csv.stat().st_size == 0:
+        return set()
+    phones: set[str] = set()
+    chunks = pd.read_csv(
+        log_csv,
+        usecols=lambda c: c in ("phone_number", "outcome"),
+        dtype=str,
+        keep_default_na=False,
+        encoding="utf-8-sig",
+        on_bad_lines="skip",
+        chunksize=200_000,
+    )
+    for chunk in chunks:
+        if "phone_number" in chunk.columns:
+            if "outcome" in chunk.columns:
+                chunk = chunk[chunk["outcome"] != OUTCOME_RETRY]
+            phones.update(normalize_phone_series(chunk["phone_number"].str.lstrip("'")).dropna())
+    return phones
+
+
+# ---- runners --------------------------------------------------------------------
+
+def run_rubika_campaign(
+    *,
+    mode: str,
+    rubica_token: str,
+    snapshot_path: str,
+    service_id: str,
+    file_id: Optional[str],
+    message_text: str,
+    test_number: Optional[str],
+    run_id: str,
+    batch_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    rate_per_sec: Optional[float] = None,
+    burst: Optional[int] = None,
+    base_url: str = DEFAULT_RUBIKA_BASE_URL,
+    timeout_sec: int = 60,
+    resume: bool = False,
+    progress_cb: Optional[Callable[[dict[str, Any]], None]] = None,
+) -> dict:
+    """
+    In-process replacement for run_r_campaign (same arguments, same
+    rubika_message_log.csv). Batches go out concurrently over one pooled
+    session, paced by the shared per-token limiter. Rows logged as "retry"
+    are sent again in later rounds (send mode, up to RUBIKA_MAX_ROUNDS).
+    resume=True skips numbers already settled in the log and appends to it.
+    Batch size and parallelism adapt to the observed latency and failures
+    (BatchTuner); without explicit values a send starts from the last good
+    settings recorded for the service.
+    progress_cb receives every progress trailer written next to the CSV log.
+    """
+    batch_size, workers = initial_settings(
+        "rubika", service_id, batch_size, workers, (DEFAULT_BATCH_SIZE, DEFAULT_SEND_WORKERS)
+    )
+    ensure_runs_dir()
+    run_dir = RUNS_DIR / run_id
+    run_dir.mkdir(parents=True, exist_ok=True)
+
+    log_path = run_dir / "run.log"
+    log_csv = run_dir / "rubika_message_log.csv"
+    resume = resume and mode == "send"
+
+    with open(log_path, "a" if resume else "w", encoding="utf-8") as lf:
+        if resume:
+            lf.write("\n=== RESUME ===\n")
+        lf.write(f"mode={mode}\n")
+        lf.write(f"snapshot_path={snapshot_path}\n")
+        lf.write(f"service_id={service_id}\n")
+        lf.write(f"file_id={file_id or ''}\n")
+        lf.write(f"batch_size={batch_size} workers={workers}\n")
+        lf.write(f"rate_per_sec={rate_per_sec or 'default'} burst={burst or 'default'}\n")
+        lf.write(f"started_at={now_iso()}\n\n")
+
+        try:
+            if mode not in ("test", "send"):
+                raise ValueError("mode must be test or send")
+            if not rubica_token or not rubica_token.strip():
+                raise ValueError("rubica_token is required")
+            if not service_id:
+                raise ValueError("service_id is required")
+            if not message_text or not str(message_text).strip():
+                raise ValueError("message_text is required")
+
+            df = read_snapshot(snapshot_path)
+            if df.empty:
+                raise ValueError("No valid rows in snapshot after cleaning")
+
+            if mode == "test":
+                if not test_number:
+                    raise ValueError("test_number required in test mode")
+                send_df = pd.DataFrame([{"phone_number": str(test_number), "link": str(df.iloc[0]["link"])}])
+                scenario = "CPA_Panel_TEST"
+                batch_size = 1
+            else:
+                send_df = df
+                scenario = "CPA_Panel_SEND"
+
+            total = len(send_df.index)
+            done_count = 0
+            if resume:
+                logged = _read_logged_phones(log_csv)
+                if logged:
+                    # Both sides canonical: older logs hold 0912…/912… numbers.
+                    already = normalize_phone_series(send_df["phone_number"]).isin(logged).to_numpy()
+                    done_count = int(already.sum())
+                    send_df = send_df[~already]
+                lf.write(f"RESUME: already logged={done_count}, remaining={len(send_df.index)}\n")
+                lf.flush()
+
+            # A test send is a single message: nothing to tune.
+            tuner = BatchTuner(batch_size, workers, min_batch=1, adaptive=False) if mode == "test" else BatchTuner(batch_size, workers)
+            pool_size = max(tuner.workers, tuner.max_workers) if tuner.adaptive else tuner.workers
+            limiter = get_rate_limiter("rubika", rubica_token, rate_per_sec, burst)
+            max_rounds = max(1, RUBIKA_MAX_ROUNDS) if mode == "send" else 1
+
+            results = ResultLogWriter(
+                log_csv,
+                RUBIKA_LOG_FIELDS,
+                total=total,
+                append=resume,
+                already_done=done_count,
+                flush_every=tuner.batch_size,
+                on_flush=progress_cb,
+            )
+            with results, make_session(pool_size) as session, ThreadPoolExecutor(
+                max_workers=pool_size, thread_name_prefix="rubika-send"
+            ) as pool:
+
+                def send_round(pairs, max_size: int, last_round: bool) -> list[tuple[str, str]]:
+                    """Send pairs in batches of at most max_size; returns the pairs to retry."""
+                    nonlocal done_count
+
+                    def batches():
+                        # Each batch takes the tuner's batch size at the time it is built.
+                        batch: list[tuple[str, str]] = []
+                        for pair in pairs:
+                            batch.append(pair)
+                            if len(batch) >= min(max_size, tuner.batch_size):
+                                yield batch
+                                batch = []
+                        if batch:
+                            yield batch
+
+                    retry: list[tuple[str, str]] = []
+                    batch_iter = enumerate(batches(), start=1)
+                    # Bounded window: one batch in flight per (tuned) worker.
+                    in_flight: dict[Any, tuple[int, list[tuple[str, str]]]] = {}
+                    while True:
+                        while len(in_flight) < tuner.workers:
+                            nxt = next(batch_iter, None)
+                            if nxt is None:
+                                break
+                            b, batch = nxt
+                            fut = pool.submit(
+                                _send_batch,
+                                session=session,
+                                limiter=limiter,
+                                base_url=base_url,
+                                token=rubica_token.strip(),
+                                service_id=str(service_id),
+                                batch=batch,
+                                text_template=message_text,
+                                file_id=file_id,
+                                scenario=scenario,
+                                timeout_sec=timeout_sec,
+                            )
+                            in_flight[fut] = (b, batch)
+                        if not in_flight:
+                            break
+
+                        finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for fut in finished:
+                            b, batch = in_flight.pop(fut)
+                            rows, summary, elapsed = fut.result()
+                            tuner.record(len(batch), elapsed, all(r["outcome"] == OUTCOME_RETRY for r in rows))
+                            sent = 0
+                            for pair, row in zip(batch, rows):
+                                ok = row["outcome"] == OUTCOME_SENT
+                                # The last round counts what is still failing as failed.
+                                counted = row["outcome"] != OUTCOME_RETRY or last_round
+                                sent += ok
+                                done_count += counted
+                                results.write(row, ok=ok, counted=counted)
+                                if row["outcome"] == OUTCOME_RETRY:
+                                    retry.append(pair)
+                            lf.write(
+                                f"[{done_count}/{total}] batch {b} rows={len(rows)} sent={sent} "
+                                f"send_sec={elapsed:.2f} {summary}\n"
+                            )
+                        lf.flush()
+                    return retry
+
+                pending = send_round(
+                    zip(send_df["phone_number"].astype(str), send_df["link"].astype(str)),
+                    tuner.max_batch,
+                    max_rounds == 1,
+                )
+                for round_no in range(2, max_rounds + 1):
+                    if not pending:
+                        break
+                    time.sleep(RUBIKA_ROUND_SLEEP_SEC)
+                    lf.write(f"\n=== ROUND {round_no} === retrying={len(pending)}\n")
+                    pending = send_round(pending, max(1, RUBIKA_RETRY_BATCH_SIZE), round_no == max_rounds)
+                if pending:
+                    lf.write(f"Reached max_rounds={max_rounds} with remaining={len(pending)}\n")
+
+            tuning = tuner.settings()
+            lf.write(f"tuning={json.dumps(tuning)}\n")
+            if mode == "send":
+                (run_dir / "send_tuning.json").write_text(json.dumps(tuning), encoding="utf-8")
+                if tuner.batches > tuner.failures:
+                    save_tuning("rubika", service_id, tuning, run_id)
+
+            lf.write(f"\nOK: campaign {'sent' if mode == 'send' else 'test sent'}\n")
+            return {
+                "returncode": 0,
+                "run_dir": str(run_dir),
+                "log_path": str(log_path),
+                "log_csv": str(log_csv),
+            }
+
+        except Exception as ex:
+            lf.write("\n=== PYTHON RUBIKA RUNNER ERROR ===\n")
+            lf.write(str(ex) + "\n")
+            return {
+                "returncode": 999,
+                "run_dir": str(run_dir),
+                "log_path": str(log_path),
+                "log_csv": str(log_csv),
+                "error": str(ex),
+            }
+
+
+def run_rubika_upload_media(
+    *,
+    rubica_token: str,
+    media_path: str,
+    media_type: str,  # "Image" or "Video"
+    run_id: str,
+    base_url: str = DEFAULT_RUBIKA_BASE_URL,
+    timeout_sec: int = 120,
+) -> dict:
+    """requestUploadFile + upload, same result.json as run_r_upload_media."""
+    ensure_runs_dir()
+    run_dir = RUNS_DIR / run_id
+    run_dir.mkdir(parents=True, exist_ok=True)
+
+    log_path = run_dir / "run.log"
+    result_path = run_dir / "result.json"
+    token = (rubica_token or "").strip()
+
+    with open(log_path, "w", encoding="utf-8") as lf:
+        try:
+            if not token:
+                raise ValueError("rubica_token is required")
+            if media_type not in ("Image", "Video"):
+                raise ValueError("media_type must be Image or Video")
+            file_name = Path(media_path).name
+
+            with requests.Session() as session:
+                resp, req_up = _api_call(
+                    session, base_url, token, "requestUploadFile",
+                    {"file_name": file_name, "file_type": media_type}, timeout_sec,
+                )
+                lf.write(f"requestUploadFile http={resp.status_code} status={req_up.get('status')}\n")
+                upload_url = (req_up.get("data") or {}).get("upload_url") if req_up.get("status") == "OK" else None
+
+                if not upload_url:
+                    result = {"ok": False, "step": "requestUploadFile", "resp": req_up}
+                else:
+                    # The docs name the multipart field "files"; some deployments want "file".
+                    up_res: dict[str, Any] = {}
+                    for field in ("files", "file"):
+                        with open(media_path, "rb") as f:
+                            up = session.post(upload_url, files={field: (file_name, f)}, headers={"token": token}, timeout=timeout_sec)
+                        lf.write(f"uploadFile raw response with field '{field}':\n{up.text}\n\n")
+                        up_res = safe_json(up)
+                        if isinstance(up_res, dict) and up_res.get("status") == "OK":
+                            break
+                    fid = ((up_res.get("data") or {}).get("file_id") if isinstance(up_res, dict) else None) or ""
+                    if fid:
+                        result = {"ok": True, "file_id": fid, "file_name": file_name, "file_type": media_type}
+                    else:
+                        result = {"ok": False, "step": "uploadFile", "resp": up_res}
+
+            result_path.write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+            lf.write("OK: media uploaded\n" if result["ok"] else f"upload failed at {result['step']}\n")
+            return {
+                "returncode": 0 if result["ok"] else 1,
+                "run_dir": str(run_dir),
+                "log_path": str(log_path),
+                "result_path": str(result_path),
+                "result": result,
+            }
+
+        except Exception as ex:
+            result = {"ok": False, "error": str(ex)}
+            lf.write("=== PYTHON RUBIKA UPLOAD ERROR ===\n")
+            lf.write(str(ex) + "\n")
+            result_path.write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+            return {
+                "returncode": 999,
+                "run_dir": str(run_dir),
+                "log_path": str(log_path),
+                "result_path": str(result_path),
+                "result": result,
+                "error": str(ex),
+            }
+
+
+def rubika_campaign_runner() -> tuple[Callable[..., dict], str]:
+    """
+    (runner, snapshot cache format) for Rubika sends per RUBIKA_ENGINE; both
+    runners take the same keyword arguments.
+    """
+    if RUBIKA_ENGINE == "r":
+        return run_r_campaign, "csv"
+    return run_rubika_campaign, "feather"
+
+
+def rubika_upload_runner() -> Callable[..., dict]:
+    return run_r_upload_media if RUBIKA_ENGINE == "r" else run_rubika_upload_media
@@ -0,0 +1,35 @@
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.feather as feather
+
+
+def read_snapshot(snapshot_path: str) -> pd.DataFrame:
+    """phone_number / link columns of a snapshot: the feather cache or an original upload."""
+    p = Path(snapshot_path)
+    ext = p.suffix.lower()
+    if ext == ".feather":
+        # Cleaned cache written at upload (services/snapshot_cache.py): the
+        # columns are already normalized, so skip the text cleaning below.
+        df = feather.read_table(str(p), memory_map=True).to_pandas()
+        return df[["phone_number", "link"]]
+    if ext in (".xlsx", ".xls"):
+        df = pd.read_excel(p)
+    elif ext == ".csv":
+        df = pd.read_csv(p)
+    else:
+        raise ValueError(f"Unsupported snapshot extension: {ext}")
+
+    for required_col in ("phone_number", "link"):
+        if required_col not in df.columns:
+            raise ValueError(f"snapshot missing required column: {required_col}")
+
+    df["phone_number"] = (
+        df["phone_number"]
+        .astype(str)
+        .str.replace(r"[^0-9]", "", regex=True)
+        .str.strip()
+    )
+    df["link"] = df["link"].astype(str).str.strip()
+    df = df[(df["phone_number"] != "") & (df["link"] != "")]
+    return df[["phone_number", "link"]].reset_index(drop=True)
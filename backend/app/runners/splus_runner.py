@@ -1,22 +1,50 @@
-import csv
+import heapq
 import json
 import mimetypes
 import os
+import random
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
+import numpy as np
 import pandas as pd
 import requests
 
+from ..services.validation import normalize_phone_series
+from .http_common import make_session, safe_json
+from .rate_limiter import TokenBucket, get_rate_limiter
+from .result_log import ResultLogWriter
+from .snapshot_reader import read_snapshot
+
 PROJECT_ROOT = Path(__file__).resolve().parents[3]
 RUNS_DIR = PROJECT_ROOT / "data" / "runs"
 
 DEFAULT_SPLUS_BASE_URL = "https://bui.splus.ir"
 RETRYABLE_RESULT_CODES = {429, 500, 724, 730, 736, 738}
 MAX_RETRIES = 5
+# Deferred retries: jittered exponential backoff, bounded by a per-message deadline.
+RETRY_BASE_DELAY_SEC = 1.0
+RETRY_MAX_DELAY_SEC = 30.0
+MESSAGE_DEADLINE_SEC = float(os.environ.get("SPLUS_MESSAGE_DEADLINE_SEC", "300"))
+# Number of concurrent senders; they share one keep-alive connection pool.
+DEFAULT_SEND_WORKERS = int(os.environ.get("SPLUS_SEND_WORKERS", "8"))
 SPLUS_MEDIA_MAX_SIZE = 8 * 1024 * 1024
+SPLUS_LOG_FIELDS = [
+    "phone_number",
+    "message_id",
+    "file_id",
+    "status",
+    "text",
+    "scenario",
+    "send_data",
+    "send_time",
+    "error_code",
+    "attempts",
+    "link",
+]
 ALLOWED_SPLUS_MIME_TYPES = {
     "image/jpeg",
     "image/png",
@@ -33,36 +61,49 @@ def now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def _read_snapshot(snapshot_path: str) -> pd.DataFrame:
-    p = Path(snapshot_path)
-    ext = p.suffix.lower()
-    if ext in (".xlsx", ".xls"):
-        df = pd.read_excel(p)
-    elif ext == ".csv":
-        df = pd.read_csv(p)
-    else:
-        raise ValueError(f"Unsupported snapshot extension: {ext}")
-
-    for required_col in ("phone_number", "link"):
-        if required_col not in df.columns:
-            raise ValueError(f"snapshot missing required column: {required_col}")
-
-    df["phone_number"] = (
-        df["phone_number"]
-        .astype(str)
-        .str.replace(r"[^0-9]", "", regex=True)
-        .str.strip()
+def _row_keys(phones: pd.Series, second: pd.Series) -> np.ndarray:
+    # 64-bit hashes of phone + link (vectorized), so resume filtering is a
+    # sorted-array membership test instead of building millions of strings.
+    # Phones are canonicalized first: logs written before canonicalization
+    # hold 0912…/912… where the snapshot cache now has 98912….
+    phones = normalize_phone_series(phones.reset_index(drop=True)).fillna("")
+    frame = pd.DataFrame({"phone_number": phones.to_numpy(dtype=str), "link": second.to_numpy(dtype=str)})
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+def _read_sent_keys(log_csv: Path) -> tuple[np.ndarray, str]:
+    """
+    Keys of rows already sent successfully in an existing message log.
+    Logs written before the link column existed are keyed on phone + text.
+    """
+    empty = np.empty(0, dtype=np.uint64)
+    if not log_csv.exists() or log_csv.stat().st_size == 0:
+        return empty, "link"
+
+    key_col = "link"
+    parts: list[np.ndarray] = []
+    chunks = pd.read_csv(
+        log_csv,
+        dtype=str,
+        keep_default_na=False,
+        encoding="utf-8-sig",
+        on_bad_lines="skip",
+        chunksize=200_000,
     )
-    df["link"] = df["link"].astype(str).str.strip()
-    df = df[(df["phone_number"] != "") & (df["link"] != "")]
-    return df[["phone_number", "link"]].reset_index(drop=True)
-
-
-def _safe_json(resp: requests.Response) -> dict[str, Any]:
-    try:
-        return resp.json()
-    except Exception:
-        return {}
+    for chunk in chunks:
+        if "link" not in chunk.columns:
+            key_col = "text"
+        if key_col not in chunk.columns or "status" not in chunk.columns:
+            return empty, key_col
+        chunk = chunk[chunk["status"] == "Sent"]
+        if chunk.empty:
+            continue
+        phones = chunk["phone_number"].str.lstrip("'")
+        parts.append(_row_keys(phones, chunk[key_col]))
+
+    if not parts:
+        return empty, key_col
+    return np.unique(np.concatenate(parts)), key_col
 
 
 def _is_retryable(resp: Optional[requests.Response], data: dict[str, Any], err: Optional[Exception]) -> bool:
@@ -92,15 +133,21 @@ def _message_text(template: str, link: str) -> str:
     return template.replace("🔗", link)
 
 
-def _send_with_retry(
+def _send_once(
     *,
+    session: requests.Session,
+    limiter: TokenBucket,
     base_url: str,
     bot_id: str,
     phone_number: str,
     text: str,
     file_id: Optional[str],
     timeout_sec: int,
-):
+) -> tuple[Optional[requests.Response], dict[str, Any], Optional[Exception], bool]:
+    """
+    Single send attempt. Never sleeps for backoff: retryable failures are
+    handed back to the run loop, which re-queues them without blocking other rows.
+    """
     payload: dict[str, Any] = {
         "phone_number": str(phone_number),
         "text": text,
@@ -115,28 +162,28 @@ def _send_with_retry(
         "Accept": "application/json",
     }
 
-    last_resp: Optional[requests.Response] = None
-    last_data: dict[str, Any] = {}
-    last_err: Optional[Exception] = None
-
-    for attempt in range(MAX_RETRIES + 1):
-        try:
-            resp = requests.post(url, json=payload, headers=headers, timeout=timeout_sec)
-            data = _safe_json(resp)
-            err = None
-        except Exception as ex:
-            resp = None
-            data = {}
-            err = ex
+    limiter.acquire()
+    try:
+        resp = session.post(url, json=payload, headers=headers, timeout=timeout_sec)
+        data = safe_json(resp)
+        err = None
+    except Exception as ex:
+        resp = None
+        data = {}
+        err = ex
 
-        last_resp, last_data, last_err = resp, data, err
-        if not _is_retryable(resp, data, err):
-            break
+    retryable = _is_retryable(resp, data, err)
+    if retryable:
+        limiter.penalize()
+    else:
+        limiter.reward()
+    return resp, data, err, retryable
 
-        if attempt < MAX_RETRIES:
-            time.sleep(2 ** attempt)
 
-    return last_resp, last_data, last_err
+def _retry_delay(attempt: int) -> float:
+    # Exponential backoff with jitter so retried rows don't re-synchronize.
+    base = min(RETRY_MAX_DELAY_SEC, RETRY_BASE_DELAY_SEC * (2 ** (attempt - 1)))
+    return base * random.uniform(0.5, 1.5)
 
 
 def _build_status(resp: Optional[requests.Response], data: dict[str, Any], err: Optional[Exception]) -> tuple[str, Optional[str], Optional[str]]:
@@ -163,6 +210,30 @@ def _build_status(resp: Optional[requests.Response], data: dict[str, Any], err:
     return f"SEND_ERROR: http={http_code} rc={result_code}", message_id_str, str(result_code) if result_code is not None else None
 
 
+def _send_row(
+    *,
+    session: requests.Session,
+    limiter: TokenBucket,
+    base_url: str,
+    bot_id: str,
+    item: dict[str, Any],
+    file_id: Optional[str],
+    timeout_sec: int,
+) -> tuple[dict[str, Any], Optional[requests.Response], dict[str, Any], Optional[Exception], bool]:
+    item["attempts"] += 1
+    resp, data, err, retryable = _send_once(
+        session=session,
+        limiter=limiter,
+        base_url=base_url,
+        bot_id=bot_id,
+        phone_number=item["phone"],
+        text=item["text"],
+        file_id=file_id,
+        timeout_sec=timeout_sec,
+    )
+    return item, resp, data, err, retryable
+
+
 def run_splus_campaign(
     *,
     mode: str,
@@ -172,21 +243,38 @@ def run_splus_campaign(
     message_text: str,
     test_number: Optional[str],
     run_id: str,
-    sleep_sec: float = 0.2,
+    scenario_name: Optional[str] = None,
+    rate_per_sec: Optional[float] = None,
+    burst: Optional[int] = None,
+    workers: int = DEFAULT_SEND_WORKERS,
+    message_deadline_sec: float = MESSAGE_DEADLINE_SEC,
     base_url: str = DEFAULT_SPLUS_BASE_URL,
     timeout_sec: int = 60,
+    resume: bool = False,
+    progress_cb: Optional[Callable[[dict[str, Any]], None]] = None,
 ) -> dict:
+    """
+    resume=True re-uses run_dir/<run_id>: rows already logged as Sent are
+    skipped and new results are appended to the existing log.
+    progress_cb receives every progress trailer written next to the CSV log.
+    """
     ensure_runs_dir()
     run_dir = RUNS_DIR / run_id
     run_dir.mkdir(parents=True, exist_ok=True)
 
     log_path = run_dir / "run.log"
     log_csv = run_dir / "splus_message_log.csv"
+    resume = resume and mode == "send"
 
-    with open(log_path, "w", encoding="utf-8") as lf:
+    with open(log_path, "a" if resume else "w", encoding="utf-8") as lf:
+        if resume:
+            lf.write("\n=== RESUME ===\n")
         lf.write(f"mode={mode}\n")
         lf.write(f"snapshot_path={snapshot_path}\n")
         lf.write(f"file_id={file_id or ''}\n")
+        lf.write(f"campaign={scenario_name or ''}\n")
+        lf.write(f"workers={workers}\n")
+        lf.write(f"rate_per_sec={rate_per_sec or 'default'} burst={burst or 'default'}\n")
         lf.write(f"started_at={now_iso()}\n\n")
 
         try:
@@ -197,7 +285,7 @@ def run_splus_campaign(
             if not message_text or not str(message_text).strip():
                 raise ValueError("message_text is required")
 
-            df = _read_snapshot(snapshot_path)
+            df = read_snapshot(snapshot_path)
             if df.empty:
                 raise ValueError("No valid rows in snapshot after cleaning")
 
@@ -213,67 +301,138 @@ def run_splus_campaign(
                 send_df = df
                 scenario = "CPA_Panel_SPLUS_SEND"
 
-            rows: list[dict[str, Any]] = []
             total = len(send_df.index)
-            for idx, row in send_df.iterrows():
-                phone = str(row["phone_number"])
-                link = str(row["link"])
-                text = _message_text(message_text, link)
-
-                resp, data, err = _send_with_retry(
-                    base_url=base_url.rstrip("/"),
-                    bot_id=splus_bot_id.strip(),
-                    phone_number=phone,
-                    text=text,
-                    file_id=file_id,
-                    timeout_sec=timeout_sec,
-                )
-
-                status, message_id, error_code = _build_status(resp, data, err)
-                ts = datetime.now()
-                rows.append(
-                    {
-                        "phone_number": f"'{phone}",
-                        "message_id": f"'{message_id}" if message_id else "",
-                        "file_id": file_id or "",
-                        "status": status,
-                        "text": text,
-                        "scenario": scenario,
-                        "send_data": ts.strftime("%Y-%m-%d"),
-                        "send_time": ts.strftime("%H:%M"),
-                        "error_code": error_code or "",
-                    }
-                )
-
-                if err:
-                    lf.write(f"[{idx + 1}/{total}] phone={phone} error={err}\n")
-                else:
-                    lf.write(
-                        f"[{idx + 1}/{total}] phone={phone} http={resp.status_code if resp else '?'} "
-                        f"rc={data.get('result_code')} status={status}\n"
-                    )
+            done_count = 0
+            if resume:
+                sent_keys, key_col = _read_sent_keys(log_csv)
+                if len(sent_keys):
+                    second = send_df["link"]
+                    if key_col == "text":
+                        second = second.map(lambda link: _message_text(message_text, link))
+                    already = np.isin(_row_keys(send_df["phone_number"], second), sent_keys)
+                    done_count = int(already.sum())
+                    send_df = send_df[~already]
+                lf.write(f"RESUME: already sent={done_count}, remaining={len(send_df.index)}\n")
                 lf.flush()
 
-                if idx + 1 < total and sleep_sec > 0:
-                    time.sleep(sleep_sec)
-
-            with open(log_csv, "w", newline="", encoding="utf-8-sig") as cf:
-                writer = csv.DictWriter(
-                    cf,
-                    fieldnames=[
-                        "phone_number",
-                        "message_id",
-                        "file_id",
-                        "status",
-                        "text",
-                        "scenario",
-                        "send_data",
-                        "send_time",
-                        "error_code",
-                    ],
-                )
-                writer.writeheader()
-                writer.writerows(rows)
+            n_workers = max(1, min(int(workers), max(1, len(send_df.index))))
+            # Keep a bounded window of in-flight rows so huge audiences don't
+            # materialize one future per row up front.
+            max_in_flight = n_workers * 4
+            # Pacing is shared with every other run using this bot token.
+            limiter = get_rate_limiter("splus", splus_bot_id, rate_per_sec, burst)
+            row_iter = zip(send_df["phone_number"].astype(str), send_df["link"].astype(str))
+
+            # Rows waiting for a retry: (ready_at, seq, item). Healthy rows keep
+            # flowing while these wait out their backoff.
+            retry_heap: list[tuple[float, int, dict[str, Any]]] = []
+            retry_seq = 0
+            retried_rows = 0
+
+            def new_item(phone: str, link: str) -> dict[str, Any]:
+                return {
+                    "phone": phone,
+                    "link": link,
+                    "text": _message_text(message_text, link),
+                    "attempts": 0,
+                    "deadline": time.monotonic() + message_deadline_sec,
+                }
+
+            # Results are streamed to the CSV in batches (bounded memory, visible
+            # progress, crash-safe trailer) instead of being written at the end.
+            results = ResultLogWriter(
+                log_csv,
+                SPLUS_LOG_FIELDS,
+                total=total,
+                append=resume,
+                already_done=done_count,
+                on_flush=progress_cb,
+            )
+            with results, make_session(n_workers) as session, ThreadPoolExecutor(
+                max_workers=n_workers, thread_name_prefix="splus-send"
+            ) as pool:
+                in_flight = set()
+                exhausted = False
+                while True:
+                    while len(in_flight) < max_in_flight:
+                        if retry_heap and retry_heap[0][0] <= time.monotonic():
+                            item = heapq.heappop(retry_heap)[2]
+                        elif not exhausted:
+                            nxt = next(row_iter, None)
+                            if nxt is None:
+                                exhausted = True
+                                continue
+                            item = new_item(*nxt)
+                        else:
+                            break
+                        in_flight.add(
+                            pool.submit(
+                                _send_row,
+                                session=session,
+                                limiter=limiter,
+                                base_url=base_url.rstrip("/"),
+                                bot_id=splus_bot_id.strip(),
+                                item=item,
+                                file_id=file_id,
+                                timeout_sec=timeout_sec,
+                            )
+                        )
+
+                    if not in_flight:
+                        if not retry_heap:
+                            break
+                        time.sleep(max(0.0, retry_heap[0][0] - time.monotonic()))
+                        continue
+
+                    wait_timeout = None
+                    if retry_heap:
+                        wait_timeout = max(0.0, retry_heap[0][0] - time.monotonic())
+                    finished, in_flight = wait(in_flight, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        item, resp, data, err, retryable = fut.result()
+                        phone = item["phone"]
+                        attempts = item["attempts"]
+
+                        if retryable and attempts <= MAX_RETRIES:
+                            delay = _retry_delay(attempts)
+                            ready_at = time.monotonic() + delay
+                            if ready_at < item["deadline"]:
+                                retry_seq += 1
+                                heapq.heappush(retry_heap, (ready_at, retry_seq, item))
+                                if attempts == 1:
+                                    retried_rows += 1
+                                continue
+
+                        done_count += 1
+                        status, message_id, error_code = _build_status(resp, data, err)
+                        ts = datetime.now()
+                        results.write(
+                            {
+                                "phone_number": f"'{phone}",
+                                "message_id": f"'{message_id}" if message_id else "",
+                                "file_id": file_id or "",
+                                "status": status,
+                                "text": item["text"],
+                                "scenario": scenario,
+                                "send_data": ts.strftime("%Y-%m-%d"),
+                                "send_time": ts.strftime("%H:%M"),
+                                "error_code": error_code or "",
+                                "attempts": attempts,
+                                "link": item["link"],
+                            },
+                            ok=status == "Sent",
+                        )
+
+                        if err:
+                            lf.write(f"[{done_count}/{total}] phone={phone} attempts={attempts} error={err}\n")
+                        else:
+                            lf.write(
+                                f"[{done_count}/{total}] phone={phone} http={resp.status_code if resp else '?'} "
+                                f"rc={data.get('result_code')} status={status} attempts={attempts}\n"
+                            )
+                    lf.flush()
+
+            lf.write(f"\nretried_rows={retried_rows}\n")
 
             lf.write("\nOK: splus campaign completed\n")
             return {
@@ -337,7 +496,7 @@ def run_splus_upload_media(
         with open(media_path, "rb") as f:
             files = {"file": (media_name, f, content_type)}
             resp = requests.post(url, files=files, headers=headers, timeout=timeout_sec)
-            data = _safe_json(resp)
+            data = safe_json(resp)
 
         file_id_val = str(data.get("file_id", "")).strip() if isinstance(data, dict) else ""
         result_code_raw = data.get("result_code") if isinstance(data, dict) else None
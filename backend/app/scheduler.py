@@ -1,8 +1,10 @@
+import os
+import traceback
 import uuid
 from queue import Empty, Queue
-from threading import Event, Lock, Thread
+from threading import Condition, Event, Lock, Thread
+import heapq
 from datetime import datetime, timezone
-import json
 from pathlib import Path
 
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -10,8 +12,12 @@ from sqlalchemy.orm import Session
 
 from .db import SessionLocal
 from .models import ScheduledRun, Campaign, Customer, AudienceSnapshot, Run
-from .runners.rscript_runner import run_r_campaign
-from .runners.splus_runner import run_splus_campaign
+from .runners.rate_limiter import limiter_key
+from .services.campaign_jobs import campaign_job
+from .services.run_executor import finish_run
+from .services.snapshot_cache import gc_snapshots
+from .services.status_refresh import STATUS_REFRESH_INTERVAL_SEC, refresh_outstanding
+from .services.run_progress import publish_run_update
 
 scheduler = BackgroundScheduler()
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
@@ -21,7 +27,36 @@ _enqueued_ids: set[str] = set()
 _enqueue_lock = Lock()
 _poll_lock = Lock()
 _worker_stop = Event()
-_worker_thread: Thread | None = None
+_worker_threads: list[Thread] = []
+
+# Scheduled runs execute on a small worker pool. Slots cap how many run at
+# once per customer, per provider token and per platform, so independent
+# campaigns run in parallel without exceeding a provider's limits.
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", "4"))
+MAX_RUNS_PER_CUSTOMER = int(os.environ.get("SCHEDULER_MAX_RUNS_PER_CUSTOMER", "1"))
+MAX_RUNS_PER_TOKEN = int(os.environ.get("SCHEDULER_MAX_RUNS_PER_TOKEN", "1"))
+MAX_RUNS_PER_PLATFORM = {
+    "rubika": int(os.environ.get("SCHEDULER_MAX_RUBIKA_RUNS", "2")),
+    "splus": int(os.environ.get("SCHEDULER_MAX_SPLUS_RUNS", "3")),
+}
+_slots: dict[str, int] = {}
+_slots_lock = Lock()
+# Runs that were due but had no free slot; re-queued when a slot frees up.
+_deferred_ids: set[str] = set()
+
+# Event-driven wakeups: a timer thread sleeps until the earliest known run_at
+# and schedule changes wake it immediately. The DB poll is only a safety net.
+SAFETY_POLL_SEC = int(os.environ.get("SCHEDULER_SAFETY_POLL_SEC", "300"))
+# Unreferenced audience snapshots are garbage-collected on this interval.
+SNAPSHOT_GC_INTERVAL_SEC = int(os.environ.get("SNAPSHOT_GC_INTERVAL_SEC", str(6 * 3600)))
+UPCOMING_TIMERS_LIMIT = 1000
+_timer_heap: list[tuple[str, str]] = []  # (run_at key, scheduled_run_id)
+# run_at of the last row loaded when more than UPCOMING_TIMERS_LIMIT runs were
+# pending; the heap is reloaded once it drains past it. None: all loaded.
+_timer_horizon: str | None = None
+_timer_cv = Condition()
+_timer_wake = False
+_timer_thread: Thread | None = None
 
 def now_iso():
     return datetime.now(timezone.utc).isoformat()
@@ -31,7 +66,20 @@ def parse_iso(dt_str: str) -> datetime:
     s = dt_str.replace("Z", "+00:00")
     return datetime.fromisoformat(s)
 
-def _create_run_row(db: Session, campaign_id: str) -> Run:
+def to_utc_key(value: str | datetime) -> str:
+    """
+    Normalized, lexicographically sortable UTC timestamp used for
+    ScheduledRun.run_at ("2026-01-04T10:00:00.000Z"). Matches SQLite's
+    strftime('%Y-%m-%dT%H:%M:%fZ') so SQL backfills produce the same format.
+    Naive inputs are taken as UTC.
+    """
+    dt = parse_iso(value) if isinstance(value, str) else value
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    dt = dt.astimezone(timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{dt.microsecond // 1000:03d}Z"
+
+def _create_run_row(db: Session, campaign_id: str, progress_total: int | None = None) -> Run:
     rid = str(uuid.uuid4())
     run_dir = RUNS_DIR / rid
     run_dir.mkdir(parents=True, exist_ok=True)
@@ -47,11 +95,52 @@ def _create_run_row(db: Session, campaign_id: str) -> Run:
         log_path=str(log_path),
         artifacts_path=str(run_dir),
         result_json=None,
+        is_test=0,
+        progress_current=0,
+        progress_total=progress_total,
     )
     db.add(r)
     db.commit()
     return r
 
+def _run_slots(platform: str, customer_id: str, token: str | None) -> list[tuple[str, int]]:
+    return [
+        (f"customer:{customer_id}", MAX_RUNS_PER_CUSTOMER),
+        (f"token:{limiter_key(platform, token or '')}", MAX_RUNS_PER_TOKEN),
+        (f"platform:{platform}", MAX_RUNS_PER_PLATFORM.get(platform, 1)),
+    ]
+
+
+def _acquire_slots(scheduled_run_id: str, slots: list[tuple[str, int]]) -> bool:
+    # All-or-nothing, so a run never holds some slots while waiting for others.
+    with _slots_lock:
+        if any(_slots.get(key, 0) >= cap for key, cap in slots):
+            _deferred_ids.add(scheduled_run_id)
+            return False
+        for key, _ in slots:
+            _slots[key] = _slots.get(key, 0) + 1
+        return True
+
+
+def _release_slots(slots: list[tuple[str, int]]):
+    with _slots_lock:
+        for key, _ in slots:
+            n = _slots.get(key, 0) - 1
+            if n > 0:
+                _slots[key] = n
+            else:
+                _slots.pop(key, None)
+        retry = list(_deferred_ids)
+        _deferred_ids.clear()
+
+    for scheduled_run_id in retry:
+        with _enqueue_lock:
+            if scheduled_run_id in _enqueued_ids:
+                continue
+            _enqueued_ids.add(scheduled_run_id)
+        _dispatch_queue.put(scheduled_run_id)
+
+
 def _mark_scheduled_failed(db: Session, sr: ScheduledRun, reason: str):
     sr.status = "failed"
     sr.updated_at = now_iso()
@@ -69,10 +158,6 @@ def _run_single_scheduled(scheduled_run_id: str):
         if sr.status != "scheduled":
             return
 
-        sr.updated_at = now_iso()
-        sr.status = "running"
-        db.commit()
-
         c = db.query(Campaign).filter(Campaign.id == sr.campaign_id).first()
         if not c:
             _mark_scheduled_failed(db, sr, "campaign not found")
@@ -84,51 +169,33 @@ def _run_single_scheduled(scheduled_run_id: str):
             _mark_scheduled_failed(db, sr, "campaign missing customer or snapshot")
             return
 
-        run_row = _create_run_row(db, c.id)
-        sr.last_run_id = run_row.id
-        db.commit()
+        slots = _run_slots(c.platform or "rubika", cust.id, sr.token_plain)
+        if not _acquire_slots(sr.id, slots):
+            return
 
         try:
-            if c.platform == "splus":
-                out = run_splus_campaign(
-                    mode="send",
-                    splus_bot_id=sr.token_plain,
-                    snapshot_path=snap.stored_path,
-                    file_id=c.selected_file_id,
-                    message_text=c.message_text,
-                    test_number=None,
-                    run_id=run_row.id,
-                    scenario_name=c.name or c.id,
-                )
-            else:
-                out = run_r_campaign(
-                    mode="send",
-                    rubica_token=sr.token_plain,
-                    snapshot_path=snap.stored_path,
-                    service_id=cust.service_id,
-                    file_id=c.selected_file_id,
-                    message_text=c.message_text,
-                    test_number=None,
-                    run_id=run_row.id,
-                )
-        except Exception as e:
-            out = {"returncode": 999, "error": str(e)}
-
-        run_row.log_path = out.get("log_path")
-        run_row.artifacts_path = out.get("run_dir")
-        run_row.finished_at = now_iso()
-
-        if out.get("returncode") == 0:
-            run_row.status = "success"
-            sr.status = "success"
-            run_row.result_json = json.dumps({"ok": True}, ensure_ascii=False)
-        else:
-            run_row.status = "failed"
-            sr.status = "failed"
-            run_row.result_json = json.dumps({"ok": False, "returncode": out.get("returncode"), "error": out.get("error")}, ensure_ascii=False)
-
-        sr.updated_at = now_iso()
-        db.commit()
+            sr.updated_at = now_iso()
+            sr.status = "running"
+            db.commit()
+
+            run_row = _create_run_row(db, c.id, snap.row_count)
+            sr.last_run_id = run_row.id
+            db.commit()
+            publish_run_update(run_row.id)
+
+            try:
+                job = campaign_job(c, cust, snap, mode="send", token=sr.token_plain, run_id=run_row.id)
+                out = job()
+            except Exception as e:
+                out = {"returncode": 999, "error": str(e)}
+
+            finish_run(db, run_row, out)
+            sr.status = run_row.status
+            sr.updated_at = now_iso()
+            db.commit()
+            publish_run_update(run_row.id)
+        finally:
+            _release_slots(slots)
 
     finally:
         db.close()
@@ -146,50 +213,175 @@ def _worker_loop():
 
         try:
             _run_single_scheduled(scheduled_run_id)
+        except Exception:
+            # Keep the worker alive; the run stays visible in the DB for inspection.
+            traceback.print_exc()
         finally:
             _dispatch_queue.task_done()
 
 
-def process_due_scheduled_runs():
+def process_due_scheduled_runs(blocking: bool = False):
     """
     Poll DB for due scheduled_runs and enqueue them for background processing.
     This function must stay lightweight to avoid APScheduler max_instances skips.
+    The timer thread calls it with blocking=True so a wakeup is never dropped.
     """
-    if not _poll_lock.acquire(blocking=False):
+    if not _poll_lock.acquire(blocking=blocking):
         return
 
     db = SessionLocal()
     try:
-        due = db.query(ScheduledRun).filter(ScheduledRun.status == "scheduled").all()
-        now_dt = datetime.now(timezone.utc)
-        due = [x for x in due if parse_iso(x.run_at) <= now_dt]
+        # run_at is a normalized UTC key, so the due set is an index range
+        # scan on (status, run_at) instead of parsing every scheduled row.
+        due_ids = [
+            row.id
+            for row in db.query(ScheduledRun.id)
+            .filter(ScheduledRun.status == "scheduled")
+            .filter(ScheduledRun.run_at <= to_utc_key(datetime.now(timezone.utc)))
+            .order_by(ScheduledRun.run_at)
+            .all()
+        ]
 
-        for sr in due:
+        for scheduled_run_id in due_ids:
             with _enqueue_lock:
-                if sr.id in _enqueued_ids:
+                if scheduled_run_id in _enqueued_ids:
                     continue
-                _enqueued_ids.add(sr.id)
-            _dispatch_queue.put(sr.id)
+                _enqueued_ids.add(scheduled_run_id)
+            _dispatch_queue.put(scheduled_run_id)
     finally:
         db.close()
         _poll_lock.release()
 
 
+def notify_schedule_changed(scheduled_run_id: str | None = None, run_at: str | None = None):
+    """
+    Called after a schedule is created, re-armed or canceled. Registers the
+    run's time with the timer heap (if given) and wakes the timer thread.
+    """
+    global _timer_wake
+    with _timer_cv:
+        if scheduled_run_id and run_at:
+            heapq.heappush(_timer_heap, (run_at, scheduled_run_id))
+        _timer_wake = True
+        _timer_cv.notify()
+
+
+def _load_upcoming_timers():
+    """
+    Load the next UPCOMING_TIMERS_LIMIT future run times into the heap. Due
+    runs are left to process_due_scheduled_runs, which the timer thread is
+    woken to call.
+    """
+    global _timer_horizon, _timer_wake
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(ScheduledRun.id, ScheduledRun.run_at)
+            .filter(ScheduledRun.status == "scheduled")
+            .filter(ScheduledRun.run_at > to_utc_key(datetime.now(timezone.utc)))
+            .order_by(ScheduledRun.run_at)
+            .limit(UPCOMING_TIMERS_LIMIT)
+            .all()
+        )
+    finally:
+        db.close()
+    with _timer_cv:
+        _timer_heap[:] = [(row.run_at, row.id) for row in rows]
+        heapq.heapify(_timer_heap)
+        _timer_horizon = rows[-1].run_at if len(rows) >= UPCOMING_TIMERS_LIMIT else None
+        _timer_wake = True
+        _timer_cv.notify()
+
+
+def _safety_poll():
+    _load_upcoming_timers()
+    process_due_scheduled_runs()
+
+
+def _timer_loop():
+    global _timer_wake
+    while not _worker_stop.is_set():
+        with _timer_cv:
+            timeout = float(SAFETY_POLL_SEC)
+            if _timer_heap:
+                try:
+                    delta = (parse_iso(_timer_heap[0][0]) - datetime.now(timezone.utc)).total_seconds()
+                except ValueError:
+                    delta = 0.0
+                timeout = min(timeout, max(0.0, delta))
+            if timeout > 0 and not _timer_wake:
+                _timer_cv.wait(timeout)
+            _timer_wake = False
+
+            now_key = to_utc_key(datetime.now(timezone.utc))
+            while _timer_heap and _timer_heap[0][0] <= now_key:
+                heapq.heappop(_timer_heap)
+            # Past the last loaded run_at, runs that did not fit the heap
+            # would otherwise wait for the safety poll.
+            reload = _timer_horizon is not None and (not _timer_heap or _timer_heap[0][0] > _timer_horizon)
+
+        process_due_scheduled_runs(blocking=True)
+        if reload:
+            _load_upcoming_timers()
+
+
+def _gc_snapshots():
+    db = SessionLocal()
+    try:
+        gc_snapshots(db)
+    except Exception:
+        traceback.print_exc()
+    finally:
+        db.close()
+
+
+def _refresh_message_status():
+    try:
+        refresh_outstanding()
+    except Exception:
+        traceback.print_exc()
+
+
 def start_scheduler():
-    global _worker_thread
+    global _timer_thread
     if not scheduler.running:
         _worker_stop.clear()
-        if _worker_thread is None or not _worker_thread.is_alive():
-            _worker_thread = Thread(target=_worker_loop, name="scheduled-run-worker", daemon=True)
-            _worker_thread.start()
+        _worker_threads[:] = [t for t in _worker_threads if t.is_alive()]
+        for i in range(len(_worker_threads), max(1, SCHEDULER_WORKERS)):
+            t = Thread(target=_worker_loop, name=f"scheduled-run-worker-{i}", daemon=True)
+            t.start()
+            _worker_threads.append(t)
+
+        _load_upcoming_timers()
+        if _timer_thread is None or not _timer_thread.is_alive():
+            _timer_thread = Thread(target=_timer_loop, name="scheduled-run-timer", daemon=True)
+            _timer_thread.start()
 
         scheduler.add_job(
-            process_due_scheduled_runs,
+            _safety_poll,
             "interval",
-            seconds=20,
+            seconds=SAFETY_POLL_SEC,
             id="poll_scheduled_runs",
             replace_existing=True,
             max_instances=1,
             coalesce=True,
         )
+        scheduler.add_job(
+            _gc_snapshots,
+            "interval",
+            seconds=SNAPSHOT_GC_INTERVAL_SEC,
+            id="gc_audience_snapshots",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+        scheduler.add_job(
+            _refresh_message_status,
+            "interval",
+            seconds=STATUS_REFRESH_INTERVAL_SEC,
+            id="refresh_message_status",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
         scheduler.start()
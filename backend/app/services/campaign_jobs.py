@@ -0,0 +1,72 @@
+from functools import partial
+
+from ..models import AudienceSnapshot, Campaign, Customer
+from ..runners.rubika_runner import rubika_campaign_runner
+from ..runners.splus_runner import run_splus_campaign
+from .contact_history import with_suppression
+from .run_progress import progress_callback
+from .snapshot_cache import resolve_snapshot_path
+
+
+def _run_on_snapshot(runner, *, stored_path: str, snapshot_hash: str | None, snapshot_format: str, **kwargs) -> dict:
+    # Resolving the snapshot may convert a legacy upload; do it in the job.
+    snapshot_path = resolve_snapshot_path(stored_path, snapshot_hash, snapshot_format)
+    return with_suppression(runner, snapshot_path=snapshot_path, **kwargs)
+
+
+def campaign_job(
+    c: Campaign,
+    cust: Customer,
+    snap: AudienceSnapshot,
+    *,
+    mode: str,
+    token: str,
+    run_id: str,
+    test_number: str | None = None,
+    resume: bool = False,
+):
+    """
+    Bind a runner call to plain values so it can execute on the background
+    run executor or a scheduler worker after the caller's DB session is
+    closed. Used by run-now, send-test, resume and scheduled runs.
+    """
+    # Frequency cap: applied on the executor, only when actually sending.
+    suppress_days = c.suppress_days if mode == "send" else None
+    if c.platform == "splus":
+        return partial(
+            _run_on_snapshot,
+            run_splus_campaign,
+            stored_path=snap.stored_path,
+            snapshot_hash=snap.hash,
+            snapshot_format="feather",
+            customer_id=cust.id,
+            days=suppress_days,
+            mode=mode,
+            splus_bot_id=token,
+            file_id=c.selected_file_id,
+            message_text=c.message_text,
+            test_number=test_number,
+            run_id=run_id,
+            scenario_name=c.name or c.id,
+            resume=resume,
+            progress_cb=progress_callback(run_id),
+        )
+    runner, snapshot_format = rubika_campaign_runner()
+    return partial(
+        _run_on_snapshot,
+        runner,
+        stored_path=snap.stored_path,
+        snapshot_hash=snap.hash,
+        snapshot_format=snapshot_format,
+        customer_id=cust.id,
+        days=suppress_days,
+        mode=mode,
+        rubica_token=token,
+        service_id=cust.service_id,
+        file_id=c.selected_file_id,
+        message_text=c.message_text,
+        test_number=test_number,
+        run_id=run_id,
+        resume=resume,
+        progress_cb=progress_callback(run_id),
+    )
@@ -0,0 +1,271 @@
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.feather as feather
+
+from ..db import SessionLocal
+from ..models import Campaign, Run
+from .storage import DATA_DIR
+from .validation import normalize_phone_series
+
+# Per-customer index of who was last messaged when, built from the message
+# logs of finished (non-test) runs:
+#   <customer_id>.npz        phones: sorted unique uint64 canonical numbers
+#                            last_ts: int64 epoch seconds of the last successful send
+#   <customer_id>.runs.json  run ids already folded into the index
+# A lookup is one np.searchsorted over the sorted keys (O(log n) per row,
+# vectorized over the whole audience).
+HISTORY_DIR = DATA_DIR / "contact_history"
+RUNS_DIR = DATA_DIR / "runs"
+MESSAGE_LOGS = ("splus_message_log.csv", "rubika_message_log.csv")
+LOG_CHUNK_ROWS = int(os.environ.get("CONTACT_HISTORY_CHUNK_ROWS", "200000"))
+FINISHED_STATUSES = ("success", "failed")
+
+_locks: dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _customer_lock(customer_id: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(customer_id, threading.Lock())
+
+
+def _paths(customer_id: str) -> tuple[Path, Path]:
+    return HISTORY_DIR / f"{customer_id}.npz", HISTORY_DIR / f"{customer_id}.runs.json"
+
+
+def _to_epoch(ts: str | None) -> int | None:
+    if not ts:
+        return None
+    try:
+        dt = datetime.fromisoformat(ts)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def digit_keys(digits: pa.Array | pa.ChunkedArray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Digit-only phone strings (already normalized, as in the snapshot cache)
+    as uint64 keys. Returns (keys, valid); keys is 0 where valid is False
+    (empty cells, or more digits than fit in 64 bits).
+    """
+    length = pc.utf8_length(digits)
+    valid = pc.fill_null(pc.and_(pc.greater(length, 0), pc.less_equal(length, 19)), False)
+    keys = pc.cast(pc.if_else(valid, digits, "0"), pa.uint64())
+    return keys.to_numpy(), valid.to_numpy(zero_copy_only=False)
+
+
+def phone_keys(values: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """digit_keys for raw phone cells (e.g. message logs): normalized first."""
+    norm = normalize_phone_series(values)
+    return digit_keys(pa.array(norm.to_numpy(), type=pa.string(), from_pandas=True))
+
+
+def _load(customer_id: str) -> tuple[np.ndarray, np.ndarray, set[str]]:
+    index_path, runs_path = _paths(customer_id)
+    phones = np.empty(0, dtype=np.uint64)
+    last_ts = np.empty(0, dtype=np.int64)
+    if index_path.exists():
+        with np.load(index_path) as z:
+            phones, last_ts = z["phones"], z["last_ts"]
+    runs: set[str] = set()
+    if runs_path.exists():
+        runs = set(json.loads(runs_path.read_text(encoding="utf-8")))
+    return phones, last_ts, runs
+
+
+def _save(customer_id: str, phones: np.ndarray, last_ts: np.ndarray, runs: set[str]):
+    HISTORY_DIR.mkdir(parents=True, exist_ok=True)
+    index_path, runs_path = _paths(customer_id)
+    tmp = index_path.with_name(index_path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, phones=phones, last_ts=last_ts)
+    os.replace(tmp, index_path)
+    tmp = runs_path.with_name(runs_path.name + ".tmp")
+    tmp.write_text(json.dumps(sorted(runs)), encoding="utf-8")
+    os.replace(tmp, runs_path)
+
+
+def _merge(phones: np.ndarray, last_ts: np.ndarray, new_phones: np.ndarray, new_ts: np.ndarray):
+    """Union of two (phone, ts) sets keeping the latest ts per phone, sorted by phone."""
+    p = np.concatenate([phones, new_phones])
+    t = np.concatenate([last_ts, new_ts])
+    order = np.lexsort((t, p))  # by phone, then ts ascending
+    p, t = p[order], t[order]
+    last = np.ones(len(p), dtype=bool)
+    last[:-1] = p[1:] != p[:-1]
+    return p[last], t[last]
+
+
+def sent_phones(run_dir: str | Path) -> np.ndarray:
+    """Unique uint64 keys of numbers a run's message log records as delivered to the provider."""
+    found: list[np.ndarray] = []
+    for name in MESSAGE_LOGS:
+        path = Path(run_dir) / name
+        if not path.exists():
+            continue
+        chunks = pd.read_csv(
+            path,
+            usecols=lambda col: col in ("phone_number", "status", "outcome"),
+            dtype=str,
+            chunksize=LOG_CHUNK_ROWS,
+            encoding="utf-8-sig",
+            on_bad_lines="skip",
+        )
+        for chunk in chunks:
+            if "phone_number" not in chunk.columns or "status" not in chunk.columns:
+                break
+            status = chunk["status"]
+            if name.startswith("splus"):
+                ok = status == "Sent"
+            elif "outcome" in chunk.columns:
+                ok = chunk["outcome"] == "sent"
+            else:
+                ok = status.notna() & ~status.str.startswith("SEND_ERROR", na=False)
+            keys, valid = phone_keys(chunk.loc[ok, "phone_number"])
+            found.append(keys[valid])
+    if not found:
+        return np.empty(0, dtype=np.uint64)
+    return np.unique(np.concatenate(found))
+
+
+def refresh_customer_history(db, customer_id: str) -> int:
+    """
+    Fold finished, non-test runs of this customer's campaigns that are not in
+    the index yet. Returns the number of runs added.
+    """
+    with _customer_lock(customer_id):
+        phones, last_ts, done = _load(customer_id)
+        rows = (
+            db.query(Run.id, Run.artifacts_path, Run.started_at, Run.finished_at)
+            .join(Campaign, Run.campaign_id == Campaign.id)
+            .filter(Campaign.customer_id == customer_id)
+            .filter(Run.status.in_(FINISHED_STATUSES))
+            .filter(Run.is_test == 0)
+            .all()
+        )
+        added = 0
+        for run_id, artifacts_path, started_at, finished_at in rows:
+            if run_id in done:
+                continue
+            ts = _to_epoch(finished_at) or _to_epoch(started_at)
+            run_dir = artifacts_path or str(RUNS_DIR / run_id)
+            if ts is not None and os.path.isdir(run_dir):
+                new = sent_phones(run_dir)
+                if len(new):
+                    phones, last_ts = _merge(phones, last_ts, new, np.full(len(new), ts, dtype=np.int64))
+            done.add(run_id)
+            added += 1
+        if added:
+            _save(customer_id, phones, last_ts, done)
+        return added
+
+
+def recently_contacted(customer_id: str, keys: np.ndarray, days: int) -> np.ndarray:
+    """Boolean mask over keys: contacted by this customer within the last `days` days."""
+    phones, last_ts, _ = _load(customer_id)
+    if not len(phones) or not len(keys):
+        return np.zeros(len(keys), dtype=bool)
+    cutoff = int(datetime.now(timezone.utc).timestamp()) - int(days) * 86400
+    pos = np.searchsorted(phones, keys)
+    pos[pos == len(phones)] = 0
+    return (phones[pos] == keys) & (last_ts[pos] >= cutoff)
+
+
+def suppress_recent_contacts(snapshot_path: str, customer_id: str, days: int, run_id: str) -> str:
+    """
+    Write the audience minus numbers contacted in the last `days` days to the
+    run directory and return its path (same format as snapshot_path: the
+    feather or clean CSV cache). A resumed run re-uses the file written at its
+    first start so its audience does not change underneath it.
+    """
+    src = Path(snapshot_path)
+    ext = src.suffix.lower()
+    if ext not in (".feather", ".csv"):
+        raise ValueError(f"Cannot apply suppression to {src.name}: snapshot cache is unavailable")
+    run_dir = RUNS_DIR / run_id
+    out = run_dir / f"audience_suppressed{ext}"
+    if out.exists():
+        return str(out)
+
+    db = SessionLocal()
+    try:
+        refresh_customer_history(db, customer_id)
+    finally:
+        db.close()
+
+    if ext == ".feather":
+        table = feather.read_table(src, memory_map=True)
+    else:
+        table = pacsv.read_csv(
+            src,
+            convert_options=pacsv.ConvertOptions(column_types={"phone_number": pa.string()}),
+        )
+    phones = table.column("phone_number")
+    if src.name.endswith((".feather", ".clean.csv")):
+        keys, valid = digit_keys(phones)
+    else:
+        # Original upload (no cache yet): normalize like the cache would.
+        keys, valid = phone_keys(phones.to_pandas())
+    keep = ~(valid & recently_contacted(customer_id, keys, days))
+
+    run_dir.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(out.name + ".tmp")
+    kept = table.filter(pa.array(keep))
+    if ext == ".feather":
+        feather.write_feather(kept, tmp, compression="uncompressed")
+    else:
+        pacsv.write_csv(kept, tmp, pacsv.WriteOptions(quoting_style="needed"))
+    os.replace(tmp, out)
+
+    before, after = len(keep), int(keep.sum())
+    (run_dir / "suppression.json").write_text(
+        json.dumps({"days": days, "rows_before": before, "rows_after": after, "suppressed": before - after}),
+        encoding="utf-8",
+    )
+    return str(out)
+
+
+def with_suppression(runner: Callable[..., dict], *, snapshot_path: str, customer_id: str, days: int | None, run_id: str, **kwargs) -> dict:
+    """
+    Call runner on the suppressed audience (or the full one when days is not
+    set). If suppression leaves nobody to message, the run succeeds without
+    calling the runner.
+    """
+    if days:
+        snapshot_path = suppress_recent_contacts(snapshot_path, customer_id, days, run_id)
+        run_dir = RUNS_DIR / run_id
+        try:
+            counts = json.loads((run_dir / "suppression.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            counts = {}
+        if counts.get("rows_after") == 0:
+            log_path = run_dir / "run.log"
+            with open(log_path, "a", encoding="utf-8") as f:
+                f.write(
+                    f"All {counts.get('rows_before', 0)} numbers were contacted in the last {days} days; "
+                    "nothing to send.\n"
+                )
+            progress_cb = kwargs.get("progress_cb")
+            if progress_cb:
+                progress_cb({"rows": 0, "sent": 0, "failed": 0, "total": 0})
+            return {
+                "returncode": 0,
+                "run_dir": str(run_dir),
+                "log_path": str(log_path),
+                "rows_after": 0,
+                "suppressed": counts.get("suppressed"),
+            }
+    return runner(snapshot_path=snapshot_path, run_id=run_id, **kwargs)
@@ -0,0 +1,97 @@
+import asyncio
+import itertools
+import os
+import signal
+from threading import Lock
+from typing import Any
+
+# In-process pub/sub for dashboard updates. Publishers are plain threads
+# (run executor, scheduler workers, runner progress callbacks); subscribers
+# are SSE handlers running on the event loop, each with a bounded queue.
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("DASHBOARD_EVENT_QUEUE_SIZE", "1000"))
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # Set when events were dropped; the client must reload its snapshot.
+        self.overflowed = False
+
+    def _put(self, event: dict[str, Any]):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            # Wake the consumer so it notices the overflow.
+            self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+
+
+class EventBroker:
+    def __init__(self):
+        self._subs: set[Subscription] = set()
+        self._lock = Lock()
+        self._seq = itertools.count(1)
+        self.closed = False
+
+    def subscribe(self) -> Subscription:
+        sub = Subscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def close(self):
+        """On shutdown: tell every open stream to finish so the server can exit."""
+        self.closed = True
+        self.publish("close", {})
+
+    def publish(self, event_type: str, data: dict[str, Any]):
+        """Thread-safe; never blocks the publisher."""
+        with self._lock:
+            if not self._subs:
+                return
+            event = {"type": event_type, "seq": next(self._seq), "data": data}
+            subs = list(self._subs)
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._put, event)
+            except RuntimeError:
+                # Loop already closed (shutdown); drop the subscriber.
+                self.unsubscribe(sub)
+
+
+broker = EventBroker()
+
+
+def publish(event_type: str, data: dict[str, Any]):
+    broker.publish(event_type, data)
+
+
+def install_shutdown_hook():
+    """
+    uvicorn waits for open responses before running lifespan shutdown, so SSE
+    streams must be ended from the signal handler or Ctrl+C / reload hangs.
+    Call from lifespan startup (main thread, after the server's own handlers
+    are installed); the server's handler still runs afterwards.
+    """
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            broker.close()
+            previous(signum, frame)
+
+        try:
+            signal.signal(sig, handler)
+        except ValueError:
+            # Not on the main thread (e.g. embedded server): nothing to hook.
+            return
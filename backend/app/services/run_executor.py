@@ -0,0 +1,134 @@
+import json
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from ..db import SessionLocal
+from ..models import Run, ScheduledRun
+from .run_progress import publish_run_update
+
+# Background execution for API-triggered runs (run-now, send-test, resume):
+# the request handler only creates the Run row and returns its id.
+RUN_EXECUTOR_WORKERS = int(os.environ.get("RUN_EXECUTOR_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=RUN_EXECUTOR_WORKERS, thread_name_prefix="run-exec")
+_active_runs: set[str] = set()
+_active_lock = Lock()
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def is_run_active(run_id: str) -> bool:
+    with _active_lock:
+        return run_id in _active_runs
+
+
+def finish_run(db: Session, run: Run, out: dict):
+    """Record a runner result dict ({returncode, run_dir, log_path, ...}) on the Run row."""
+    run.log_path = out.get("log_path") or run.log_path
+    run.artifacts_path = out.get("run_dir") or run.artifacts_path
+    run.finished_at = now_iso()
+
+    if out.get("returncode") == 0:
+        run.status = "success"
+        run.result_json = json.dumps({"ok": True}, ensure_ascii=False)
+    else:
+        run.status = "failed"
+        run.result_json = json.dumps(
+            {"ok": False, "returncode": out.get("returncode"), "error": out.get("error")},
+            ensure_ascii=False,
+        )
+    db.commit()
+
+
+def _execute(run_id: str, job: Callable[[], dict]):
+    db = SessionLocal()
+    try:
+        r = db.query(Run).filter(Run.id == run_id).first()
+        if not r:
+            return
+        # Queue wait is not run time: the run starts when a worker picks it up.
+        r.status = "running"
+        r.started_at = now_iso()
+        db.commit()
+        publish_run_update(run_id)
+
+        try:
+            out = job()
+        except Exception as e:
+            out = {"returncode": 999, "error": str(e)}
+            if r.log_path:
+                with open(r.log_path, "a", encoding="utf-8") as f:
+                    f.write("\n\n=== RUN EXECUTOR ERROR ===\n")
+                    f.write(traceback.format_exc() + "\n")
+
+        finish_run(db, r, out)
+        publish_run_update(run_id)
+    finally:
+        db.close()
+        with _active_lock:
+            _active_runs.discard(run_id)
+
+
+def reserve_run(run_id: str) -> bool:
+    """
+    Mark run_id as taken before its row is updated, so a caller that loses
+    the race learns it before changing anything. Follow with
+    submit_run(..., reserved=True) or release_run().
+    """
+    with _active_lock:
+        if run_id in _active_runs:
+            return False
+        _active_runs.add(run_id)
+        return True
+
+
+def release_run(run_id: str):
+    with _active_lock:
+        _active_runs.discard(run_id)
+
+
+def submit_run(run_id: str, job: Callable[[], dict], *, reserved: bool = False) -> bool:
+    """
+    Queue job (a runner call returning the usual result dict) for the Run row
+    run_id. Returns False if that run is already queued or executing.
+    """
+    if not reserved and not reserve_run(run_id):
+        return False
+    _executor.submit(_execute, run_id, job)
+    return True
+
+
+def fail_orphaned_runs() -> int:
+    """
+    Startup: runs still queued or running belonged to a previous process and
+    will never finish. Mark them failed (and their scheduled runs) so they
+    show up as interrupted and can be resumed.
+    """
+    db = SessionLocal()
+    try:
+        orphans = db.query(Run).filter(Run.status.in_(("queued", "running"))).all()
+        for r in orphans:
+            r.status = "failed"
+            r.finished_at = now_iso()
+            r.result_json = json.dumps(
+                {"ok": False, "returncode": None, "error": "interrupted by a server restart"},
+                ensure_ascii=False,
+            )
+            if r.log_path and os.path.exists(r.log_path):
+                with open(r.log_path, "a", encoding="utf-8") as f:
+                    f.write("\n\n=== RUN INTERRUPTED BY SERVER RESTART ===\n")
+        db.query(ScheduledRun).filter(ScheduledRun.status == "running").update(
+            {ScheduledRun.status: "failed", ScheduledRun.updated_at: now_iso()}, synchronize_session=False
+        )
+        db.commit()
+        return len(orphans)
+    finally:
+        db.close()
@@ -0,0 +1,231 @@
+import csv
+import os
+import re
+import traceback
+from datetime import datetime, timezone
+from functools import partial
+from typing import Any, Callable
+
+from ..db import SessionLocal
+from ..models import Run, Campaign, Customer, AudienceSnapshot
+from .events import publish
+
+# Runners report progress as the "<log_csv>.progress.json" trailer dict
+# ({rows, sent, failed, total, complete}); publish_progress stores it on the
+# Run row so the dashboard can answer from one indexed query.
+
+PROGRESS_RE = re.compile(r"\[(\d+)\s*/\s*(\d+)\]")
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def dashboard_row(r: Run, c: Campaign, cust: Customer) -> dict[str, Any]:
+    progress_pct = None
+    if r.progress_current is not None and r.progress_total and r.progress_total > 0:
+        progress_pct = round((r.progress_current / r.progress_total) * 100, 2)
+
+    return {
+        "run_id": r.id,
+        "campaign_id": c.id,
+        "campaign_name": c.name,
+        "customer_id": cust.id,
+        "customer_name": cust.name,
+        "status": r.status,
+        "started_at": r.started_at,
+        "finished_at": r.finished_at,
+        "artifacts_path": r.artifacts_path,  # not needed in UI but handy
+        "has_log": bool(r.log_path),
+        "has_result": bool(r.artifacts_path),
+        "progress_current": r.progress_current,
+        "progress_total": r.progress_total,
+        "progress_pct": progress_pct,
+        "sent_count": r.sent_count,
+        "failed_count": r.failed_count,
+    }
+
+
+def publish_run_update(run_id: str):
+    """
+    Push the run's full dashboard row to /dashboard/events subscribers.
+    Called on lifecycle changes (created, queued, running, finished).
+    """
+    db = SessionLocal()
+    try:
+        row = (
+            db.query(Run, Campaign, Customer)
+            .join(Campaign, Run.campaign_id == Campaign.id)
+            .join(Customer, Campaign.customer_id == Customer.id)
+            .filter(Run.id == run_id)
+            .first()
+        )
+        if row is None or row[0].is_test:
+            return
+        publish("run", dashboard_row(*row))
+    finally:
+        db.close()
+
+
+def publish_progress(run_id: str, trailer: dict[str, Any]):
+    values: dict[str, Any] = {
+        "progress_current": int(trailer.get("rows") or 0),
+        "sent_count": int(trailer.get("sent") or 0),
+        "failed_count": int(trailer.get("failed") or 0),
+        "progress_updated_at": now_iso(),
+    }
+    if trailer.get("total") is not None:
+        values["progress_total"] = int(trailer["total"])
+
+    db = SessionLocal()
+    try:
+        db.query(Run).filter(Run.id == run_id).update(values, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+    delta = {
+        "run_id": run_id,
+        "progress_current": values["progress_current"],
+        "sent_count": values["sent_count"],
+        "failed_count": values["failed_count"],
+    }
+    total = values.get("progress_total")
+    if total:
+        delta["progress_total"] = total
+        delta["progress_pct"] = round((values["progress_current"] / total) * 100, 2)
+    publish("progress", delta)
+
+
+def progress_callback(run_id: str) -> Callable[[dict[str, Any]], None]:
+    """Callback for a runner's progress_cb argument, bound to one Run row."""
+    return partial(publish_progress, run_id)
+
+
+# ---- one-time backfill for runs created before progress was persisted ----
+
+def read_log_text_tail(log_path: str | None, max_bytes: int = 256 * 1024) -> str:
+    if not log_path or not os.path.exists(log_path):
+        return ""
+
+    try:
+        # Read only tail for performance; latest progress line is near file end.
+        with open(log_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            tail = min(size, max_bytes)
+            f.seek(-tail, os.SEEK_END)
+            return f.read().decode("utf-8", errors="ignore")
+    except Exception:
+        return ""
+
+
+def read_log_text_head(log_path: str | None, max_bytes: int = 8 * 1024) -> str:
+    if not log_path or not os.path.exists(log_path):
+        return ""
+    try:
+        with open(log_path, "rb") as f:
+            return f.read(max_bytes).decode("utf-8", errors="ignore")
+    except Exception:
+        return ""
+
+
+def is_test_run(log_path: str | None) -> bool:
+    head = read_log_text_head(log_path)
+    if not head:
+        return False
+    h = head.lower()
+    return ("mode=test" in h) or ("--mode test" in h)
+
+
+def extract_progress_from_log(log_path: str | None) -> tuple[int | None, int | None]:
+    text = read_log_text_tail(log_path)
+    if not text:
+        return None, None
+
+    matches = PROGRESS_RE.findall(text)
+    if not matches:
+        return None, None
+
+    cur, total = matches[-1]
+    try:
+        return int(cur), int(total)
+    except Exception:
+        return None, None
+
+
+def _csv_row_count(csv_path: str) -> int | None:
+    if not csv_path or not os.path.exists(csv_path):
+        return None
+    try:
+        # subtract header row if present
+        with open(csv_path, "r", encoding="utf-8", errors="ignore", newline="") as f:
+            reader = csv.reader(f)
+            n = sum(1 for _ in reader)
+        if n <= 0:
+            return 0
+        return max(0, n - 1)
+    except Exception:
+        return None
+
+
+def infer_progress_from_artifacts(run: Run, snapshot_row_count: int | None) -> tuple[int | None, int | None]:
+    if not run.artifacts_path:
+        return None, None
+
+    splus_csv = os.path.join(run.artifacts_path, "splus_message_log.csv")
+    rubika_csv = os.path.join(run.artifacts_path, "rubika_message_log.csv")
+    sent = _csv_row_count(splus_csv)
+    if sent is None:
+        sent = _csv_row_count(rubika_csv)
+    if sent is None:
+        return None, None
+
+    if snapshot_row_count and snapshot_row_count > 0:
+        return sent, snapshot_row_count
+    if run.status in ("success", "failed"):
+        return sent, sent
+    return sent, None
+
+
+def backfill_legacy_runs(batch_size: int = 200):
+    """
+    Fill is_test/progress for runs recorded before these columns existed,
+    scraping their logs once. Runs with is_test set are never touched again.
+    """
+    db = SessionLocal()
+    try:
+        snap_rows: dict[str, int | None] = {}
+        while True:
+            rows = (
+                db.query(Run, Campaign)
+                .outerjoin(Campaign, Run.campaign_id == Campaign.id)
+                .filter(Run.is_test.is_(None))
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+
+            for r, c in rows:
+                r.is_test = 1 if is_test_run(r.log_path) else 0
+                if r.progress_current is not None:
+                    continue
+
+                cur, total = extract_progress_from_log(r.log_path)
+                if cur is None:
+                    sid = c.audience_snapshot_id if c else None
+                    if sid and sid not in snap_rows:
+                        s = db.query(AudienceSnapshot).filter(AudienceSnapshot.id == sid).first()
+                        snap_rows[sid] = int(s.row_count) if s else None
+                    cur, total = infer_progress_from_artifacts(r, snap_rows.get(sid) if sid else None)
+
+                r.progress_current = cur
+                r.progress_total = total
+                r.progress_updated_at = now_iso()
+            db.commit()
+    except Exception:
+        db.rollback()
+        traceback.print_exc()
+    finally:
+        db.close()
@@ -0,0 +1,232 @@
+import os
+import traceback
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator
+
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from ..models import AudienceSnapshot, Campaign
+from .storage import SNAPSHOT_DIR
+from .validation import PREVIEW_ROWS, StreamingValidator
+
+# Parsed, cleaned copies of uploaded audiences keyed by AudienceSnapshot.hash,
+# written once at upload so runners never re-parse the original CSV/XLSX:
+#   <hash>.feather    uncompressed Arrow IPC, memory-mapped by the Python runners
+#   <hash>.clean.csv  two plain text columns for the R runner (fread)
+SNAPSHOT_CACHE_DIR = SNAPSHOT_DIR / "cache"
+CACHE_COLUMNS = ["phone_number", "link"]
+CACHE_SCHEMA = pa.schema([(c, pa.string()) for c in CACHE_COLUMNS])
+AUDIENCE_CHUNK_ROWS = int(os.environ.get("AUDIENCE_CHUNK_ROWS", "100000"))
+
+
+def cache_paths(snapshot_hash: str) -> tuple[Path, Path]:
+    return (
+        SNAPSHOT_CACHE_DIR / f"{snapshot_hash}.feather",
+        SNAPSHOT_CACHE_DIR / f"{snapshot_hash}.clean.csv",
+    )
+
+
+class SnapshotCacheWriter:
+    """
+    Writes the cache for one snapshot chunk by chunk (bounded memory for
+    large uploads). Files are written to temporary names and only appear
+    under their final names on commit(). If the cache for this hash already
+    exists, writing is skipped.
+    """
+
+    def __init__(self, snapshot_hash: str):
+        SNAPSHOT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        self.feather_path, self.csv_path = cache_paths(snapshot_hash)
+        self.skip = self.feather_path.exists() and self.csv_path.exists()
+        suffix = f".{uuid.uuid4().hex}.tmp"
+        self._feather_tmp = self.feather_path.with_name(self.feather_path.name + suffix)
+        self._csv_tmp = self.csv_path.with_name(self.csv_path.name + suffix)
+        self._ipc = None
+        self._csv_header = True
+
+    def write(self, df: pd.DataFrame):
+        """df: a chunk cleaned by validate_and_clean / StreamingValidator."""
+        if self.skip or df.empty:
+            return
+        out = pd.DataFrame({c: df[c].astype(str) for c in CACHE_COLUMNS})
+        table = pa.Table.from_pandas(out, schema=CACHE_SCHEMA, preserve_index=False)
+        if self._ipc is None:
+            # Uncompressed Arrow IPC file == feather v2, memory-mappable.
+            self._ipc = pa.ipc.new_file(str(self._feather_tmp), CACHE_SCHEMA)
+        self._ipc.write_table(table)
+        out.to_csv(self._csv_tmp, mode="a", header=self._csv_header, index=False, encoding="utf-8")
+        self._csv_header = False
+
+    def commit(self):
+        if self.skip:
+            return
+        if self._ipc is None:
+            self.abort()
+            return
+        self._ipc.close()
+        os.replace(self._feather_tmp, self.feather_path)
+        os.replace(self._csv_tmp, self.csv_path)
+
+    def abort(self):
+        if self._ipc is not None:
+            self._ipc.close()
+            self._ipc = None
+        for tmp in (self._feather_tmp, self._csv_tmp):
+            tmp.unlink(missing_ok=True)
+
+
+def iter_audience_chunks(path: Path | str, chunk_rows: int = AUDIENCE_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Read an uploaded audience file as DataFrames of at most chunk_rows rows.
+    CSV cells are read as text. .xlsx is streamed with openpyxl read-only
+    mode. Legacy .xls has no streaming reader and is loaded whole.
+    """
+    p = Path(path)
+    ext = p.suffix.lower()
+    if ext == ".csv":
+        yield from pd.read_csv(p, chunksize=chunk_rows, dtype=str)
+    elif ext == ".xlsx":
+        wb = openpyxl.load_workbook(p, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = [str(c) if c is not None else "" for c in header]
+            batch: list[tuple] = []
+            for row in rows:
+                batch.append(row[: len(columns)])
+                if len(batch) >= chunk_rows:
+                    yield pd.DataFrame.from_records(batch, columns=columns)
+                    batch = []
+            if batch:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+        finally:
+            wb.close()
+    elif ext == ".xls":
+        yield pd.read_excel(p)
+    else:
+        raise ValueError(f"Unsupported file type: {ext}")
+
+
+def ingest_audience_file(path: Path | str, snapshot_hash: str) -> StreamingValidator:
+    """
+    Validate an audience file chunk by chunk and write its cache. Returns the
+    validator (row counts, notes, preview). The cache is only committed
+    when at least one valid row was found.
+    """
+    validator = StreamingValidator()
+    writer = SnapshotCacheWriter(snapshot_hash)
+    try:
+        for chunk in iter_audience_chunks(path):
+            cleaned = validator.feed(chunk)
+            if cleaned is None:
+                break
+            writer.write(cleaned)
+        if validator.missing or validator.rows_out == 0:
+            writer.abort()
+        else:
+            writer.commit()
+    except Exception:
+        writer.abort()
+        raise
+    return validator
+
+
+def resolve_snapshot_path(stored_path: str, snapshot_hash: str | None, fmt: str) -> str:
+    """
+    Path a runner should load for a snapshot: the cached "feather" (Python
+    runners) or "csv" (R runner) file. Snapshots uploaded before the cache
+    existed are converted on first use, so call this from the job, not the
+    request; if that fails the original file is returned and the runner
+    parses it as before.
+    """
+    if not snapshot_hash:
+        return stored_path
+    feather_path, csv_path = cache_paths(snapshot_hash)
+    path = feather_path if fmt == "feather" else csv_path
+    if not path.exists():
+        try:
+            ingest_audience_file(stored_path, snapshot_hash)
+        except Exception:
+            traceback.print_exc()
+            return stored_path
+        if not path.exists():
+            # Nothing valid to cache (missing columns, no valid rows): the
+            # runner parses the original and reports the real error.
+            return stored_path
+    return str(path)
+
+
+def snapshot_path_for_runner(snap: AudienceSnapshot, fmt: str) -> str:
+    return resolve_snapshot_path(snap.stored_path, snap.hash, fmt)
+
+
+def legacy_snapshot_meta(snap: AudienceSnapshot) -> dict:
+    """Preview for snapshots stored before meta_json existed (dedup hits)."""
+    try:
+        path = snapshot_path_for_runner(snap, "feather")
+        if not path.endswith(".feather"):
+            return {}
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        return {"columns": table.column_names, "preview": table.slice(0, PREVIEW_ROWS).to_pylist()}
+    except Exception:
+        return {}
+
+
+# ---- garbage collection ------------------------------------------------------
+
+# Unreferenced snapshots are kept this long after their last upload (dedup
+# hits included), so an upload is not collected before the user has created
+# a campaign for it.
+SNAPSHOT_GC_GRACE_SEC = int(os.environ.get("SNAPSHOT_GC_GRACE_SEC", str(24 * 3600)))
+
+
+def gc_snapshots(db: Session) -> dict:
+    """
+    Delete snapshots no campaign references together with their stored file
+    and cache, then sweep files in the snapshot directories that no snapshot
+    row points to. The campaigns table is the only reference record: a
+    snapshot is in use exactly while some campaign's audience_snapshot_id
+    points at it, so there is no counter to drift out of sync.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=SNAPSHOT_GC_GRACE_SEC)
+    referenced = select(Campaign.id).where(Campaign.audience_snapshot_id == AudienceSnapshot.id).exists()
+    stale = (
+        db.query(AudienceSnapshot)
+        .filter(func.coalesce(AudienceSnapshot.last_used_at, AudienceSnapshot.created_at) < cutoff.isoformat())
+        .filter(~referenced)
+        .all()
+    )
+    for snap in stale:
+        Path(snap.stored_path).unlink(missing_ok=True)
+        if snap.hash:
+            for p in cache_paths(snap.hash):
+                p.unlink(missing_ok=True)
+        db.delete(snap)
+    db.commit()
+
+    # Orphans: duplicates folded by the schema migration, uploads interrupted
+    # before their row was written, caches of deleted snapshots.
+    live_paths = {str(Path(p).resolve()) for (p,) in db.query(AudienceSnapshot.stored_path)}
+    live_hashes = {h for (h,) in db.query(AudienceSnapshot.hash)}
+    cutoff_ts = cutoff.timestamp()
+    orphans = 0
+    for p in list(SNAPSHOT_DIR.glob("*")) + list(SNAPSHOT_CACHE_DIR.glob("*")):
+        if not p.is_file() or p.stat().st_mtime >= cutoff_ts:
+            continue
+        if p.parent == SNAPSHOT_CACHE_DIR:
+            if p.name.split(".", 1)[0] in live_hashes:
+                continue
+        elif str(p.resolve()) in live_paths:
+            continue
+        p.unlink(missing_ok=True)
+        orphans += 1
+
+    return {"snapshots_deleted": len(stale), "orphan_files_deleted": orphans}
@@ -0,0 +1,232 @@
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Any, Optional
+
+import pandas as pd
+from sqlalchemy import func, or_, text
+from sqlalchemy.orm import Session
+
+from ..db import SessionLocal
+from ..models import Campaign, MessageStatus, Run, ScheduledRun
+from ..runners.rate_limiter import get_rate_limiter
+from ..runners.http_common import is_throttled, make_session
+from ..runners.rubika_runner import DEFAULT_RUBIKA_BASE_URL, get_messages_status, status_list
+
+# Delivery status refresh for Rubika runs. A finished run's message ids are
+# loaded once from rubika_message_log.csv into message_status; afterwards
+# only ids whose status is not final are polled through getMessagesStatus,
+# STATUS_BATCH_SIZE ids per call with STATUS_REFRESH_WORKERS calls in
+# flight, and only changed rows are written. The log CSV is never rewritten.
+STATUS_REFRESH_INTERVAL_SEC = int(os.environ.get("STATUS_REFRESH_INTERVAL_SEC", "900"))
+STATUS_BATCH_SIZE = 1000
+STATUS_REFRESH_WORKERS = int(os.environ.get("STATUS_REFRESH_WORKERS", "4"))
+# Runs that finished longer ago than this are no longer polled.
+STATUS_REFRESH_MAX_AGE_HOURS = float(os.environ.get("STATUS_REFRESH_MAX_AGE_HOURS", "72"))
+FINAL_STATUSES = tuple(
+    s.strip() for s in os.environ.get("RUBIKA_FINAL_STATUSES", "Seen,Failed").split(",") if s.strip()
+)
+LOG_NAME = "rubika_message_log.csv"
+
+# Tokens of manually started runs are only kept in memory (they are never
+# stored); scheduled runs fall back to their ScheduledRun.token_plain.
+_run_tokens: dict[str, str] = {}
+_active_runs: set[str] = set()
+_lock = Lock()
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def remember_run_token(run_id: str, token: str):
+    with _lock:
+        _run_tokens[run_id] = token
+
+
+def _token_for(db: Session, run_id: str) -> Optional[str]:
+    with _lock:
+        token = _run_tokens.get(run_id)
+    if token:
+        return token
+    sr = db.query(ScheduledRun.token_plain).filter(ScheduledRun.last_run_id == run_id).first()
+    return sr[0] if sr and sr[0] else None
+
+
+def seed_run(db: Session, run: Run) -> int:
+    """Load a finished run's message ids into message_status (once per run)."""
+    path = Path(run.artifacts_path or "") / LOG_NAME
+    seeded = 0
+    if run.artifacts_path and path.exists():
+        chunks = pd.read_csv(
+            path,
+            usecols=lambda c: c in ("phone_number", "message_id", "status"),
+            dtype=str,
+            keep_default_na=False,
+            encoding="utf-8-sig",
+            on_bad_lines="skip",
+            chunksize=200_000,
+        )
+        for chunk in chunks:
+            if "message_id" not in chunk.columns or "status" not in chunk.columns:
+                break
+            message_id = chunk["message_id"].str.lstrip("'")
+            keep = (message_id != "") & (message_id != "NA") & ~chunk["status"].str.startswith("SEND_ERROR")
+            if not keep.any():
+                continue
+            frame = pd.DataFrame({
+                "message_id": message_id[keep],
+                "phone_number": chunk["phone_number"][keep].str.lstrip("'") if "phone_number" in chunk else None,
+                "status": chunk["status"][keep],
+            })
+            rows = [
+                {"run_id": run.id, "message_id": m, "phone_number": p, "status": s}
+                for m, p, s in frame.itertuples(index=False, name=None)
+            ]
+            db.execute(
+                text(
+                    "INSERT OR IGNORE INTO message_status "
+                    "(run_id, message_id, phone_number, status, status_at_send, updated_at) "
+                    "VALUES (:run_id, :message_id, :phone_number, :status, :status, NULL)"
+                ),
+                rows,
+            )
+            seeded += len(rows)
+    run.status_synced_at = now_iso()
+    db.commit()
+    return seeded
+
+
+def _fetch_batch(session, limiter, token: str, ids: list[str]) -> dict[str, str]:
+    limiter.acquire()
+    resp, obj = get_messages_status(session, DEFAULT_RUBIKA_BASE_URL, token, ids, 60)
+    if is_throttled(resp):
+        limiter.penalize()
+        return {}
+    limiter.reward()
+    return {
+        str(m["message_id"]): str(m["status"])
+        for m in status_list(obj)
+        if m.get("message_id") and m.get("status")
+    }
+
+
+def refresh_run(run_id: str, token: Optional[str] = None) -> dict[str, Any]:
+    """Poll the non-final messages of one run and store the changes."""
+    with _lock:
+        if run_id in _active_runs:
+            return {"run_id": run_id, "skipped": "already refreshing"}
+        _active_runs.add(run_id)
+
+    db = SessionLocal()
+    try:
+        run = db.query(Run).filter(Run.id == run_id).first()
+        if not run:
+            return {"run_id": run_id, "skipped": "run not found"}
+        if run.status_synced_at is None:
+            seed_run(db, run)
+        token = token or _token_for(db, run_id)
+        if not token:
+            return {"run_id": run_id, "skipped": "no token"}
+
+        ids = [
+            m for (m,) in db.query(MessageStatus.message_id)
+            .filter(MessageStatus.run_id == run_id)
+            .filter(or_(MessageStatus.status.is_(None), MessageStatus.status.notin_(FINAL_STATUSES)))
+        ]
+        batches = [ids[i:i + STATUS_BATCH_SIZE] for i in range(0, len(ids), STATUS_BATCH_SIZE)]
+        checked = 0
+        if batches:
+            limiter = get_rate_limiter("rubika", token)
+            n_workers = max(1, min(STATUS_REFRESH_WORKERS, len(batches)))
+            with make_session(n_workers) as session, ThreadPoolExecutor(
+                max_workers=n_workers, thread_name_prefix="status-refresh"
+            ) as pool:
+                futures = [pool.submit(_fetch_batch, session, limiter, token, b) for b in batches]
+                for fut in as_completed(futures):
+                    try:
+                        statuses = fut.result()
+                    except Exception:
+                        traceback.print_exc()
+                        continue
+                    if not statuses:
+                        continue
+                    ts = now_iso()
+                    # SQLite evaluates every SET expression against the old
+                    # row, so updated_at only moves when the status changed.
+                    db.execute(
+                        text(
+                            "UPDATE message_status SET "
+                            "updated_at = CASE WHEN status IS NOT :status THEN :ts ELSE updated_at END, "
+                            "status = :status, checked_at = :ts "
+                            "WHERE run_id = :run_id AND message_id = :message_id"
+                        ),
+                        [{"status": s, "ts": ts, "run_id": run_id, "message_id": m} for m, s in statuses.items()],
+                    )
+                    db.commit()
+                    checked += len(statuses)
+        return {"run_id": run_id, "outstanding": len(ids), "checked": checked}
+    finally:
+        db.close()
+        with _lock:
+            _active_runs.discard(run_id)
+
+
+def refresh_run_in_background(run_id: str, token: Optional[str] = None) -> bool:
+    with _lock:
+        if run_id in _active_runs:
+            return False
+    Thread(target=refresh_run, args=(run_id, token), name=f"status-refresh-{run_id[:8]}", daemon=True).start()
+    return True
+
+
+def status_summary(db: Session, run_id: str) -> dict[str, Any]:
+    rows = (
+        db.query(MessageStatus.status, func.count(), func.max(MessageStatus.checked_at))
+        .filter(MessageStatus.run_id == run_id)
+        .group_by(MessageStatus.status)
+        .all()
+    )
+    counts = {status or "": n for status, n, _ in rows}
+    return {
+        "run_id": run_id,
+        "counts": counts,
+        "total": sum(counts.values()),
+        "pending": sum(n for status, n in counts.items() if status not in FINAL_STATUSES),
+        "last_checked_at": max((c for _, _, c in rows if c), default=None),
+    }
+
+
+def refresh_outstanding():
+    """Scheduler job: refresh every recent, finished Rubika send run."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(hours=STATUS_REFRESH_MAX_AGE_HOURS)).isoformat()
+    db = SessionLocal()
+    try:
+        run_ids = [
+            r for (r,) in db.query(Run.id)
+            .join(Campaign, Run.campaign_id == Campaign.id)
+            .filter(Campaign.platform == "rubika")
+            .filter(Run.is_test == 0)
+            .filter(Run.status.in_(("success", "failed")))
+            .filter(Run.finished_at >= cutoff)
+        ]
+        with _lock:
+            remembered = list(_run_tokens)
+        expired = {
+            r for (r,) in db.query(Run.id).filter(Run.id.in_(remembered)).filter(Run.finished_at < cutoff)
+        } if remembered else set()
+    finally:
+        db.close()
+
+    with _lock:
+        for run_id in expired:
+            _run_tokens.pop(run_id, None)
+
+    for run_id in run_ids:
+        try:
+            refresh_run(run_id)
+        except Exception:
+            traceback.print_exc()
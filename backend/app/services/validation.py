@@ -1,50 +1,129 @@
-import re
+import os
+import numpy as np
 import pandas as pd
 
 REQUIRED_COLS = {"phone_number", "link"}
 OPTIONAL_COLS = {"source"}
+PREVIEW_ROWS = 10
 
-def normalize_phone(v) -> str | None:
-    if v is None or (isinstance(v, float) and pd.isna(v)):
-        return None
-    s = str(v).strip()
-    if not s:
-        return None
-    s = re.sub(r"[^0-9]", "", s)
-    return s or None
+# Phone numbers are canonicalized to international form without "+", so the
+# same subscriber gets the same key whichever way a file spelled it:
+#   00989121234567 / +98 912 123 4567 / 09121234567 / 9121234567 -> 989121234567
+# The national-number rule (10 digits starting with 9) is Iran's mobile plan;
+# PHONE_COUNTRY_CODE is the code prepended to such numbers.
+PHONE_COUNTRY_CODE = os.environ.get("PHONE_COUNTRY_CODE", "98")
+PHONE_CANONICALIZE = os.environ.get("PHONE_CANONICALIZE", "1") != "0"
 
-def validate_and_clean(df: pd.DataFrame) -> tuple[pd.DataFrame, list[str]]:
-    errors: list[str] = []
+def canonicalize_phones(digits: pd.Series, country_code: str = PHONE_COUNTRY_CODE) -> pd.Series:
+    """digits: digit-only strings (see normalize_phone_series)."""
+    # "00" is the international call prefix: 0098… / 0044… -> 98… / 44…
+    s = digits.str.replace(r"^00", "", regex=True)
+    # National mobile numbers with or without the trunk 0: 0912…, 912… -> 98912…
+    return s.str.replace(r"^0?(9\d{9})$", country_code + r"\1", regex=True)
 
-    cols = {c.strip() for c in df.columns}
-    missing = REQUIRED_COLS - cols
-    if missing:
-        errors.append(f"Missing required columns: {sorted(missing)}. Required: {sorted(REQUIRED_COLS)}")
-        return df, errors
+def normalize_phone_series(values: pd.Series, canonicalize: bool = PHONE_CANONICALIZE) -> pd.Series:
+    """
+    Vectorized phone cleanup for a whole column: keeps digits only, maps
+    NaN/None/empty/no-digit cells to None and (by default) canonicalizes the
+    country code. Float cells (Excel, numeric CSV columns) lose their ".0".
+    """
+    mask = values.notna()
+    # Arrow-backed strings run the regexes in native code (RE2), not per cell in Python.
+    s = values[mask].astype(str).astype("string[pyarrow]").str.strip()
+    dotted = s.str.contains(".", regex=False)
+    if dotted.any():
+        s = s.mask(dotted, s.str.replace(r"\.0+$", "", regex=True))
+    s = s.str.replace(r"[^0-9]", "", regex=True)
+    if canonicalize:
+        s = canonicalize_phones(s)
+
+    out = pd.Series(np.full(len(values), None, dtype=object), index=values.index)
+    out[mask] = s.astype(object).where(s != "", None)
+    return out
+
+def normalize_phone(v) -> str | None:
+    return normalize_phone_series(pd.Series([v], dtype=object)).iloc[0]
 
+def missing_columns(columns) -> set[str]:
+    return REQUIRED_COLS - {str(c).strip() for c in columns}
+
+def clean_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Normalize phone_number/link and drop rows where either is empty."""
     # Keep only required + optional + any extra (we will keep extra for future)
     # But we normalize required columns
     df = df.copy()
-    df["phone_number"] = df["phone_number"].apply(normalize_phone)
+    df["phone_number"] = normalize_phone_series(df["phone_number"])
     df["link"] = df["link"].astype(str).str.strip()
 
     # drop invalid
-    before = len(df)
     df = df[df["phone_number"].notna()]
     df = df[df["link"].notna() & (df["link"].str.len() > 0)]
-    after = len(df)
+    return df
 
+def summarize(before: int, after: int, dup_count: int) -> list[str]:
+    errors: list[str] = []
     if after == 0:
         errors.append("No valid rows left after cleaning (phone_number/link).")
-        return df, errors
-
-    # duplicates by phone_number+link
-    dup_count = int(df.duplicated(subset=["phone_number", "link"]).sum())
+        return errors
 
     # stats (not errors but useful)
     if after < before:
         errors.append(f"Removed {before - after} invalid rows (empty phone_number or link).")
     if dup_count > 0:
         errors.append(f"Found {dup_count} duplicate rows (phone_number+link). (We keep them for now.)")
+    return errors
+
+def validate_and_clean(df: pd.DataFrame) -> tuple[pd.DataFrame, list[str]]:
+    missing = missing_columns(df.columns)
+    if missing:
+        return df, [f"Missing required columns: {sorted(missing)}. Required: {sorted(REQUIRED_COLS)}"]
+
+    before = len(df)
+    df = clean_rows(df)
+
+    # duplicates by phone_number+link
+    dup_count = int(df.duplicated(subset=["phone_number", "link"]).sum())
+
+    return df, summarize(before, len(df), dup_count)
+
+
+class StreamingValidator:
+    """
+    validate_and_clean for a file read in chunks: feed() cleans one chunk and
+    returns it, while row counts, duplicates (as 64-bit phone+link hashes,
+    8 bytes per row) and the preview are accumulated for notes().
+    """
+
+    def __init__(self):
+        self.columns: list[str] | None = None
+        self.missing: set[str] = set()
+        self.rows_in = 0
+        self.rows_out = 0
+        self.preview: list[dict] = []
+        self._keys: list[np.ndarray] = []
+
+    def feed(self, chunk: pd.DataFrame) -> pd.DataFrame | None:
+        if self.columns is None:
+            self.columns = [str(c) for c in chunk.columns]
+            self.missing = missing_columns(chunk.columns)
+        if self.missing:
+            return None
+
+        self.rows_in += len(chunk)
+        chunk = clean_rows(chunk)
+        self.rows_out += len(chunk)
+        if len(chunk):
+            self._keys.append(
+                pd.util.hash_pandas_object(chunk[["phone_number", "link"]], index=False).to_numpy()
+            )
+        if len(self.preview) < PREVIEW_ROWS:
+            head = chunk.head(PREVIEW_ROWS - len(self.preview)).astype(object)
+            self.preview.extend(head.where(head.notna(), None).to_dict(orient="records"))
+        return chunk
 
-    return df, errors
+    def notes(self) -> list[str]:
+        if self.missing:
+            return [f"Missing required columns: {sorted(self.missing)}. Required: {sorted(REQUIRED_COLS)}"]
+        keys = np.concatenate(self._keys) if self._keys else np.empty(0, dtype=np.uint64)
+        dup_count = int(len(keys) - len(np.unique(keys)))
+        return summarize(self.rows_in, self.rows_out, dup_count)
@@ -0,0 +1 @@
+"""Throughput benchmarks for the send runners; run with `python -m bench` from backend/."""
@@ -0,0 +1,107 @@
+"""
+Send-run throughput benchmarks against local mock providers.
+
+Run from backend/:
+
+    python -m bench --runner splus rubika --rows 10000 100000 \\
+        --latency-ms 20 --rate-429 0.01 --error-rate 0.005 --error-codes 500,724 \\
+        --json /tmp/cpa_panel_bench/latest.json --baseline /tmp/cpa_panel_bench/baseline.json
+
+`--runner rubika-r-worker --rows 1000` doubles as a smoke test of R sends
+on the pooled R worker; the command exits non-zero if the send fails.
+It needs Rscript; the pool logic itself is covered without R by
+tests/test_r_worker.py (`python -m pytest tests`).
+
+Synthetic snapshots are cached under --bench-dir (default: a directory in
+the system temp dir, or $BENCH_DIR), never in the source tree.
+
+Each case gets its own mock server and child process, so peak RSS belongs
+to that case alone. Nothing is sent outside 127.0.0.1. The default
+limiter rate is far above the production limits so the runners, not
+the limiter, are measured; pass --rate-per-sec to include pacing.
+"""
+import argparse
+import json
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .harness import BENCH_DIR, RUNNERS, compare, format_table, load_results, run_case
+from .mock_providers import ProviderProfile
+
+
+def _error_codes(raw: str) -> tuple:
+    codes = []
+    for part in raw.split(","):
+        part = part.strip()
+        if part:
+            codes.append(int(part) if part.isdigit() else part)
+    return tuple(codes)
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(prog="python -m bench", description="Benchmark send runners against mock providers.")
+    p.add_argument("--runner", nargs="+", default=["splus", "rubika"], choices=list(RUNNERS))
+    p.add_argument("--rows", nargs="+", type=int, default=[10000], help="snapshot sizes (e.g. 10000 100000 1000000)")
+    p.add_argument("--latency-ms", type=float, default=20.0, help="mock latency per request")
+    p.add_argument("--jitter-ms", type=float, default=5.0, help="uniform +/- jitter on the latency")
+    p.add_argument("--per-message-ms", type=float, default=0.05, help="extra Rubika latency per message in a batch")
+    p.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    p.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with an error code")
+    p.add_argument("--error-codes", type=_error_codes, default=(500,), help="comma separated: HTTP codes (<600) or provider codes")
+    p.add_argument("--seed", type=int, default=None)
+    p.add_argument("--workers", type=int, default=None, help="runner workers (default: runner default)")
+    p.add_argument("--batch-size", type=int, default=None, help="Rubika batch size (default: runner default)")
+    p.add_argument("--rate-per-sec", type=float, default=10000.0)
+    p.add_argument("--burst", type=int, default=10000)
+    p.add_argument("--json", dest="json_path", default=None, help="write results to this file")
+    p.add_argument("--baseline", default=None, help="results file to compare throughput against")
+    p.add_argument("--max-regression", type=float, default=0.15, help="allowed throughput drop vs the baseline")
+    p.add_argument("--bench-dir", type=Path, default=BENCH_DIR, help="where synthetic snapshots are cached")
+    p.add_argument("--keep", action="store_true", help="keep the run directories under data/runs")
+    args = p.parse_args(argv)
+
+    results = []
+    for runner in args.runner:
+        for rows in args.rows:
+            profile = ProviderProfile(
+                latency_ms=args.latency_ms,
+                jitter_ms=args.jitter_ms,
+                per_message_ms=args.per_message_ms if runner != "splus" else 0.0,
+                rate_429=args.rate_429,
+                error_rate=args.error_rate,
+                error_codes=args.error_codes,
+                seed=args.seed,
+            )
+            print(f"running {runner} rows={rows} ...", file=sys.stderr, flush=True)
+            results.append(run_case(
+                runner,
+                rows,
+                profile,
+                workers=args.workers,
+                batch_size=args.batch_size,
+                rate_per_sec=args.rate_per_sec,
+                burst=args.burst,
+                keep=args.keep,
+                bench_dir=args.bench_dir,
+            ))
+
+    print(format_table(results))
+
+    if args.json_path:
+        out = Path(args.json_path)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(
+            json.dumps({"created_at": datetime.now(timezone.utc).isoformat(), "results": results}, indent=2),
+            encoding="utf-8",
+        )
+
+    failed = [r for r in results if not r.get("skipped") and r.get("returncode") != 0]
+    regressions = compare(results, load_results(args.baseline), args.max_regression) if args.baseline else []
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
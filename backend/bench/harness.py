@@ -0,0 +1,295 @@
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from .mock_providers import MockProvider, MockRubika, MockSplus, ProviderProfile
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+# Synthetic snapshots are cached here, outside the source tree.
+BENCH_DIR = Path(os.environ.get("BENCH_DIR") or Path(tempfile.gettempdir()) / "cpa_panel_bench")
+
+# runner name -> (mock provider, snapshot format)
+RUNNERS = {
+    "splus": (MockSplus, "feather"),
+    "rubika": (MockRubika, "feather"),
+    "rubika-r": (MockRubika, "csv"),
+    # Same R runner on a pooled r_worker.R process: a smoke test of the
+    # worker path, whose jobs run under the worker's condition handlers.
+    "rubika-r-worker": (MockRubika, "csv"),
+}
+BENCH_MESSAGE = "Benchmark message %s"
+
+
+def make_snapshot(rows: int, fmt: str, bench_dir: Path = BENCH_DIR) -> Path:
+    """Synthetic audience of `rows` distinct numbers (cached per size/format)."""
+    snapshot_dir = Path(bench_dir) / "snapshots"
+    path = snapshot_dir / f"audience_{rows}.{fmt}"
+    if path.exists():
+        return path
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    idx = np.arange(rows, dtype=np.int64)
+    phones = pa.array((989120000000 + idx).astype(str))
+    links = pa.array(np.char.add("https://example.com/l/", idx.astype(str)))
+    table = pa.table({"phone_number": phones, "link": links})
+    tmp = path.with_name(path.name + ".tmp")
+    if fmt == "feather":
+        feather.write_feather(table, tmp, compression="uncompressed")
+    else:
+        table.to_pandas().to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return path
+
+
+def _peak_rss_mb(who) -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # KiB on Linux, bytes on macOS.
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def _time_http_calls(samples: list[float]):
+    """Record the wall time of every HTTP call made through requests in this process."""
+    import requests
+
+    original = requests.Session.send
+
+    def send(self, request, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(self, request, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - started)
+
+    requests.Session.send = send
+
+
+def _percentiles_ms(samples: list[float]) -> tuple[Optional[float], Optional[float]]:
+    if not samples:
+        return None, None
+    p50, p99 = np.percentile(np.asarray(samples), [50, 99]) * 1000
+    return round(float(p50), 2), round(float(p99), 2)
+
+
+def _run_in_child(spec: dict[str, Any], out: "multiprocessing.Queue"):
+    """Child process: run one send against the mock and report what it measured."""
+    try:
+        os.environ["RUBIKA_BASE_URL"] = spec["base_url"]
+        # Plain Rscript per job so the R process is reaped and shows up in
+        # RUSAGE_CHILDREN (pooled workers would outlive the measurement),
+        # except for the case that exercises the worker pool.
+        os.environ["R_WORKER_POOL_SIZE"] = "1" if spec["runner"] == "rubika-r-worker" else "0"
+        samples: list[float] = []
+        _time_http_calls(samples)
+
+        from app.runners.result_log import read_progress
+
+        kwargs: dict[str, Any] = {
+            "mode": "send",
+            "snapshot_path": spec["snapshot_path"],
+            "file_id": None,
+            "message_text": BENCH_MESSAGE,
+            "test_number": None,
+            "run_id": spec["run_id"],
+            "rate_per_sec": spec["rate_per_sec"],
+            "burst": spec["burst"],
+        }
+        if spec["workers"]:
+            kwargs["workers"] = spec["workers"]
+        runner = spec["runner"]
+        if runner == "splus":
+            from app.runners.splus_runner import run_splus_campaign as run
+            kwargs.update(splus_bot_id=spec["token"], base_url=spec["base_url"])
+        else:
+            kwargs.update(rubica_token=spec["token"], service_id=spec["service_id"])
+            if spec["batch_size"]:
+                kwargs["batch_size"] = spec["batch_size"]
+            if runner == "rubika":
+                from app.runners.rubika_runner import run_rubika_campaign as run
+                kwargs["base_url"] = spec["base_url"]
+            else:
+                from app.runners.rscript_runner import run_r_campaign as run
+
+        started = time.perf_counter()
+        try:
+            res = run(**kwargs)
+            elapsed = time.perf_counter() - started
+        finally:
+            if runner == "rubika-r-worker":
+                from app.runners.r_worker import pool
+
+                pool.close()
+
+        p50, p99 = _percentiles_ms(samples)
+        out.put({
+            "returncode": res.get("returncode"),
+            "error": res.get("error"),
+            "seconds": round(elapsed, 3),
+            "client_p50_ms": p50,
+            "client_p99_ms": p99,
+            "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+            "peak_child_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+            "progress": read_progress(res["log_csv"]) if res.get("log_csv") else None,
+            "run_dir": res.get("run_dir"),
+        })
+    except Exception as ex:
+        out.put({"returncode": 999, "error": f"{type(ex).__name__}: {ex}"})
+
+
+def _cleanup(runner: str, run_dir: Optional[str], token: str, service_id: str):
+    # Imported here: app.runners resolve their data directories at import.
+    from app.runners.batch_tuner import tuning_path
+    from app.runners.rate_limiter import rate_state_path
+
+    if run_dir:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    platform = "splus" if runner == "splus" else "rubika"
+    state = rate_state_path(platform, token)
+    for p in (state, Path(str(state) + ".lock"), tuning_path("rubika", service_id)):
+        p.unlink(missing_ok=True)
+
+
+def run_case(
+    runner: str,
+    rows: int,
+    profile: ProviderProfile,
+    *,
+    workers: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    rate_per_sec: float = 10000.0,
+    burst: int = 10000,
+    keep: bool = False,
+    bench_dir: Path = BENCH_DIR,
+) -> dict[str, Any]:
+    """
+    One benchmark: a fresh mock provider, a fresh child process running the
+    runner against a synthetic snapshot, and the merged measurements.
+    """
+    if runner not in RUNNERS:
+        raise ValueError(f"unknown runner {runner!r}; expected one of {', '.join(RUNNERS)}")
+    provider_cls, fmt = RUNNERS[runner]
+    result: dict[str, Any] = {"runner": runner, "rows": rows, "profile": profile.as_dict()}
+
+    if runner.startswith("rubika-r") and not shutil.which(os.environ.get("RSCRIPT_PATH", "Rscript")):
+        return {**result, "skipped": "Rscript not found (set RSCRIPT_PATH)"}
+
+    snapshot = make_snapshot(rows, fmt, bench_dir)
+    tag = uuid.uuid4().hex[:8]
+    token, service_id = f"bench-token-{tag}", f"bench-{tag}"
+    provider: MockProvider = provider_cls(profile)
+    with provider:
+        spec = {
+            "runner": runner,
+            "snapshot_path": str(snapshot),
+            "run_id": f"bench-{runner}-{rows}-{tag}",
+            "token": token,
+            "service_id": service_id,
+            "base_url": provider.base_url,
+            "workers": workers,
+            "batch_size": batch_size,
+            "rate_per_sec": rate_per_sec,
+            "burst": burst,
+        }
+        ctx = multiprocessing.get_context("spawn")
+        out = ctx.Queue()
+        child = ctx.Process(target=_run_in_child, args=(spec, out), name=f"bench-{runner}")
+        child.start()
+        measured = None
+        while measured is None:
+            try:
+                measured = out.get(timeout=1.0)
+            except queue.Empty:
+                if not child.is_alive():
+                    measured = {"returncode": child.exitcode, "error": "benchmark process exited without a result"}
+        child.join()
+        served = provider.stats.snapshot()
+
+    if not keep:
+        _cleanup(runner, measured.get("run_dir"), token, service_id)
+
+    server_p50, server_p99 = _percentiles_ms(served.pop("latencies"))
+    seconds = measured.get("seconds") or 0.0
+    progress = measured.pop("progress", None) or {}
+    return {
+        **result,
+        **measured,
+        "rows_per_sec": round(rows / seconds, 1) if seconds else None,
+        # Runners in this process are timed client side; the R runner only
+        # at the mock.
+        "p50_ms": measured.get("client_p50_ms") or server_p50,
+        "p99_ms": measured.get("client_p99_ms") or server_p99,
+        "server_p50_ms": server_p50,
+        "server_p99_ms": server_p99,
+        "sent": progress.get("sent"),
+        "failed": progress.get("failed"),
+        **served,
+    }
+
+
+def compare(results: list[dict[str, Any]], baseline: list[dict[str, Any]], max_regression: float) -> list[str]:
+    """Cases whose throughput fell more than max_regression below the baseline."""
+    base = {(b["runner"], b["rows"]): b for b in baseline if b.get("rows_per_sec")}
+    regressions = []
+    for r in results:
+        b = base.get((r["runner"], r["rows"]))
+        if not b or not r.get("rows_per_sec"):
+            continue
+        floor = b["rows_per_sec"] * (1 - max_regression)
+        if r["rows_per_sec"] < floor:
+            regressions.append(
+                f"{r['runner']} rows={r['rows']}: {r['rows_per_sec']} rows/s < {floor:.1f} "
+                f"(baseline {b['rows_per_sec']}, -{max_regression:.0%})"
+            )
+    return regressions
+
+
+def load_results(path: Path | str) -> list[dict[str, Any]]:
+    obj = json.loads(Path(path).read_text(encoding="utf-8"))
+    return obj["results"] if isinstance(obj, dict) else obj
+
+
+def format_table(results: list[dict[str, Any]]) -> str:
+    cols = [
+        ("runner", "runner"),
+        ("rows", "rows"),
+        ("seconds", "sec"),
+        ("rows_per_sec", "rows/s"),
+        ("p50_ms", "p50 ms"),
+        ("p99_ms", "p99 ms"),
+        ("peak_rss_mb", "rss MB"),
+        ("peak_child_rss_mb", "child MB"),
+        ("requests", "requests"),
+        ("retries", "retries"),
+        ("throttled", "429s"),
+        ("errors", "errors"),
+        ("sent", "sent"),
+        ("failed", "failed"),
+    ]
+    table = pd.DataFrame(
+        [{label: "-" if r.get(key) is None else r[key] for key, label in cols} for r in results],
+        columns=[label for _, label in cols],
+    )
+    lines = [table.to_string(index=False)]
+    for r in results:
+        if r.get("skipped"):
+            lines.append(f"{r['runner']} rows={r['rows']}: skipped ({r['skipped']})")
+        elif r.get("error"):
+            lines.append(f"{r['runner']} rows={r['rows']}: returncode={r.get('returncode')} {r['error']}")
+    return "\n".join(lines)
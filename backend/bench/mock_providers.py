@@ -0,0 +1,235 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+# Local stand-ins for the SPlus and Rubika APIs. They only listen on
+# 127.0.0.1, answer like the real services closely enough for the runners,
+# and count every request so a benchmark can report retries.
+
+
+class ProviderProfile:
+    """
+    How a mock provider behaves. Latencies are in milliseconds; rate_429 and
+    error_rate are per-request probabilities. An error code below 600 is
+    answered as that HTTP status; anything else (SPlus result codes such as
+    724, Rubika statuses such as "INVALID_INPUT") as HTTP 200 with the code
+    in the body.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 20.0,
+        jitter_ms: float = 0.0,
+        per_message_ms: float = 0.0,
+        rate_429: float = 0.0,
+        error_rate: float = 0.0,
+        error_codes: tuple[Any, ...] = (500,),
+        seed: Optional[int] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.per_message_ms = per_message_ms
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes) or (500,)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay_sec(self, n_messages: int = 1) -> float:
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter + self.per_message_ms * n_messages) / 1000.0
+
+    def fault(self) -> Optional[Any]:
+        """None for a normal answer, 429, or one of error_codes."""
+        with self._lock:
+            r = self._random.random()
+            if r < self.rate_429:
+                return 429
+            if r < self.rate_429 + self.error_rate:
+                return self._random.choice(self.error_codes)
+        return None
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "latency_ms": self.latency_ms,
+            "jitter_ms": self.jitter_ms,
+            "per_message_ms": self.per_message_ms,
+            "rate_429": self.rate_429,
+            "error_rate": self.error_rate,
+            "error_codes": list(self.error_codes),
+        }
+
+
+def _http_status(code: Any) -> Optional[int]:
+    try:
+        code_i = int(code)
+    except (TypeError, ValueError):
+        return None
+    return code_i if code_i < 600 else None
+
+
+class ProviderStats:
+    """Thread-safe counters of what the mock saw."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.message_attempts = 0
+        self.phones: set[int] = set()
+        self.latencies: list[float] = []
+
+    def record(self, phones: list[str], fault: Optional[Any], elapsed_sec: float):
+        keys = [int(p) for p in phones if p.isdigit()]
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(elapsed_sec)
+            if fault == 429:
+                self.throttled += 1
+            elif fault is not None:
+                self.errors += 1
+            self.message_attempts += len(phones)
+            self.phones.update(keys)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "errors": self.errors,
+                "message_attempts": self.message_attempts,
+                "unique_phones": len(self.phones),
+                # Every attempt past the first for a number is a retry.
+                "retries": self.message_attempts - len(self.phones),
+                "latencies": list(self.latencies),
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body leave in one segment; unbuffered writes plus Nagle and
+    # delayed ACKs would add ~40 ms to every keep-alive request.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    server: "MockProvider"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code: int, obj: dict[str, Any]):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict[str, Any]:
+        n = int(self.headers.get("Content-Length", 0) or 0)
+        try:
+            obj = json.loads(self.rfile.read(n) or b"{}")
+        except ValueError:
+            return {}
+        return obj if isinstance(obj, dict) else {}
+
+    def do_POST(self):
+        started = time.perf_counter()
+        req = self._read_json()
+        self.server.handle_api(self, req, started)
+
+
+class MockProvider(ThreadingHTTPServer):
+    daemon_threads = True
+    # The runners open one keep-alive connection per worker; the default
+    # backlog of 5 would refuse connections under load.
+    request_queue_size = 256
+
+    def __init__(self, profile: ProviderProfile, port: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.profile = profile
+        self.stats = ProviderStats()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self) -> "MockProvider":
+        self._thread = threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "MockProvider":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle_api(self, handler: _Handler, req: dict[str, Any], started: float):
+        raise NotImplementedError
+
+
+class MockSplus(MockProvider):
+    """POST /v1/messages/send, one message per request."""
+
+    def handle_api(self, handler: _Handler, req: dict[str, Any], started: float):
+        if not handler.path.startswith("/v1/messages/send"):
+            return handler._send(404, {"result_code": 404, "result_message": "not found"})
+        phone = str(req.get("phone_number") or "")
+        time.sleep(self.profile.delay_sec())
+        fault = self.profile.fault()
+        if fault is None:
+            handler._send(200, {"result_code": 200, "message_id": uuid.uuid4().hex[:16]})
+        elif fault == 429:
+            handler._send(429, {"result_code": 429, "result_message": "Too Many Requests"})
+        else:
+            status = _http_status(fault)
+            handler._send(status or 200, {"result_code": fault, "result_message": "mock error"})
+        self.stats.record([phone], fault, time.perf_counter() - started)
+
+
+class MockRubika(MockProvider):
+    """Rubika messaging API envelope: sendBulkMessages and getMessagesStatus."""
+
+    def handle_api(self, handler: _Handler, req: dict[str, Any], started: float):
+        method = req.get("method")
+        data = req.get("data") if isinstance(req.get("data"), dict) else {}
+
+        if method == "getMessagesStatus":
+            ids = data.get("message_ids") or []
+            time.sleep(self.profile.delay_sec())
+            return handler._send(200, {
+                "status": "OK",
+                "data": {"message_status_list": [{"message_id": i, "status": "Delivered"} for i in ids]},
+            })
+        if method != "sendBulkMessages":
+            return handler._send(400, {"status": "INVALID_METHOD"})
+
+        messages = [m for m in data.get("message_list") or [] if isinstance(m, dict)]
+        phones = [str(m.get("phone") or "") for m in messages]
+        time.sleep(self.profile.delay_sec(len(messages)))
+        fault = self.profile.fault()
+        if fault is None:
+            handler._send(200, {
+                "status": "OK",
+                "data": {
+                    "status": "Done",
+                    "message_status_list": [{"message_id": uuid.uuid4().hex[:12], "status": "Sent"} for _ in messages],
+                },
+            })
+        elif fault == 429:
+            handler._send(429, {"status": "TOO_MANY_REQUESTS"})
+        else:
+            status = _http_status(fault)
+            handler._send(status or 200, {"status": "ERROR" if status else str(fault)})
+        self.stats.record(phones, fault, time.perf_counter() - started)
@@ -0,0 +1,53 @@
+"""
+Stand-in for Rscript in the r_worker tests.
+
+Started as `<bin> .../r_worker.R` it speaks the worker protocol of
+r/runners/r_worker.R: a ready line, then one response per JSON job read from
+stdin. Job args are interpreted as:
+    --exit <n>       returncode to report (default 0)
+    --wait <path>    block until <path> exists (keeps the worker busy)
+Started with any other script it behaves like a one-shot Rscript run.
+FAKE_R_WORKER=silent makes the worker never announce itself.
+"""
+import json
+import os
+import sys
+import time
+
+PREFIX = "@@cpa-worker@@ "
+
+
+def respond(msg: dict):
+    sys.stdout.write(PREFIX + json.dumps(msg) + "\n")
+    sys.stdout.flush()
+
+
+def arg(args: list[str], name: str, default: str | None = None) -> str | None:
+    return args[args.index(name) + 1] if name in args else default
+
+
+def serve():
+    if os.environ.get("FAKE_R_WORKER") == "silent":
+        sys.stdin.read()
+        return
+    respond({"id": "ready", "returncode": 0, "pid": os.getpid()})
+    for line in sys.stdin:
+        req = json.loads(line)
+        args = req["args"]
+        wait_for = arg(args, "--wait")
+        while wait_for and not os.path.exists(wait_for):
+            time.sleep(0.02)
+        with open(req["log"], "a", encoding="utf-8") as log:
+            log.write(f"worker {os.getpid()} token={req['env'].get('RUBICA_TOKEN')}\n")
+        # Stray output must not be taken for a response.
+        print("noise from the job")
+        sys.stdout.flush()
+        respond({"id": req["id"], "returncode": int(arg(args, "--exit", "0")), "error": None})
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1].endswith("r_worker.R"):
+        serve()
+    else:
+        print(f"rscript {os.getpid()} token={os.environ.get('RUBICA_TOKEN')}")
+        sys.exit(int(arg(sys.argv, "--exit", "0")))
@@ -0,0 +1,111 @@
+import stat
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from app.runners import r_worker, rscript_runner
+from app.runners.r_worker import RWorkerPool, RWorkerUnavailable
+
+FAKE_WORKER = Path(__file__).with_name("fake_r_worker.py")
+
+
+@pytest.fixture
+def fake_rscript(tmp_path, monkeypatch):
+    """An executable that stands in for Rscript (see fake_r_worker.py)."""
+    monkeypatch.setattr(r_worker, "WORKER_LOG_DIR", tmp_path / "r_workers")
+    monkeypatch.setattr(r_worker, "R_WORKER_START_TIMEOUT_SEC", 10.0)
+    monkeypatch.delenv("FAKE_R_WORKER", raising=False)
+    bin_path = tmp_path / "Rscript"
+    bin_path.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_WORKER}" "$@"\n', encoding="utf-8")
+    bin_path.chmod(bin_path.stat().st_mode | stat.S_IXUSR)
+    return str(bin_path)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    p = RWorkerPool(1)
+    monkeypatch.setattr(r_worker, "pool", p)
+    yield p
+    p.close()
+
+
+def run_job(pool, rscript, log_path, *args, ticks=None):
+    on_tick = (lambda: ticks.append(1)) if ticks is not None else (lambda: None)
+    return pool.run(rscript, list(args), {"RUBICA_TOKEN": "tok"}, log_path, on_tick, 0.05)
+
+
+def test_worker_runs_jobs_and_is_reused(fake_rscript, pool, tmp_path):
+    log_path = tmp_path / "run.log"
+
+    assert run_job(pool, fake_rscript, log_path, "--mode", "test") == 0
+    assert run_job(pool, fake_rscript, log_path, "--exit", "3") == 3
+
+    lines = log_path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 2
+    assert lines[0] == lines[1]
+    assert lines[0].endswith("token=tok")
+    assert len(pool._idle) == 1 and pool._idle[0].jobs == 2
+    # Output that is not a response goes to the worker's own log.
+    worker_logs = list((tmp_path / "r_workers").glob("worker-*.log"))
+    assert "noise from the job" in "".join(p.read_text(encoding="utf-8") for p in worker_logs)
+
+
+def test_busy_pool_falls_back_to_rscript(fake_rscript, pool, tmp_path, monkeypatch):
+    release = tmp_path / "release"
+    ticks: list[int] = []
+    results: dict[str, int] = {}
+
+    def long_send():
+        results["send"] = run_job(pool, fake_rscript, tmp_path / "send.log", "--wait", str(release), ticks=ticks)
+
+    sender = threading.Thread(target=long_send)
+    sender.start()
+    try:
+        deadline = time.monotonic() + 10
+        while not ticks and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert ticks, "the send never reached the worker"
+
+        with pytest.raises(RWorkerUnavailable, match="busy"):
+            run_job(pool, fake_rscript, tmp_path / "test.log")
+
+        # The runner then starts its own Rscript instead of waiting.
+        monkeypatch.setattr(rscript_runner, "R_WORKER_POOL_SIZE", 1)
+        cmd = [fake_rscript, str(rscript_runner.R_RUNNER), "--mode", "test", "--exit", "0"]
+        with open(tmp_path / "test.log", "w", encoding="utf-8") as f:
+            assert rscript_runner._execute(cmd, "tok", f, lambda: None) == 0
+        out = (tmp_path / "test.log").read_text(encoding="utf-8")
+        assert "all R workers are busy; starting Rscript" in out
+        assert "rscript " in out and out.rstrip().endswith("token=tok")
+    finally:
+        release.touch()
+        sender.join(timeout=10)
+
+    assert results["send"] == 0
+    assert len(pool._idle) == 1
+
+
+def test_failed_start_disables_pool_until_retry(fake_rscript, pool, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_R_WORKER", "silent")
+    monkeypatch.setattr(r_worker, "R_WORKER_START_TIMEOUT_SEC", 0.5)
+    log_path = tmp_path / "run.log"
+
+    with pytest.raises(RWorkerUnavailable, match="did not start"):
+        run_job(pool, fake_rscript, log_path)
+    assert pool._disabled_until > time.monotonic()
+    assert pool._count == 0
+
+    # While disabled no worker is started at all.
+    started = len(list((tmp_path / "r_workers").glob("worker-*.log")))
+    with pytest.raises(RWorkerUnavailable, match="disabled"):
+        run_job(pool, fake_rscript, log_path)
+    assert len(list((tmp_path / "r_workers").glob("worker-*.log"))) == started
+
+    # Once the retry time has passed the pool tries again.
+    monkeypatch.delenv("FAKE_R_WORKER")
+    pool._disabled_until = time.monotonic() - 1
+    assert run_job(pool, fake_rscript, log_path) == 0
+    assert log_path.read_text(encoding="utf-8").endswith("token=tok\n")
@@ -1,4 +1,5 @@
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useMemo, useRef, useState } from "react";
+import { Link } from "react-router-dom";
 import { apiGet, apiPost, apiPostForm } from "../api/client";
 import type { Customer, CustomerMedia, CustomerMessage } from "../api/types";
 import DatePickerModule from "react-multi-date-picker";
@@ -10,6 +11,10 @@ import { DateTime } from "luxon";
 const DatePicker =
   (DatePickerModule as unknown as { default?: typeof DatePickerModule }).default ?? DatePickerModule;
 
+// A queued run has no log yet: poll its status until the executor picks it up.
+const RUN_START_POLL_MS = 2000;
+const RUN_START_POLL_MAX = 150;
+
 
 
 export default function CampaignBuilder() {
@@ -41,6 +46,7 @@ export default function CampaignBuilder() {
 
   // Test number default
   const [testNumber, setTestNumber] = useState("989024004940");
+  const [suppressDays, setSuppressDays] = useState<string>("");
 
   const [customers, setCustomers] = useState<Customer[]>([]);
   const [selectedCustomerId, setSelectedCustomerId] = useState<string>("");
@@ -72,6 +78,8 @@ export default function CampaignBuilder() {
   const [createdCampaignId, setCreatedCampaignId] = useState<string>("");
 
   const [lastRunId, setLastRunId] = useState<string>("");
+  // The run whose start is being waited for; a newer run cancels the wait.
+  const watchedRunRef = useRef("");
   const [lastRunLog, setLastRunLog] = useState<string>("");
 
   const [mediaFile, setMediaFile] = useState<File | null>(null);
@@ -100,6 +108,7 @@ export default function CampaignBuilder() {
         columns: string[];
         preview: any[];
         notes: string[];
+        deduplicated?: boolean;
       }>("/audience/upload", fd);
 
       setSnapshotId(res.snapshot_id);
@@ -107,7 +116,11 @@ export default function CampaignBuilder() {
       setAudienceColumns(res.columns);
       setAudiencePreview(res.preview);
       setAudienceNotes(res.notes || []);
-      setStatus(`Audience uploaded. snapshot_id=${res.snapshot_id} rows=${res.row_count}`);
+      setStatus(
+        res.deduplicated
+          ? `Audience already uploaded, reusing snapshot_id=${res.snapshot_id} rows=${res.row_count}`
+          : `Audience uploaded. snapshot_id=${res.snapshot_id} rows=${res.row_count}`
+      );
     } catch (e: any) {
       setStatus(`Upload failed: ${e.message || e}`);
     }
@@ -167,6 +180,7 @@ export default function CampaignBuilder() {
         selected_file_id: selectedFileId || null,
         message_text: messageText,
         test_number: testNumber,
+        suppress_days: suppressDays.trim() ? Number(suppressDays) : null,
       });
 
       setCreatedCampaignId(res.campaign_id);
@@ -203,7 +217,7 @@ export default function CampaignBuilder() {
     if (!createdCampaignId) return setStatus("Create campaign first.");
     if (!token.trim()) return setStatus("Token is required (not saved).");
 
-    setStatus("Sending test...");
+    setStatus("Queueing test...");
     setLastRunLog("");
 
     try {
@@ -213,7 +227,10 @@ export default function CampaignBuilder() {
       );
 
       setLastRunId(res.run_id);
-      setStatus(`Test finished. run_id=${res.run_id} status=${res.status}`);
+      setStatus(`Test queued. run_id=${res.run_id} status=${res.status} (track it on the dashboard / live log)`);
+      const started = await waitForRunStart(res.run_id);
+      if (started === null) return;
+      setStatus(`Test ${started}. run_id=${res.run_id} (follow it on the live log)`);
       await fetchRunLog(res.run_id);
     } catch (e: any) {
       setStatus(`Test failed: ${e.message || e}`);
@@ -225,7 +242,7 @@ export default function CampaignBuilder() {
     if (!createdCampaignId) return setStatus("Create campaign first.");
     if (!token.trim()) return setStatus("Token is required (not saved).");
 
-    setStatus("Running campaign now...");
+    setStatus("Queueing campaign run...");
     setLastRunLog("");
 
     try {
@@ -235,7 +252,10 @@ export default function CampaignBuilder() {
       );
 
       setLastRunId(res.run_id);
-      setStatus(`Run finished. run_id=${res.run_id} status=${res.status}`);
+      setStatus(`Run queued. run_id=${res.run_id} status=${res.status} (track it on the dashboard / live log)`);
+      const started = await waitForRunStart(res.run_id);
+      if (started === null) return;
+      setStatus(`Run ${started}. run_id=${res.run_id} (follow it on the live log)`);
       await fetchRunLog(res.run_id);
     } catch (e: any) {
       setStatus(`Run failed: ${e.message || e}`);
@@ -294,6 +314,25 @@ export default function CampaignBuilder() {
     }
   }
 
+  /**
+   * Poll the run until it leaves "queued". Returns its status then, or null
+   * when another run was started meanwhile or it never left the queue.
+   */
+  async function waitForRunStart(runId: string): Promise<string | null> {
+    watchedRunRef.current = runId;
+    for (let i = 0; i < RUN_START_POLL_MAX; i++) {
+      if (watchedRunRef.current !== runId) return null;
+      try {
+        const run = await apiGet<{ status: string }>(`/runs/${runId}`);
+        if (run.status !== "queued") return watchedRunRef.current === runId ? run.status : null;
+      } catch {
+        // Transient errors: keep polling.
+      }
+      await new Promise((resolve) => setTimeout(resolve, RUN_START_POLL_MS));
+    }
+    return null;
+  }
+
   async function fetchRunLog(runId: string) {
   try {
     const res = await apiGet<{ log: string }>(`/runs/${runId}/log`);
@@ -447,6 +486,18 @@ function tehranPickerToUtcIso(dateObj: DateObject, hhmm: string): string {
               />
             </label>
 
+            <label>
+              Skip numbers this customer contacted in the last N days
+              <input
+                type="number"
+                min={0}
+                value={suppressDays}
+                onChange={(e) => setSuppressDays(e.target.value)}
+                placeholder="Off"
+                style={{ width: "100%", padding: 8, borderRadius: 8 }}
+              />
+            </label>
+
             <div style={{ fontSize: 12, color: "#666" }}>
               Token is never stored and is required for send test / run now / schedule.
             </div>
@@ -813,6 +864,9 @@ function tehranPickerToUtcIso(dateObj: DateObject, hhmm: string): string {
               <button onClick={() => fetchRunLog(lastRunId)} style={{ marginLeft: 10 }}>
                 Refresh log
               </button>
+              <Link to={`/runs/${lastRunId}/live-log`} style={{ marginLeft: 10 }}>
+                Open live log
+              </Link>
             </div>
 
             <textarea
@@ -1,4 +1,4 @@
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useMemo, useRef, useState } from "react";
 import { apiGet } from "../api/client";
 import { Link } from "react-router-dom";
 import "./Dashboard.css";
@@ -17,8 +17,48 @@ type DashRow = {
   progress_current?: number | null;
   progress_total?: number | null;
   progress_pct?: number | null;
+  sent_count?: number | null;
+  failed_count?: number | null;
 };
 
+type ProgressDelta = Pick<DashRow, "run_id"> &
+  Partial<Pick<DashRow, "progress_current" | "progress_total" | "progress_pct" | "sent_count" | "failed_count">>;
+
+type Filters = { status: string; customerId: string; q: string };
+
+const ROW_LIMIT = 300;
+
+function matchesFilters(r: DashRow, f: Filters): boolean {
+  if (f.status && r.status !== f.status) return false;
+  if (f.customerId && r.customer_id !== f.customerId) return false;
+  const q = f.q.trim().toLowerCase();
+  if (q && !(r.campaign_name || "").toLowerCase().includes(q) && !(r.customer_name || "").toLowerCase().includes(q)) {
+    return false;
+  }
+  return true;
+}
+
+function upsertRun(rows: DashRow[], row: DashRow, f: Filters): DashRow[] {
+  const rest = rows.filter((r) => r.run_id !== row.run_id);
+  if (!matchesFilters(row, f)) return rest;
+  const idx = rows.findIndex((r) => r.run_id === row.run_id);
+  if (idx >= 0) {
+    const next = rows.slice();
+    next[idx] = row;
+    return next;
+  }
+  // New runs are the most recent ones.
+  return [row, ...rest].slice(0, ROW_LIMIT);
+}
+
+function applyProgress(rows: DashRow[], d: ProgressDelta): DashRow[] {
+  const idx = rows.findIndex((r) => r.run_id === d.run_id);
+  if (idx < 0) return rows;
+  const next = rows.slice();
+  next[idx] = { ...rows[idx], ...d };
+  return next;
+}
+
 function formatTehran(isoUtc: string | null): string {
   if (!isoUtc) return "-";
   const d = new Date(isoUtc);
@@ -40,6 +80,10 @@ export default function Dashboard() {
   const [status, setStatus] = useState<string>("");
   const [customerId, setCustomerId] = useState<string>("");
   const [q, setQ] = useState<string>("");
+  // Filters of the last loaded snapshot; pushed rows are matched against them.
+  const appliedFilters = useRef<Filters>({ status: "", customerId: "", q: "" });
+  // Events arriving while a snapshot is loading are replayed on top of it.
+  const pending = useRef<((rows: DashRow[]) => DashRow[])[] | null>(null);
 
   const filtered = useMemo(() => rows, [rows]);
   const summary = useMemo(() => {
@@ -51,19 +95,48 @@ export default function Dashboard() {
     return { total, running, success, failed, successRate };
   }, [filtered]);
 
-  async function load() {
+  async function load(filters: Filters = { status, customerId, q }) {
     const params = new URLSearchParams();
-    if (status) params.set("status", status);
-    if (customerId) params.set("customer_id", customerId);
-    if (q.trim()) params.set("q", q.trim());
-    params.set("limit", "300");
+    if (filters.status) params.set("status", filters.status);
+    if (filters.customerId) params.set("customer_id", filters.customerId);
+    if (filters.q.trim()) params.set("q", filters.q.trim());
+    params.set("limit", String(ROW_LIMIT));
+
+    appliedFilters.current = filters;
+    pending.current = [];
+    try {
+      const data = await apiGet<DashRow[]>(`/dashboard/runs?${params.toString()}`);
+      const queued = pending.current || [];
+      setRows(queued.reduce((acc, fn) => fn(acc), data));
+    } finally {
+      pending.current = null;
+    }
+  }
 
-    const data = await apiGet<DashRow[]>(`/dashboard/runs?${params.toString()}`);
-    setRows(data);
+  function apply(fn: (rows: DashRow[]) => DashRow[]) {
+    if (pending.current) pending.current.push(fn);
+    else setRows(fn);
   }
 
   useEffect(() => {
-    load();
+    // One shared event channel; the snapshot is (re)loaded once the channel
+    // is open, then kept current by "run" and "progress" diffs.
+    const es = new EventSource(`${API_BASE}/dashboard/events`);
+    es.addEventListener("hello", () => {
+      load(appliedFilters.current);
+    });
+    es.addEventListener("resync", () => {
+      load(appliedFilters.current);
+    });
+    es.addEventListener("run", (ev) => {
+      const row = JSON.parse((ev as MessageEvent).data) as DashRow;
+      apply((prev) => upsertRun(prev, row, appliedFilters.current));
+    });
+    es.addEventListener("progress", (ev) => {
+      const d = JSON.parse((ev as MessageEvent).data) as ProgressDelta;
+      apply((prev) => applyProgress(prev, d));
+    });
+    return () => es.close();
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, []);
 
@@ -72,7 +145,7 @@ export default function Dashboard() {
       <div className="dash-toolbar">
         <h2>Dashboard</h2>
         <div className="dash-toolbar-actions">
-          <button className="ghost-btn" onClick={load}>Refresh</button>
+          <button className="ghost-btn" onClick={() => load()}>Refresh</button>
           <button
             className="ghost-btn"
             onClick={() => {
@@ -112,6 +185,7 @@ export default function Dashboard() {
           <option value="success">Success</option>
           <option value="failed">Failed</option>
           <option value="running">Running</option>
+          <option value="queued">Queued</option>
         </select>
 
         <input
@@ -128,7 +202,7 @@ export default function Dashboard() {
           className="field"
         />
 
-        <button className="primary-btn" onClick={load}>Apply Filters</button>
+        <button className="primary-btn" onClick={() => load()}>Apply Filters</button>
       </div>
 
       <div className="table-card">
@@ -1,35 +1,66 @@
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { Link, useParams } from "react-router-dom";
-import { apiGet } from "../api/client";
+import { API_BASE } from "../api/client";
+
+// Keep the page responsive on huge logs: only the tail is rendered.
+const MAX_LOG_CHARS = 2_000_000;
 
 export default function RunLiveLogPage() {
   const { runId } = useParams();
   const [logText, setLogText] = useState("");
   const [error, setError] = useState("");
-  const [autoRefresh, setAutoRefresh] = useState(true);
-
-  async function loadLog() {
-    if (!runId) return;
-    try {
-      const res = await apiGet<{ log: string }>(`/runs/${runId}/log`);
-      setLogText(res.log || "");
-      setError("");
-    } catch (e: any) {
-      setError(String(e?.message || e));
-    }
-  }
+  const [following, setFollowing] = useState(true);
+  const [finalStatus, setFinalStatus] = useState("");
+  // Byte offset of everything received so far; a paused stream resumes from here.
+  const offsetRef = useRef(0);
+  const textRef = useRef<HTMLTextAreaElement | null>(null);
 
   useEffect(() => {
-    loadLog();
-    // eslint-disable-next-line react-hooks/exhaustive-deps
+    offsetRef.current = 0;
+    setLogText("");
+    setFinalStatus("");
   }, [runId]);
 
   useEffect(() => {
-    if (!autoRefresh) return;
-    const t = setInterval(loadLog, 3000);
-    return () => clearInterval(t);
-    // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, [autoRefresh, runId]);
+    if (!runId || !following || finalStatus) return;
+
+    const es = new EventSource(`${API_BASE}/runs/${runId}/log/stream?offset=${offsetRef.current}`);
+
+    es.addEventListener("log", (ev) => {
+      const msg = JSON.parse((ev as MessageEvent).data) as { text: string; offset: number };
+      offsetRef.current = msg.offset;
+      setLogText((prev) => {
+        const next = prev + msg.text;
+        return next.length > MAX_LOG_CHARS ? next.slice(next.length - MAX_LOG_CHARS) : next;
+      });
+      setError("");
+    });
+
+    es.addEventListener("reset", () => {
+      offsetRef.current = 0;
+      setLogText("");
+    });
+
+    es.addEventListener("end", (ev) => {
+      const msg = JSON.parse((ev as MessageEvent).data) as { status: string | null; offset: number };
+      offsetRef.current = msg.offset;
+      setFinalStatus(msg.status || "finished");
+      es.close();
+    });
+
+    es.onerror = () => {
+      // EventSource reconnects by itself (resuming via Last-Event-ID).
+      if (es.readyState === EventSource.CLOSED) setError("Log stream closed");
+      else setError("Log stream interrupted, reconnecting...");
+    };
+
+    return () => es.close();
+  }, [runId, following, finalStatus]);
+
+  useEffect(() => {
+    const el = textRef.current;
+    if (el && following) el.scrollTop = el.scrollHeight;
+  }, [logText, following]);
 
   return (
     <div style={{ display: "grid", gap: 10 }}>
@@ -40,16 +71,19 @@ export default function RunLiveLogPage() {
 
       <div style={{ fontSize: 12, color: "#666" }}>
         Run ID: <code>{runId || "-"}</code>
+        {finalStatus && <> · finished: <b>{finalStatus}</b></>}
       </div>
 
       <div style={{ display: "flex", gap: 8 }}>
-        <button onClick={loadLog}>Refresh now</button>
-        <button onClick={() => setAutoRefresh((v) => !v)}>{autoRefresh ? "Pause auto refresh" : "Resume auto refresh"}</button>
+        <button onClick={() => setFollowing((v) => !v)} disabled={!!finalStatus}>
+          {following ? "Pause live log" : "Resume live log"}
+        </button>
       </div>
 
-      {error && <div style={{ color: "#b91c1c" }}>{error}</div>}
+      {error && !finalStatus && <div style={{ color: "#b91c1c" }}>{error}</div>}
 
       <textarea
+        ref={textRef}
         readOnly
         value={logText}
         style={{
@@ -65,4 +99,3 @@ export default function RunLiveLogPage() {
     </div>
   );
 }
-